@@ -0,0 +1,88 @@
+"""アンケート回答の同時書き込みスループットを、旧方式 (呼び出しごとに接続 +
+プロセス内ロック + 既定のジャーナル) と現在の db.py (スレッドごとの接続 + WAL) で比較する。
+
+    python -m benchmarks.bench_db [スレッド数] [1 スレッドあたりの書き込み数]
+"""
+import datetime as _dt
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+os.environ.setdefault("SURVEY_DB_PATH", os.path.join(tempfile.mkdtemp(), "survey.db"))
+
+from oncall_app import db  # noqa: E402
+
+
+def legacy_upsert_factory(path: Path):
+    lock = threading.Lock()
+
+    def connect():
+        conn = sqlite3.connect(str(path))
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA foreign_keys = ON")
+        return conn
+
+    with connect() as conn:
+        conn.executescript(
+            """
+            CREATE TABLE surveys (id TEXT PRIMARY KEY);
+            CREATE TABLE survey_responses (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                survey_id TEXT NOT NULL,
+                doctor TEXT NOT NULL,
+                blocked TEXT NOT NULL,
+                submitted_at TEXT NOT NULL,
+                FOREIGN KEY (survey_id) REFERENCES surveys(id) ON DELETE CASCADE
+            );
+            CREATE INDEX idx_responses_survey ON survey_responses(survey_id);
+            INSERT INTO surveys VALUES ('s');
+            """
+        )
+
+    def upsert(survey_id, doctor, blocked):
+        with lock, connect() as conn:
+            conn.execute(
+                "DELETE FROM survey_responses WHERE survey_id = ? AND doctor = ?",
+                (survey_id, doctor),
+            )
+            conn.execute(
+                "INSERT INTO survey_responses (survey_id, doctor, blocked, submitted_at) "
+                "VALUES (?, ?, ?, ?)",
+                (survey_id, doctor, json.dumps(blocked), _dt.datetime.utcnow().isoformat()),
+            )
+
+    return upsert
+
+
+def run(upsert, survey_id, threads, per_thread):
+    def worker(k):
+        for n in range(per_thread):
+            upsert(survey_id, f"医師{k}", [f"2024-06-{n % 28 + 1:02d}|DAY"])
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as ex:
+        list(ex.map(worker, range(threads)))
+    return threads * per_thread / (time.perf_counter() - t0)
+
+
+def main(threads=8, per_thread=200):
+    legacy = legacy_upsert_factory(Path(tempfile.mkdtemp()) / "legacy.db")
+    db.init_db()
+    db.create_survey("bench", "bench", 2024, 6, [f"医師{k}" for k in range(threads)], 5, 8)
+    old = run(legacy, "s", threads, per_thread)
+    new = run(db.upsert_response, "bench", threads, per_thread)
+    print(f"threads={threads} writes/thread={per_thread}")
+    print(f"legacy (connect + lock) : {old:8.0f} writes/s")
+    print(f"pooled (WAL)            : {new:8.0f} writes/s")
+    print(f"speedup                 : {new / old:8.1f}x")
+
+
+if __name__ == "__main__":
+    args = [int(a) for a in sys.argv[1:3]]
+    main(*args)
@@ -0,0 +1,65 @@
+"""病院全体 (複数病棟・50〜200 名) のシフト作成を、病棟を順に解く場合と
+プロセスプールで同時に解く場合で比べる。
+
+    python -m benchmarks.bench_department [--solver repair] [--workers N]
+
+各病棟は 8 名。2 割の医師を「非常勤」グループ (休日日直なし・平日宿直 1 枠)、
+1 割を個別に平日宿直 3 枠とし、不可枠は 15% の確率で固定シードから作る。
+"""
+import argparse
+import os
+import random
+import time
+
+from oncall_app.scheduler import generate_shift_slots, make_department_schedule
+
+SIZES = (50, 100, 200)
+WARD_SIZE = 8
+
+
+def hospital(n_docs, seed=1):
+    rng = random.Random(seed)
+    slots = generate_shift_slots(2024, 6)
+    doctors = [f"医師{i:03d}" for i in range(n_docs)]
+    wards = {
+        f"病棟{w:02d}": doctors[w * WARD_SIZE:(w + 1) * WARD_SIZE]
+        for w in range(-(-n_docs // WARD_SIZE))
+    }
+    groups = {
+        "非常勤": {"doctors": doctors[::5], "quota": {"WE_DAY": 0, "WE_NIGHT": 1, "WD_NIGHT": 1}},
+    }
+    quotas = {doc: {"WD_NIGHT": 3} for doc in doctors[3::10]}
+    unavailable = {doc: {s for s in slots if rng.random() < 0.15} for doc in doctors}
+    return wards, unavailable, quotas, groups
+
+
+def run(n_docs, workers, solver):
+    wards, unavailable, quotas, groups = hospital(n_docs)
+    t0 = time.perf_counter()
+    try:
+        out = make_department_schedule(
+            2024, 6, wards, unavailable, quotas=quotas, groups=groups, workers=workers, solver=solver,
+        )
+        rows = sum(len(v) for v in out.values())
+    except RuntimeError as e:
+        rows = f"失敗 ({getattr(e, 'ward', '?')})"
+    return time.perf_counter() - t0, len(wards), rows
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--solver", default="repair")
+    ap.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    args = ap.parse_args(argv)
+    print(f"solver={args.solver} cpu_count={os.cpu_count()}")
+    for n in SIZES:
+        seq, wards, rows = run(n, 1, args.solver)
+        par, _, _ = run(n, args.workers, args.solver)
+        print(
+            f"{n:4d} 名 / {wards:2d} 病棟  rows={rows}  順に: {seq * 1e3:8.1f} ms  "
+            f"同時 (workers={args.workers}): {par * 1e3:8.1f} ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""複数か月のシフト表を、make_horizon_schedule 1 回と、make_schedule を月ごとに
+N 回 (前月の最終勤務は手で history に渡す) 呼ぶ方式で比較する。
+
+    python -m benchmarks.bench_horizon [医師数] [ソルバー]
+
+make_horizon_schedule もまず月ごとに前月の最終勤務を引き継いで順に解くので、行き詰まらない限り
+中身は independent と同じ処理になる。3 方式とも同じソルバーで解き、祝日・枠の表のキャッシュは
+各方式の計測前に 1 回だけ空にする。
+joint は期間全体を 1 つの問題として解いた場合 (行き詰まり時の予備経路) の参考値。
+"""
+import sys
+import time
+
+from oncall_app import holiday_utils, scheduler
+from oncall_app.scheduler import last_shifts, make_horizon_schedule, make_schedule, month_range
+
+
+def cold():
+    if hasattr(holiday_utils.year_holidays, "cache_clear"):
+        holiday_utils.year_holidays.cache_clear()
+    holiday_utils.month_weeks.cache_clear()
+    scheduler._month_slots.cache_clear()
+
+
+def independent(year, month, months, doctors, solver):
+    rows, history = [], None
+    for y, m in month_range(year, month, months):
+        part = make_schedule(y, m, doctors, {}, solver=solver, history=history)
+        rows += part
+        history = last_shifts(rows)
+    return rows
+
+
+def horizon(year, month, months, doctors, solver):
+    return make_horizon_schedule(year, month, months, doctors, {}, solver=solver)
+
+
+def joint(year, month, months, doctors, solver):
+    return scheduler._schedule(
+        month_range(year, month, months), doctors, {}, 30000, 42, 5, 8, solver, 1, None,
+    )
+
+
+def bench(fn, months, doctors, solver, repeat=5):
+    """キャッシュを空にしてからの 1 回を repeat 回測った最小値"""
+    best, n = float("inf"), 0
+    for _ in range(repeat):
+        cold()
+        t0 = time.perf_counter()
+        try:
+            n = len(fn(2024, 4, months, doctors, solver))
+        except RuntimeError:
+            n = 0
+        best = min(best, time.perf_counter() - t0)
+    return best, n
+
+
+def main(n_docs=4, solver="repair"):
+    doctors = [f"医師{i}" for i in range(n_docs)]
+    print(f"doctors={n_docs} solver={solver}")
+    bench(independent, 1, doctors, solver, repeat=1)  # import や初回のウォームアップ
+    for months in (3, 6, 12):
+        line = [f"{months:2d} か月"]
+        for fn in (independent, horizon, joint):
+            t, n = bench(fn, months, doctors, solver)
+            line.append(f"{fn.__name__}: {t * 1e3:8.1f} ms (rows={n})")
+        print("  ".join(line))
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 4, sys.argv[2] if len(sys.argv) > 2 else "repair")
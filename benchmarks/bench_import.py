@@ -0,0 +1,61 @@
+"""oncall_app.oncall_app の import 時間と最大 RSS を新しいプロセスで計測する。
+
+    python -m benchmarks.bench_import [回数]
+
+"before" は以前の routes.py と同じく pandas を併せて import した場合の値。
+pandas が入っていない環境では "after" のみ表示する。
+"""
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+PROBE = """
+import json, resource, sys, time
+t0 = time.perf_counter()
+{extra}
+import oncall_app.oncall_app
+dt = time.perf_counter() - t0
+rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+if sys.platform == "darwin":
+    rss //= 1024
+print(json.dumps({{"seconds": dt, "rss_kb": rss}}))
+"""
+
+
+def measure(extra: str, runs: int):
+    env = dict(os.environ, SURVEY_DB_PATH=os.path.join(tempfile.mkdtemp(), "survey.db"))
+    out = []
+    for _ in range(runs):
+        res = subprocess.run(
+            [sys.executable, "-c", PROBE.format(extra=extra)],
+            capture_output=True, text=True, env=env, check=True,
+        )
+        out.append(json.loads(res.stdout))
+    return (
+        statistics.median(r["seconds"] for r in out),
+        statistics.median(r["rss_kb"] for r in out),
+    )
+
+
+def main(runs=5):
+    after = measure("", runs)
+    try:
+        import pandas  # noqa: F401
+    except ImportError:
+        before = None
+    else:
+        before = measure("import pandas", runs)
+    print(f"runs={runs} (median)")
+    if before:
+        print(f"before (with pandas): {before[0] * 1000:7.1f} ms  {before[1] / 1024:6.1f} MiB")
+    print(f"after                : {after[0] * 1000:7.1f} ms  {after[1] / 1024:6.1f} MiB")
+    if before:
+        print(f"saved                : {(before[0] - after[0]) * 1000:7.1f} ms  "
+              f"{(before[1] - after[1]) / 1024:6.1f} MiB")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 5)
@@ -0,0 +1,88 @@
+"""回答の一括登録が続けて届いている間の、イベントループの遅れを測る負荷試験。
+
+    python -m benchmarks.bench_loop_latency [同時リクエスト数] [1 リクエストの医師数]
+
+アプリに httpx の ASGITransport で POST /api/surveys/{id}/responses/bulk を 2 ms おきに送り
+(応答を待たずに次を送るので、書き込みが重なる)、その間 1 ms ごとに起きるタイマーが
+どれだけ遅れたか (p50 / p99 / 最大) を表示する。
+全リクエストを同時に送ると、SQLite と関係のない JSON の検証がまとめて走る分の遅れが混ざるのでずらしている。
+inline はハンドラの中で SQLite を直接呼ぶ従来の動き (adb の実行先をイベントループに差し替える)、
+adb は現在の実装 (読み取り・書き込み用のスレッドで実行)。
+"""
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+os.environ.setdefault("SURVEY_DB_PATH", os.path.join(tempfile.mkdtemp(), "survey.db"))
+
+import httpx  # noqa: E402
+
+from oncall_app import adb  # noqa: E402
+from oncall_app.oncall_app import app  # noqa: E402
+
+TICK = 0.001
+INTERVAL = 0.002
+
+
+async def _inline(executor, fn, *args, **kwargs):
+    return fn(*args, **kwargs)
+
+
+async def ticker(stop: asyncio.Event, lags: list):
+    while not stop.is_set():
+        t0 = time.perf_counter()
+        await asyncio.sleep(TICK)
+        lags.append(time.perf_counter() - t0 - TICK)
+
+
+async def burst(n_requests, n_docs):
+    doctors = [f"医師{i:03d}" for i in range(n_docs)]
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        survey_id = (await client.post("/api/surveys", data={
+            "title": "bench", "year": 2024, "month": 6, "docs": ",".join(doctors),
+        })).json()["id"]
+        body = {"responses": [
+            {"doctor": d, "blocked": [f"2024-06-{k:02d}|NIGHT" for k in range(1, 11)]} for d in doctors
+        ]}
+        stop, lags = asyncio.Event(), []
+        tick = asyncio.ensure_future(ticker(stop, lags))
+        t0 = time.perf_counter()
+        pending = []
+        for _ in range(n_requests):
+            pending.append(asyncio.ensure_future(
+                client.post(f"/api/surveys/{survey_id}/responses/bulk", json=body),
+            ))
+            await asyncio.sleep(INTERVAL)
+        res = await asyncio.gather(*pending)
+        elapsed = time.perf_counter() - t0
+        stop.set()
+        await tick
+    assert all(r.status_code == 200 for r in res)
+    return elapsed, sorted(lags)
+
+
+def report(name, elapsed, lags):
+    p99 = lags[int(len(lags) * 0.99)]
+    print(
+        f"{name:<7}: {elapsed * 1e3:7.1f} ms  ticks={len(lags):5d}  遅れ p50={statistics.median(lags) * 1e3:6.2f} ms"
+        f"  p99={p99 * 1e3:6.2f} ms  最大={lags[-1] * 1e3:6.2f} ms"
+    )
+
+
+def main(n_requests=50, n_docs=200):
+    print(f"requests={n_requests} doctors/request={n_docs}")
+    run = adb._run
+    adb._run = _inline
+    try:
+        report("inline", *asyncio.run(burst(n_requests, n_docs)))
+    finally:
+        adb._run = run
+    report("adb", *asyncio.run(burst(n_requests, n_docs)))
+
+
+if __name__ == "__main__":
+    main(*[int(a) for a in sys.argv[1:3]])
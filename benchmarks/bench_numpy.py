@@ -0,0 +1,47 @@
+"""乱択探索 1 試行あたりの処理量を、純 Python (solver="random") と NumPy のバッチ探索
+(solver="numpy") で比較する。
+
+    python -m benchmarks.bench_numpy [試行回数]
+
+月数を増やして必要枠 (医師 × 月 × 4 枠) を大きくし、どちらも全試行が失敗する
+厳しい間隔 (4〜7 日) で回して「試行数 / 秒」を表示する。
+"""
+import sys
+import time
+
+from oncall_app import scheduler
+from oncall_app.batch_solver import solve as solve_numpy
+from oncall_app.scheduler import _solve_random, default_demand, month_range
+
+CASES = ((1, 7), (3, 7), (6, 7), (12, 7))  # (月数, 医師数)
+
+
+def problem(months, n_docs):
+    periods = month_range(2024, 4, months)
+    doctors = [f"医師{i}" for i in range(n_docs)]
+    slots = [s for y, m in periods for s in scheduler._month_slots(y, m)]
+    demand = {doc: default_demand(periods) for doc in doctors}
+    return slots, demand, {doc: set() for doc in doctors}
+
+
+def rate(fn, months, n_docs, attempts):
+    slots, demand, unavailable = problem(months, n_docs)
+    stats: dict = {}
+    t0 = time.perf_counter()
+    fn(slots, demand, unavailable, attempts, 42, 4, 7, stats=stats)
+    return stats["attempts"] / (time.perf_counter() - t0), stats["attempts"]
+
+
+def main(attempts=20000):
+    print(f"attempts<={attempts}")
+    for months, n_docs in CASES:
+        py, n_py = rate(_solve_random, months, n_docs, attempts)
+        np_, n_np = rate(solve_numpy, months, n_docs, attempts)
+        print(
+            f"{months:2d} か月 × {n_docs} 名 ({months * n_docs * 4:4d} 枠)  "
+            f"random: {py:9.0f} /s ({n_py})  numpy: {np_:9.0f} /s ({n_np})  x{np_ / py:5.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
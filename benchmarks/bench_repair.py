@@ -0,0 +1,57 @@
+"""修復型の局所探索 (solver="repair") と乱択再始動 (solver="random") を、
+bench_scenarios と同じシナリオで「評価した割当の数」(stats["states"]) で比べる。
+
+    python -m benchmarks.bench_repair [--quick] [--attempts N]
+
+states は、乱択再始動では 1 枠置くごとに 1、修復では初期解の候補と手の候補を 1 つ評価するごとに 1。
+"""
+import argparse
+import itertools
+
+from benchmarks.bench_scenarios import MATRIX, MONTHS, QUICK, SEEDS, unavailability
+from oncall_app.scheduler import make_schedule
+
+SOLVERS = ("random", "repair")
+
+
+def run(doctors, density, month, gap, solver, attempts):
+    year, mon = MONTHS[month]
+    docs = [f"医師{i}" for i in range(doctors)]
+    states, ok = 0, 0
+    for seed in SEEDS:
+        stats: dict = {}
+        try:
+            make_schedule(
+                year, mon, docs, unavailability(year, mon, docs, density, seed), attempts=attempts,
+                seed=seed, gap_lo=gap[0], gap_hi=gap[1], solver=solver, stats=stats,
+            )
+            ok += 1
+        except RuntimeError:
+            pass
+        states += stats.get("states", 0)
+    return states, ok
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--quick", action="store_true")
+    ap.add_argument("--attempts", type=int, default=5000)
+    args = ap.parse_args(argv)
+    matrix = QUICK if args.quick else MATRIX
+    totals = {s: [0, 0] for s in SOLVERS}
+    for doctors, density, month, gap in itertools.product(
+        matrix["doctors"], matrix["density"], matrix["month"], matrix["gap"],
+    ):
+        line = [f"{month:<11} d{doctors} u{int(density * 100):02d} g{gap[0]}-{gap[1]}"]
+        for solver in SOLVERS:
+            states, ok = run(doctors, density, month, gap, solver, args.attempts)
+            totals[solver][0] += states
+            totals[solver][1] += ok
+            line.append(f"{solver}: {states:8d} states {ok}/{len(SEEDS)}")
+        print("  ".join(line))
+    for solver, (states, ok) in totals.items():
+        print(f"合計 {solver:<7}: {states:10d} states  成功 {ok}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+"""集計画面のポーリング 1 回あたりの DB 読み出し時間を比べる。
+
+    python -m benchmarks.bench_results [医師数] [回数]
+
+separate: get_survey + list_responses + blocked_heatmap (従来の 3 回の読み出し)
+one_conn: 1 つの接続でまとめて読む (db._load_results、キャッシュなし)
+cached  : db.get_survey_results (回答が変わらない間はプロセス内キャッシュから返す)
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+
+os.environ.setdefault("SURVEY_DB_PATH", os.path.join(tempfile.mkdtemp(), "survey.db"))
+
+from oncall_app import db  # noqa: E402
+
+
+def setup(n_docs, seed=1):
+    rng = random.Random(seed)
+    doctors = [f"医師{i:03d}" for i in range(n_docs)]
+    db.init_db()
+    db.create_survey("bench", "bench", 2024, 6, doctors, 5, 8)
+    db.upsert_responses("bench", {
+        doc: [f"2024-06-{d:02d}|{rng.choice(('DAY', 'NIGHT'))}" for d in rng.sample(range(1, 31), 8)]
+        for doc in doctors
+    })
+
+
+def per_call(fn, n):
+    t0 = time.perf_counter()
+    for _ in range(n):
+        fn()
+    return (time.perf_counter() - t0) / n
+
+
+def main(n_docs=60, n=500):
+    setup(n_docs)
+    cases = {
+        "separate": lambda: (db.get_survey("bench"), db.list_responses("bench"), db.blocked_heatmap("bench")),
+        "one_conn": lambda: db._load_results("bench"),
+        "cached": lambda: db.get_survey_results("bench"),
+    }
+    print(f"doctors={n_docs} calls={n}")
+    for name, fn in cases.items():
+        print(f"{name:<9}: {per_call(fn, n) * 1e6:9.1f} us/call")
+
+
+if __name__ == "__main__":
+    main(*[int(a) for a in sys.argv[1:3]])
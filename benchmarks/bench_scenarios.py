@@ -0,0 +1,164 @@
+"""make_schedule のシナリオ別ベンチマーク。
+
+医師数・不可枠の密度・月 (通常月 / ゴールデンウィーク / 年末年始)・間隔・ソルバーの
+組み合わせを固定シードで回し、所要時間・試行回数・評価した割当の数・成功率を JSON に書き出す。
+保存済みのベースラインと比べて悪化したシナリオがあれば終了コード 1 で終わる。
+
+    python -m benchmarks.bench_scenarios                     # 計測してベースラインと比較
+    python -m benchmarks.bench_scenarios --quick             # 縮小版のマトリクス
+    python -m benchmarks.bench_scenarios --update-baseline   # 今回の結果をベースラインとして保存
+
+悪化の判定 (シナリオごと):
+  - 成功率がベースラインより下がった
+  - 試行回数がベースラインの (1 + --attempts-tolerance) 倍を超えた (固定シードなので環境によらない)
+  - 所要時間 (シードごとの中央値) がベースラインの --max-slowdown 倍を超え、かつ --min-ms 以上遅い
+"""
+import argparse
+import itertools
+import json
+import os
+import random
+import statistics
+import sys
+import time
+from pathlib import Path
+
+from oncall_app.scheduler import generate_shift_slots, make_schedule
+
+HERE = Path(__file__).resolve().parent
+BASELINE = HERE / "baseline_scenarios.json"
+RESULTS = HERE / "results" / "scenarios.json"
+
+MONTHS = {"normal": (2024, 6), "golden_week": (2024, 5), "new_year": (2025, 1)}
+MATRIX = {
+    "doctors": (3, 5, 7),
+    "density": (0.0, 0.15, 0.3),
+    "month": tuple(MONTHS),
+    "gap": ((5, 8), (4, 7), (6, 10)),
+    "solver": ("random", "backtrack", "repair"),
+}
+QUICK = dict(MATRIX, doctors=(3, 5), density=(0.0, 0.3), gap=((5, 8),))
+SEEDS = (1, 2, 3)
+
+
+def scenario_name(doctors, density, month, gap, solver) -> str:
+    return f"{solver}/{month}/d{doctors}/u{int(density * 100):02d}/g{gap[0]}-{gap[1]}"
+
+
+def unavailability(year, month, doctors, density, seed):
+    rng = random.Random(seed)
+    slots = generate_shift_slots(year, month)
+    return {doc: {s for s in slots if rng.random() < density} for doc in doctors}
+
+
+def run_scenario(doctors, density, month, gap, solver, seeds, attempts) -> dict:
+    year, mon = MONTHS[month]
+    docs = [f"医師{i}" for i in range(doctors)]
+    times, used, states, ok = [], [], [], 0
+    for seed in seeds:
+        unavail = unavailability(year, mon, docs, density, seed)
+        stats: dict = {}
+        t0 = time.perf_counter()
+        try:
+            make_schedule(
+                year, mon, docs, unavail, attempts=attempts, seed=seed,
+                gap_lo=gap[0], gap_hi=gap[1], solver=solver, stats=stats,
+            )
+            ok += 1
+        except RuntimeError:
+            pass
+        times.append((time.perf_counter() - t0) * 1e3)
+        used.append(stats.get("attempts", 0))
+        states.append(stats.get("states", 0))
+    return {
+        "name": scenario_name(doctors, density, month, gap, solver),
+        "params": {
+            "doctors": doctors, "density": density, "month": month,
+            "gap": list(gap), "solver": solver,
+        },
+        "wall_ms": round(statistics.median(times), 3),
+        "attempts": sum(used),
+        "states": sum(states),
+        "success_rate": round(ok / len(seeds), 4),
+    }
+
+
+def run_matrix(matrix, seeds, attempts):
+    keys = ("doctors", "density", "month", "gap", "solver")
+    for combo in itertools.product(*(matrix[k] for k in keys)):
+        yield run_scenario(*combo, seeds=seeds, attempts=attempts)
+
+
+def compare(results, baseline, max_slowdown, min_ms, attempts_tolerance):
+    """ベースラインより悪化したシナリオの (名前, 理由) のリスト"""
+    base = {r["name"]: r for r in baseline.get("scenarios", [])}
+    out = []
+    for r in results:
+        b = base.get(r["name"])
+        if b is None:
+            continue
+        if r["success_rate"] < b["success_rate"]:
+            out.append((r["name"], f"success_rate {b['success_rate']} -> {r['success_rate']}"))
+        if r["attempts"] > b["attempts"] * (1 + attempts_tolerance):
+            out.append((r["name"], f"attempts {b['attempts']} -> {r['attempts']}"))
+        if r["wall_ms"] > b["wall_ms"] * max_slowdown and r["wall_ms"] - b["wall_ms"] > min_ms:
+            out.append((r["name"], f"wall_ms {b['wall_ms']} -> {r['wall_ms']}"))
+    return out
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--quick", action="store_true", help="縮小版のマトリクスで回す")
+    ap.add_argument("--attempts", type=int, default=5000, help="1 回の make_schedule の試行回数上限")
+    ap.add_argument("--out", type=Path, default=RESULTS, help="結果の JSON の出力先")
+    ap.add_argument("--baseline", type=Path, default=BASELINE)
+    ap.add_argument("--update-baseline", action="store_true")
+    ap.add_argument("--max-slowdown", type=float, default=2.0)
+    ap.add_argument("--min-ms", type=float, default=5.0)
+    ap.add_argument("--attempts-tolerance", type=float, default=0.1)
+    args = ap.parse_args(argv)
+
+    results = []
+    for r in run_matrix(QUICK if args.quick else MATRIX, SEEDS, args.attempts):
+        results.append(r)
+        print(
+            f"{r['name']:<40} {r['wall_ms']:10.2f} ms  attempts={r['attempts']:<7} "
+            f"success={r['success_rate']:.2f}"
+        )
+    doc = {
+        "attempts": args.attempts,
+        "seeds": list(SEEDS),
+        "python": sys.version.split()[0],
+        "cpu_count": os.cpu_count(),
+        "scenarios": results,
+    }
+    args.out.parent.mkdir(parents=True, exist_ok=True)
+    args.out.write_text(json.dumps(doc, ensure_ascii=False, indent=2) + "\n", encoding="utf-8")
+    print(f"結果: {args.out}")
+
+    if args.update_baseline:
+        if args.baseline.exists():
+            # --quick で更新しても、含まれないシナリオの既存値は残す
+            old = json.loads(args.baseline.read_text(encoding="utf-8"))
+            names = {r["name"] for r in results}
+            doc["scenarios"] = [r for r in old["scenarios"] if r["name"] not in names] + results
+        args.baseline.write_text(json.dumps(doc, ensure_ascii=False, indent=2) + "\n", encoding="utf-8")
+        print(f"ベースラインを更新: {args.baseline}")
+        return 0
+
+    if not args.baseline.exists():
+        print("ベースラインがありません (--update-baseline で作成)")
+        return 0
+    baseline = json.loads(args.baseline.read_text(encoding="utf-8"))
+    if baseline.get("attempts") != args.attempts:
+        print(f"ベースラインの試行回数上限 ({baseline.get('attempts')}) と異なるため比較しません")
+        return 0
+    bad = compare(results, baseline, args.max_slowdown, args.min_ms, args.attempts_tolerance)
+    for name, why in bad:
+        print(f"悪化: {name}: {why}")
+    print(f"{len(results)} シナリオ中 {len({n for n, _ in bad})} シナリオが悪化")
+    return 1 if bad else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
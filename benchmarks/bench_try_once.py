@@ -0,0 +1,77 @@
+"""try_once 1 回あたりの所要時間を、旧実装 (ok_gap による並べ替え + 走査) と
+SlotIndex によるマスク積の実装で比較するマイクロベンチマーク。
+
+    python -m benchmarks.bench_try_once [試行回数]
+
+どちらも全試行が失敗する厳しい条件で回し、総時間 / 試行回数を表示する。
+"""
+import random
+import sys
+import time
+
+from oncall_app.scheduler import _solve_random, default_demand, generate_shift_slots, ok_gap
+
+
+def legacy_solve_random(slots, doctors, unavailable, attempts, seed, gap_lo, gap_hi):
+    random.seed(seed)
+    stock = {tp: [d for d, t in slots if t == tp] for tp in ("WE_DAY", "WE_NIGHT", "WD_NIGHT")}
+
+    def try_once():
+        pool = {k: v[:] for k, v in stock.items()}
+        for v in pool.values():
+            random.shuffle(v)
+        assign = {}
+        for doc in random.sample(doctors, len(doctors)):
+            picks = []
+            typ_list = ["WE_DAY", "WE_NIGHT", "WD_NIGHT", "WD_NIGHT"]
+            random.shuffle(typ_list)
+            for typ in typ_list:
+                cand = [
+                    d
+                    for d in pool[typ]
+                    if (d, typ) not in unavailable[doc] and ok_gap(picks + [d], gap_lo, gap_hi)
+                ]
+                if not cand:
+                    return None
+                ch = random.choice(cand)
+                picks.append(ch)
+                pool[typ].remove(ch)
+            assign[doc] = list(zip(picks, typ_list))
+        return assign
+
+    for _ in range(attempts):
+        res = try_once()
+        if res:
+            return res
+    return None
+
+
+def scenario():
+    doctors = [f"医師{i}" for i in range(7)]
+    slots = generate_shift_slots(2024, 6)
+    rng = random.Random(1)
+    unavailable = {d: {s for s in slots if rng.random() < 0.5} for d in doctors}
+    return slots, doctors, unavailable
+
+
+def bench(fn, attempts):
+    slots, doctors, unavailable = scenario()
+    if fn is _solve_random:
+        doctors = {doc: default_demand([(2024, 6)]) for doc in doctors}
+    t0 = time.perf_counter()
+    res = fn(slots, doctors, unavailable, attempts, 42, 4, 7)
+    dt = time.perf_counter() - t0
+    return dt / attempts, res is not None
+
+
+def main(attempts=5000):
+    old, old_ok = bench(legacy_solve_random, attempts)
+    new, new_ok = bench(_solve_random, attempts)
+    print(f"attempts={attempts}")
+    print(f"legacy (ok_gap)  : {old * 1e6:8.1f} us/attempt  found={old_ok}")
+    print(f"SlotIndex (mask) : {new * 1e6:8.1f} us/attempt  found={new_ok}")
+    print(f"speedup          : {old / new:8.1f}x")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 5000)
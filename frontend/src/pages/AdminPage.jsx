@@ -4,6 +4,7 @@ import { Link } from 'react-router-dom'
 export default function AdminPage() {
   const today = new Date()
   const [surveys, setSurveys] = useState([])
+  const [nextCursor, setNextCursor] = useState(null)
   const [loading, setLoading] = useState(false)
   const [error, setError] = useState('')
   const [title, setTitle] = useState('')
@@ -17,6 +18,14 @@ export default function AdminPage() {
     const res = await fetch('/api/surveys')
     const data = await res.json()
     setSurveys(data.surveys || [])
+    setNextCursor(data.next_cursor || null)
+  }
+
+  async function loadMore() {
+    const res = await fetch(`/api/surveys?cursor=${encodeURIComponent(nextCursor)}`)
+    const data = await res.json()
+    setSurveys(prev => [...prev, ...(data.surveys || [])])
+    setNextCursor(data.next_cursor || null)
   }
 
   useEffect(() => { refresh() }, [])
@@ -144,6 +153,9 @@ export default function AdminPage() {
             ))}
           </tbody>
         </table>
+        {nextCursor && (
+          <button type="button" onClick={loadMore}>さらに表示</button>
+        )}
       </section>
     </div>
   )
@@ -1,5 +1,6 @@
 import { useEffect, useState } from 'react'
 import { Link, useNavigate, useParams } from 'react-router-dom'
+import { postScheduleStream, progressLabel } from '../scheduleStream'
 
 const WEEKDAY_LABELS = ['日', '月', '火', '水', '木', '金', '土']
 
@@ -12,6 +13,8 @@ export default function AdminResultsPage() {
   const [gapLo, setGapLo] = useState(null)
   const [gapHi, setGapHi] = useState(null)
   const [scheduleError, setScheduleError] = useState('')
+  const [progress, setProgress] = useState(null)
+  const [saved, setSaved] = useState(null)
 
   useEffect(() => {
     (async () => {
@@ -24,16 +27,19 @@ export default function AdminResultsPage() {
       setData(json)
       setGapLo(json.survey.gap_lo)
       setGapHi(json.survey.gap_hi)
+      const prev = await fetch(`/api/surveys/${id}/schedule`)
+      if (prev.ok) setSaved(await prev.json())
     })()
   }, [id])
 
   if (error) return <div><p className="error">{error}</p><Link to="/admin">← 管理画面へ</Link></div>
   if (!data) return <div>読み込み中...</div>
 
-  const { survey, responses, pending } = data
+  const { survey, responses, pending, heatmap } = data
   const { year, month, docs, weeks } = survey
 
-  // 集計: dateKey|tag -> [doctor,...]
+  // 人数はサーバー側の集計 (heatmap) を使い、医師名 (ツールチップ) だけここで引く
+  // dateKey|tag -> [doctor,...]
   const agg = {}
   for (const r of responses) {
     for (const item of r.blocked) {
@@ -61,23 +67,16 @@ export default function AdminResultsPage() {
   async function generateSchedule() {
     setGenerating(true)
     setScheduleError('')
-    const unavailParts = []
-    for (const r of responses) {
-      for (const item of r.blocked) {
-        unavailParts.push(`${r.doctor}|${item}`)
-      }
-    }
+    setProgress(null)
+    // 入れない枠はサーバーが保存済みの回答から組み立てるので、送るのは間隔だけ
     const form = new FormData()
-    form.append('year', year)
-    form.append('month', month)
-    form.append('docs', docs.join(','))
-    form.append('unavail', unavailParts.join(','))
     form.append('gap_lo', gapLo)
     form.append('gap_hi', gapHi)
     try {
-      const res = await fetch('/api/schedule', { method: 'POST', body: form })
-      const d = await res.json()
-      if (d.error) {
+      const d = await postScheduleStream(form, setProgress, undefined, `/api/surveys/${id}/schedule/stream`)
+      if (d.unfilled) {
+        navigate('/schedule', { state: { year, month, ...d } })
+      } else if (d.error) {
         setScheduleError(d.error)
       } else {
         navigate('/schedule', { state: d })
@@ -109,20 +108,21 @@ export default function AdminResultsPage() {
               {week.map((day, di) => {
                 const dayBlocked = day.in_month ? blockedFor(day.date, 'DAY') : []
                 const nightBlocked = day.in_month ? blockedFor(day.date, 'NIGHT') : []
+                const counts = (day.in_month && heatmap[day.date]) || {}
                 return (
                   <td key={di} className={cellClass(day)}>
                     {day.in_month && (
                       <div className="cell-inner">
                         <span className="day-num">{day.day}</span>
                         <div style={{ fontSize: '0.7em', textAlign: 'left', width: '100%' }}>
-                          {!isWeekday(day) && dayBlocked.length > 0 && (
+                          {!isWeekday(day) && counts.DAY > 0 && (
                             <div title={dayBlocked.join(', ')} style={{ color: '#d9534f' }}>
-                              昼×{dayBlocked.length}
+                              昼×{counts.DAY}
                             </div>
                           )}
-                          {nightBlocked.length > 0 && (
+                          {counts.NIGHT > 0 && (
                             <div title={nightBlocked.join(', ')} style={{ color: '#0275d8' }}>
-                              夜×{nightBlocked.length}
+                              夜×{counts.NIGHT}
                             </div>
                           )}
                         </div>
@@ -178,8 +178,14 @@ export default function AdminResultsPage() {
           </p>
         )}
         <button type="button" disabled={generating} onClick={generateSchedule}>
-          {generating ? '作成中...' : 'この結果でシフト作成'}
+          {generating ? progressLabel(progress) : 'この結果でシフト作成'}
         </button>
+        {saved && (
+          <p style={{ margin: 0 }}>
+            前回作成したシフト表 ({saved.created_at} UTC・間隔 {saved.gap_lo}〜{saved.gap_hi} 日):{' '}
+            <a href={`/api/surveys/${id}/schedule/csv`}>CSV ダウンロード</a>
+          </p>
+        )}
       </div>
     </div>
   )
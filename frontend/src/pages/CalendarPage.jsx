@@ -1,5 +1,6 @@
 import { useState } from 'react'
 import { useNavigate, useLocation } from 'react-router-dom'
+import { postScheduleStream, progressLabel } from '../scheduleStream'
 
 const WEEKDAY_LABELS = ['日', '月', '火', '水', '木', '金', '土']
 
@@ -12,6 +13,7 @@ export default function CalendarPage() {
   const [blocked, setBlocked] = useState(new Set())
   const [loading, setLoading] = useState(false)
   const [error, setError] = useState('')
+  const [progress, setProgress] = useState(null)
 
   if (!state) {
     navigate('/')
@@ -47,6 +49,7 @@ export default function CalendarPage() {
     e.preventDefault()
     setLoading(true)
     setError('')
+    setProgress(null)
     const form = new FormData()
     form.append('year', year)
     form.append('month', month)
@@ -55,9 +58,10 @@ export default function CalendarPage() {
     form.append('gap_lo', gap_lo)
     form.append('gap_hi', gap_hi)
     try {
-      const res = await fetch('/api/schedule', { method: 'POST', body: form })
-      const data = await res.json()
-      if (data.error) {
+      const data = await postScheduleStream(form, setProgress)
+      if (data.unfilled) {
+        navigate('/schedule', { state: { year, month, ...data } })
+      } else if (data.error) {
         setError(data.error)
       } else {
         navigate('/schedule', { state: data })
@@ -116,7 +120,7 @@ export default function CalendarPage() {
         </table>
         <br />
         <button type="submit" disabled={loading} style={{ marginTop: 15 }}>
-          {loading ? '作成中...' : 'スケジュール作成'}
+          {loading ? progressLabel(progress) : 'スケジュール作成'}
         </button>
       </form>
     </div>
@@ -16,16 +16,18 @@ export default function IndexPage() {
     e.preventDefault()
     setLoading(true)
     setError('')
-    const form = new FormData()
-    form.append('year', year)
-    form.append('month', month)
-    form.append('docs', docs)
-    form.append('gap_lo', gapLo)
-    form.append('gap_hi', gapHi)
     try {
-      const res = await fetch('/api/calendar', { method: 'POST', body: form })
-      const data = await res.json()
-      navigate('/calendar', { state: data })
+      // 週データは年月だけで決まるので GET で取り、ブラウザの HTTP キャッシュ (ETag) に任せる
+      const res = await fetch(`/api/calendar/${year}/${month}`)
+      if (!res.ok) throw new Error(`HTTP ${res.status}`)
+      const { weeks } = await res.json()
+      const docList = docs.split(',').map(d => d.trim()).filter(Boolean)
+      navigate('/calendar', {
+        state: {
+          year: Number(year), month: Number(month), docs: docList, weeks,
+          gap_lo: Number(gapLo), gap_hi: Number(gapHi),
+        },
+      })
     } catch (err) {
       setError('エラーが発生しました: ' + err.message)
     } finally {
@@ -1,5 +1,12 @@
 import { useLocation, useNavigate } from 'react-router-dom'
 
+const REASON_LABELS = { unavailable: '入れない日', history: '前回の勤務から近い', gap: '間隔' }
+
+function blockedLabel(blocked) {
+  if (blocked.length === 0) return '空き枠なし'
+  return blocked.map(b => `${b.date.slice(5)} ${REASON_LABELS[b.reason] ?? b.reason}`).join('、')
+}
+
 export default function SchedulePage() {
   const { state } = useLocation()
   const navigate = useNavigate()
@@ -9,12 +16,22 @@ export default function SchedulePage() {
     return null
   }
 
-  const { year, month, rows, tok } = state
+  const { year, month, rows, tok, unfilled, error } = state
 
   return (
     <div>
       <h2>{year}年{month}月 シフト表</h2>
-      <p><a href={`/csv?tok=${tok}`}>CSV ダウンロード</a></p>
+      {tok && <p><a href={`/csv?tok=${tok}`}>CSV ダウンロード</a></p>}
+      {unfilled?.length > 0 && (
+        <div className="error">
+          <p>{error} 以下の枠は手作業で調整してください。</p>
+          <ul>
+            {unfilled.map((u, i) => (
+              <li key={i}>{u.doctor}: {u.shift} ({blockedLabel(u.blocked)})</li>
+            ))}
+          </ul>
+        </div>
+      )}
       <table className="schedule-table">
         <thead>
           <tr>
@@ -0,0 +1,31 @@
+// /api/schedule/stream (または同じイベントを送る url) に POST し、Server-Sent Events を読みながら進捗を通知する。
+// 戻り値は done イベントの結果 (エラー時は { error } )。signal で中断するとサーバ側の探索も止まる。
+export async function postScheduleStream(form, onProgress, signal, url = '/api/schedule/stream') {
+  const res = await fetch(url, { method: 'POST', body: form, signal })
+  if (!res.ok) {
+    return await res.json()
+  }
+  const reader = res.body.getReader()
+  const decoder = new TextDecoder()
+  let buf = ''
+  for (;;) {
+    const { value, done } = await reader.read()
+    if (done) break
+    buf += decoder.decode(value, { stream: true })
+    let sep
+    while ((sep = buf.indexOf('\n\n')) >= 0) {
+      const chunk = buf.slice(0, sep)
+      buf = buf.slice(sep + 2)
+      const event = chunk.match(/^event: (.*)$/m)?.[1]
+      const data = JSON.parse(chunk.match(/^data: (.*)$/m)?.[1] ?? 'null')
+      if (event === 'progress') onProgress?.(data)
+      if (event === 'done') return data
+      if (event === 'error') return data
+    }
+  }
+  return { error: '接続が切れました。' }
+}
+
+export function progressLabel(p) {
+  return p ? `作成中... (試行 ${p.attempts} 回 / 最大 ${p.depth}/${p.total} 枠)` : '作成中...'
+}
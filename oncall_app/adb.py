@@ -0,0 +1,66 @@
+"""db モジュールの非同期版。SQLite の呼び出しをイベントループの外の専用スレッドで実行する。
+
+読み取りは SURVEY_DB_READERS 本 (既定 4) のスレッドで並行に、書き込みは 1 本のスレッドで順に行う。
+SQLite の書き込みはどのみち 1 つずつなので、書き込みスレッドを増やしても busy_timeout で待つだけになる。
+同時に走る SQLite 操作はスレッド数で頭打ちになり、残りはイベントループを止めずに順番を待つ。
+各スレッドは db._connect() のスレッドごとの接続を使い回す。
+
+    survey = await adb.get_survey(survey_id)
+    history = await adb.read(some_sync_fn, ...)  # 複数の db 呼び出しをまとめて 1 回で渡す
+"""
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial, wraps
+from typing import Any, Callable, Dict, Optional
+
+from . import db
+
+READERS = int(os.environ.get("SURVEY_DB_READERS", "4"))
+
+_readers = ThreadPoolExecutor(max_workers=max(1, READERS), thread_name_prefix="db-read")
+_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-write")
+
+
+async def _run(executor: ThreadPoolExecutor, fn: Callable, *args, **kwargs) -> Any:
+    return await asyncio.get_running_loop().run_in_executor(executor, partial(fn, *args, **kwargs))
+
+
+async def read(fn: Callable, *args, **kwargs) -> Any:
+    """読み取りだけの同期関数を読み取りスレッドで実行する"""
+    return await _run(_readers, fn, *args, **kwargs)
+
+
+async def write(fn: Callable, *args, **kwargs) -> Any:
+    """書き込む同期関数を書き込みスレッドで実行する"""
+    return await _run(_writer, fn, *args, **kwargs)
+
+
+def _offload(executor: ThreadPoolExecutor, name: str) -> Callable:
+    # 呼び出しのたびに db から引く (テストで db の関数を差し替えられるように)
+    @wraps(getattr(db, name))
+    async def wrapper(*args, **kwargs):
+        return await _run(executor, getattr(db, name), *args, **kwargs)
+    return wrapper
+
+
+get_survey = _offload(_readers, "get_survey")
+list_surveys = _offload(_readers, "list_surveys")
+get_response = _offload(_readers, "get_response")
+get_survey_schedule = _offload(_readers, "get_survey_schedule")
+open_csv_token = _offload(_readers, "open_csv_token")
+
+create_survey = _offload(_writer, "create_survey")
+delete_survey = _offload(_writer, "delete_survey")
+upsert_response = _offload(_writer, "upsert_response")
+upsert_responses = _offload(_writer, "upsert_responses")
+
+_load_survey_results = _offload(_readers, "get_survey_results")
+
+
+async def get_survey_results(survey_id: str) -> Optional[Dict[str, Any]]:
+    """キャッシュにあれば SQLite を読まないので、スレッドに渡さずそのまま返す"""
+    hit = db.cached_survey_results(survey_id)
+    if hit is not None:
+        return hit
+    return await _load_survey_results(survey_id)
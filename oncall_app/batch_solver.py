@@ -0,0 +1,152 @@
+"""NumPy で多数の乱択割当をまとめて作る探索 (solver="numpy")。
+
+枠は区分 (月, シフト種別) ごとの日番号 (toordinal) の配列、医師の可否は区分ごとの
+真偽値配列で持つ。1 バッチ分の候補を同時に作り、必要枠 1 つごとに
+「空き & 可否 & 間隔」のマスクを (候補数, 区分の枠数) の配列演算で求めてから
+乱数で 1 枠ずつ選ぶ。行き詰まった候補は捨て、生き残りが半分を切ったら配列を詰める。
+最後に医師・月ごとの勤務日を並べ替え、差分 (np.diff) で間隔 [gap_lo, gap_hi] を検証する。
+
+numpy は起動時には読み込まない (scheduler から solver="numpy" のときだけ import される)。
+"""
+import datetime as _dt
+from typing import Dict, List
+
+import numpy as np
+
+from .scheduler import _cat
+
+# 1 バッチの候補数。易しい問題で無駄に作りすぎないよう BATCH から倍々に MAX_BATCH まで増やす
+BATCH = 256
+MAX_BATCH = 4096
+
+
+def _prepare(slots, demand, unavailable, gap_lo, history):
+    """全枠の日番号 (S,)、区分ごとの列番号、医師・区分ごとの可否 (区分の枠数,)"""
+    order = sorted(slots)
+    ords = np.array([d.toordinal() for d, _ in order], dtype=np.int64)
+    cols: Dict[tuple, list] = {}
+    for i, (d, tp) in enumerate(order):
+        cols.setdefault(_cat(d, tp), []).append(i)
+    cols = {c: np.array(v, dtype=np.int64) for c, v in cols.items()}
+    avail = {}
+    for doc in demand:
+        floor = history[doc].toordinal() + gap_lo if history and doc in history else None
+        ok = np.array([s not in unavailable.get(doc, ()) for s in order], dtype=bool)
+        if floor is not None:
+            ok &= ords >= floor
+        avail[doc] = {c: ok[ix] for c, ix in cols.items()}
+    return ords, cols, avail
+
+
+def solve(slots, demand, unavailable, attempts, seed, gap_lo, gap_hi, stop=None, history=None, stats=None,
+          progress=None):
+    rng = np.random.default_rng(seed)
+    ords, cols, avail = _prepare(slots, demand, unavailable, gap_lo, history)
+    doctors = list(demand)
+    by_period = {
+        doc: [[c for c in cats if c[0] == p] for p in sorted({c[0] for c in cats})]
+        for doc, cats in demand.items()
+    }
+    stats = {} if stats is None else stats
+    stats["attempts"] = stats["depth"] = 0
+    stats["partial"] = {}
+    failures = stats["failures"] = {}
+
+    batch = BATCH
+    while stats["attempts"] < attempts:
+        if stop is not None and stop():
+            return None
+        size = min(batch, attempts - stats["attempts"])
+        batch = min(batch * 2, MAX_BATCH)
+        stats["attempts"] += size
+        # 医師の順と月内の枠の順はバッチごとに乱択する (バッチ内の候補はすべて同じ順で埋める)
+        units = []
+        for i in rng.permutation(len(doctors)):
+            doc = doctors[i]
+            for group in by_period[doc]:
+                units += [(doc, group[j]) for j in rng.permutation(len(group))]
+        found = _run_batch(rng, size, units, ords, cols, avail, gap_lo, gap_hi, stats, failures)
+        if found is not None:
+            return found
+        if progress is not None:
+            progress(stats["attempts"], stats["depth"])
+    return None
+
+
+def _run_batch(rng, size, units, ords, cols, avail, gap_lo, gap_hi, stats, failures):
+    taken = np.zeros((size, len(ords)), dtype=bool)
+    picked = np.zeros((size, len(units)), dtype=np.int64)  # 列 k は units[k] に選んだ日番号
+    alive = np.ones(size, dtype=bool)
+    start = 0  # 今の (医師, 月) の最初の枠の units 上の位置
+    floor = None  # 同じ医師の前月の最終勤務 + gap_lo
+    for k, (doc, c) in enumerate(units):
+        if k and units[k - 1][0] != doc:
+            start, floor = k, None
+        elif k and units[k - 1][1][0] != c[0]:
+            floor = picked[:, start:k].max(axis=1)[:, None] + gap_lo
+            start = k
+        ix = cols[c]
+        d = ords[ix][None, :]
+        mask = avail[doc][c][None, :] & ~taken[:, ix] & alive[:, None]
+        if floor is not None:
+            mask &= d >= floor
+        if k > start:
+            month = picked[:, start:k]
+            first, last = month.min(axis=1)[:, None], month.max(axis=1)[:, None]
+            inside = (d > first) & (d < last)
+            if k - start > 1 and inside.any():
+                inside &= np.abs(d[:, :, None] - month[:, None, :]).min(axis=2) >= gap_lo
+            mask &= (
+                ((first - d >= gap_lo) & (first - d <= gap_hi))
+                | ((d - last >= gap_lo) & (d - last <= gap_hi))
+                | inside
+            )
+        ok = mask.any(axis=1)
+        dead = int((alive & ~ok).sum())
+        if dead:
+            failures[c[1]] = failures.get(c[1], 0) + dead
+        if not ok.any():
+            if k > stats["depth"]:
+                i = int(np.flatnonzero(alive)[0])
+                stats["depth"] = k
+                stats["partial"] = _assign(units[:k], picked[i, :k])
+            return None
+        # 候補の中から一様に 1 つ: 候補外の乱数キーを -1 にして最大を取る
+        keys = rng.random(mask.shape, dtype=np.float32)
+        keys[~mask] = -1.0
+        choice = keys.argmax(axis=1)
+        taken[ok, ix[choice[ok]]] = True
+        picked[:, k] = ords[ix[choice]]
+        alive = ok
+        if alive.sum() * 2 < len(alive):
+            # 生き残りが半分を切ったら行き詰まった候補を捨てて配列を詰める
+            taken, picked = taken[alive], picked[alive]
+            if floor is not None:
+                floor = floor[alive]
+            alive = alive[alive]
+    stats["depth"] = len(units)
+    valid = alive & _verify(units, picked, gap_lo, gap_hi)
+    if not valid.any():
+        return None
+    return _assign(units, picked[int(np.flatnonzero(valid)[0])])
+
+
+def _verify(units, picked, gap_lo, gap_hi) -> np.ndarray:
+    """医師・月ごとに勤務日を並べ、差分がすべて [gap_lo, gap_hi] に収まる候補"""
+    valid = np.ones(len(picked), dtype=bool)
+    groups: Dict[tuple, List[int]] = {}
+    for k, (doc, c) in enumerate(units):
+        groups.setdefault((doc, c[0]), []).append(k)
+    for ks in groups.values():
+        if len(ks) < 2:
+            continue
+        gaps = np.diff(np.sort(picked[:, ks], axis=1), axis=1)
+        valid &= ((gaps >= gap_lo) & (gaps <= gap_hi)).all(axis=1)
+    return valid
+
+
+def _assign(units, ords) -> Dict[str, list]:
+    assign: Dict[str, list] = {}
+    for (doc, c), o in zip(units, ords):
+        assign.setdefault(doc, []).append((_dt.date.fromordinal(int(o)), c[1]))
+    return assign
@@ -3,23 +3,75 @@ import os
 import sqlite3
 import threading
 import datetime as _dt
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import wraps
 from pathlib import Path
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Iterator, Optional, Tuple
+
+from .metrics import db_query_seconds
 
 _DB_PATH = Path(os.environ.get("SURVEY_DB_PATH", Path(__file__).parent.parent / "data" / "survey.db"))
-_lock = threading.Lock()
+_BUSY_TIMEOUT_MS = int(os.environ.get("SURVEY_DB_BUSY_TIMEOUT_MS", "5000"))
+_local = threading.local()
+_RESULTS_CACHE_SIZE = int(os.environ.get("SURVEY_RESULTS_CACHE_SIZE", "256"))
 
 
-def _connect() -> sqlite3.Connection:
+def _open() -> sqlite3.Connection:
     _DB_PATH.parent.mkdir(parents=True, exist_ok=True)
-    conn = sqlite3.connect(str(_DB_PATH))
+    conn = sqlite3.connect(
+        str(_DB_PATH),
+        timeout=_BUSY_TIMEOUT_MS / 1000,
+        check_same_thread=False,
+        cached_statements=256,
+    )
     conn.row_factory = sqlite3.Row
     conn.execute("PRAGMA foreign_keys = ON")
+    # WAL: 読み取りは書き込みを待たない。synchronous=NORMAL は WAL なら電源断以外で壊れない
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.execute(f"PRAGMA busy_timeout = {_BUSY_TIMEOUT_MS}")
+    return conn
+
+
+def _connect() -> sqlite3.Connection:
+    """スレッドごとに 1 本の接続を使い回す (プリペアドステートメントのキャッシュも効く)"""
+    conn = getattr(_local, "conn", None)
+    if conn is None or _local.path != _DB_PATH:
+        conn = _open()
+        _local.conn, _local.path = conn, _DB_PATH
     return conn
 
 
+def _timed(fn):
+    """関数ごとの所要時間を oncall_db_query_seconds{op="関数名"} に記録する"""
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        t0 = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            db_query_seconds.observe(time.perf_counter() - t0, op=fn.__name__)
+    return wrapper
+
+
+@contextmanager
+def _write() -> Iterator[sqlite3.Connection]:
+    """書き込みトランザクション。BEGIN IMMEDIATE で最初に書き込みロックを取り、
+    取れなければ busy_timeout まで SQLite 側で待つ (プロセス内ロックは不要)"""
+    conn = _connect()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn
+    except BaseException:
+        conn.rollback()
+        raise
+    conn.commit()
+
+
 def init_db() -> None:
-    with _lock, _connect() as conn:
+    with _connect() as conn:
         conn.executescript(
             """
             CREATE TABLE IF NOT EXISTS surveys (
@@ -30,21 +82,95 @@ def init_db() -> None:
                 docs TEXT NOT NULL,
                 gap_lo INTEGER NOT NULL DEFAULT 5,
                 gap_hi INTEGER NOT NULL DEFAULT 8,
-                created_at TEXT NOT NULL
+                created_at TEXT NOT NULL,
+                response_count INTEGER NOT NULL DEFAULT 0
             );
             CREATE TABLE IF NOT EXISTS survey_responses (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 survey_id TEXT NOT NULL,
                 doctor TEXT NOT NULL,
-                blocked TEXT NOT NULL,
                 submitted_at TEXT NOT NULL,
                 FOREIGN KEY (survey_id) REFERENCES surveys(id) ON DELETE CASCADE
             );
             CREATE INDEX IF NOT EXISTS idx_responses_survey ON survey_responses(survey_id);
+            CREATE TABLE IF NOT EXISTS survey_blocked (
+                survey_id TEXT NOT NULL,
+                doctor TEXT NOT NULL,
+                date TEXT NOT NULL,
+                tag TEXT NOT NULL,
+                PRIMARY KEY (survey_id, doctor, date, tag),
+                FOREIGN KEY (survey_id) REFERENCES surveys(id) ON DELETE CASCADE
+            );
+            CREATE INDEX IF NOT EXISTS idx_blocked_day ON survey_blocked(survey_id, date, tag);
+            -- アンケートの回答から作ったシフト表 (アンケートごとに最新の 1 件)
+            CREATE TABLE IF NOT EXISTS survey_schedules (
+                survey_id TEXT PRIMARY KEY,
+                rows TEXT NOT NULL,
+                gap_lo INTEGER NOT NULL,
+                gap_hi INTEGER NOT NULL,
+                solver TEXT NOT NULL,
+                created_at TEXT NOT NULL,
+                FOREIGN KEY (survey_id) REFERENCES surveys(id) ON DELETE CASCADE
+            );
+            CREATE TABLE IF NOT EXISTS csv_tokens (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                tok TEXT NOT NULL UNIQUE,
+                body BLOB NOT NULL,
+                created_at TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_csv_tokens_created ON csv_tokens(created_at);
+            CREATE TABLE IF NOT EXISTS schedule_cache (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                created_at TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_schedule_cache_created ON schedule_cache(created_at);
+            """
+        )
+        _migrate(conn)
+        conn.executescript(
+            """
+            CREATE INDEX IF NOT EXISTS idx_surveys_created ON surveys(created_at DESC, id DESC);
+            CREATE INDEX IF NOT EXISTS idx_surveys_month
+                ON surveys(year, month, created_at DESC, id DESC);
+            -- 一覧で回答数を数えずに済むよう surveys.response_count を維持する
+            CREATE TRIGGER IF NOT EXISTS trg_responses_insert AFTER INSERT ON survey_responses
+            BEGIN
+                UPDATE surveys SET response_count = response_count + 1 WHERE id = NEW.survey_id;
+            END;
+            CREATE TRIGGER IF NOT EXISTS trg_responses_delete AFTER DELETE ON survey_responses
+            BEGIN
+                UPDATE surveys SET response_count = response_count - 1 WHERE id = OLD.survey_id;
+            END;
             """
         )
 
 
+def _migrate(conn: sqlite3.Connection) -> None:
+    """既存 DB に後から追加した列を足す"""
+    cols = {r["name"] for r in conn.execute("PRAGMA table_info(surveys)")}
+    if "response_count" not in cols:
+        conn.execute("ALTER TABLE surveys ADD COLUMN response_count INTEGER NOT NULL DEFAULT 0")
+        conn.execute(
+            "UPDATE surveys SET response_count = "
+            "(SELECT COUNT(*) FROM survey_responses r WHERE r.survey_id = surveys.id)"
+        )
+    cols = {r["name"] for r in conn.execute("PRAGMA table_info(survey_responses)")}
+    if "blocked" in cols:
+        # 旧形式: 回答ごとに "YYYY-MM-DD|TAG" の JSON 配列 → survey_blocked の行へ
+        rows = conn.execute("SELECT survey_id, doctor, blocked FROM survey_responses").fetchall()
+        conn.executemany(
+            "INSERT OR IGNORE INTO survey_blocked (survey_id, doctor, date, tag) VALUES (?, ?, ?, ?)",
+            [
+                (r["survey_id"], r["doctor"], *item.split("|"))
+                for r in rows
+                for item in json.loads(r["blocked"])
+            ],
+        )
+        conn.execute("ALTER TABLE survey_responses DROP COLUMN blocked")
+
+
+@_timed
 def create_survey(
     survey_id: str,
     title: str,
@@ -54,7 +180,7 @@ def create_survey(
     gap_lo: int,
     gap_hi: int,
 ) -> None:
-    with _lock, _connect() as conn:
+    with _write() as conn:
         conn.execute(
             "INSERT INTO surveys (id, title, year, month, docs, gap_lo, gap_hi, created_at) "
             "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
@@ -71,6 +197,7 @@ def create_survey(
         )
 
 
+@_timed
 def get_survey(survey_id: str) -> Optional[Dict[str, Any]]:
     with _connect() as conn:
         row = conn.execute(
@@ -78,6 +205,10 @@ def get_survey(survey_id: str) -> Optional[Dict[str, Any]]:
         ).fetchone()
     if not row:
         return None
+    return _survey_row(row)
+
+
+def _survey_row(row: sqlite3.Row) -> Dict[str, Any]:
     return {
         "id": row["id"],
         "title": row["title"],
@@ -90,14 +221,39 @@ def get_survey(survey_id: str) -> Optional[Dict[str, Any]]:
     }
 
 
-def list_surveys() -> List[Dict[str, Any]]:
+@_timed
+def list_surveys(
+    limit: int = 50,
+    cursor: Optional[str] = None,
+    year: Optional[int] = None,
+    month: Optional[int] = None,
+) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """新しい順に最大 limit 件。cursor は前ページの next_cursor ("created_at|id")。
+
+    次のページがあれば 2 番目の戻り値にその cursor を返す (なければ None)。
+    """
+    where, params = [], []
+    if year is not None:
+        where.append("year = ?")
+        params.append(year)
+    if month is not None:
+        where.append("month = ?")
+        params.append(month)
+    if cursor:
+        created_at, _, last_id = cursor.partition("|")
+        if not last_id:
+            raise ValueError(f"不正なカーソル: {cursor}")
+        where.append("(created_at, id) < (?, ?)")
+        params += [created_at, last_id]
+    sql = "SELECT * FROM surveys"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += " ORDER BY created_at DESC, id DESC LIMIT ?"
     with _connect() as conn:
-        rows = conn.execute(
-            "SELECT s.*, "
-            "  (SELECT COUNT(*) FROM survey_responses r WHERE r.survey_id = s.id) AS response_count "
-            "FROM surveys s ORDER BY s.created_at DESC"
-        ).fetchall()
-    return [
+        rows = conn.execute(sql, (*params, limit + 1)).fetchall()
+    more = len(rows) > limit
+    rows = rows[:limit]
+    items = [
         {
             "id": r["id"],
             "title": r["title"],
@@ -111,58 +267,304 @@ def list_surveys() -> List[Dict[str, Any]]:
         }
         for r in rows
     ]
+    next_cursor = f"{rows[-1]['created_at']}|{rows[-1]['id']}" if more else None
+    return items, next_cursor
 
 
 def upsert_response(survey_id: str, doctor: str, blocked: List[str]) -> None:
-    with _lock, _connect() as conn:
-        conn.execute(
-            "DELETE FROM survey_responses WHERE survey_id = ? AND doctor = ?",
-            (survey_id, doctor),
+    upsert_responses(survey_id, {doctor: blocked})
+
+
+@_timed
+def upsert_responses(survey_id: str, responses: Dict[str, List[str]]) -> None:
+    """医師ごとの回答 (入れない枠 "YYYY-MM-DD|TAG" のリスト) を 1 トランザクションで上書きする"""
+    now = _dt.datetime.utcnow().isoformat(timespec="seconds")
+    keys = [(survey_id, doctor) for doctor in responses]
+    with _write() as conn:
+        conn.executemany("DELETE FROM survey_responses WHERE survey_id = ? AND doctor = ?", keys)
+        conn.executemany("DELETE FROM survey_blocked WHERE survey_id = ? AND doctor = ?", keys)
+        conn.executemany(
+            "INSERT INTO survey_responses (survey_id, doctor, submitted_at) VALUES (?, ?, ?)",
+            [(survey_id, doctor, now) for doctor in responses],
         )
-        conn.execute(
-            "INSERT INTO survey_responses (survey_id, doctor, blocked, submitted_at) "
-            "VALUES (?, ?, ?, ?)",
-            (
-                survey_id,
-                doctor,
-                json.dumps(blocked, ensure_ascii=False),
-                _dt.datetime.utcnow().isoformat(timespec="seconds"),
-            ),
+        conn.executemany(
+            "INSERT OR IGNORE INTO survey_blocked (survey_id, doctor, date, tag) VALUES (?, ?, ?, ?)",
+            [
+                (survey_id, doctor, *item.split("|"))
+                for doctor, blocked in responses.items()
+                for item in blocked
+            ],
         )
+    _invalidate_results(survey_id)
+
+
+def _blocked_by_doctor(conn: sqlite3.Connection, survey_id: str, doctor: Optional[str] = None) -> Dict[str, List[str]]:
+    sql = "SELECT doctor, date, tag FROM survey_blocked WHERE survey_id = ?"
+    params: list = [survey_id]
+    if doctor is not None:
+        sql += " AND doctor = ?"
+        params.append(doctor)
+    out: Dict[str, List[str]] = {}
+    for r in conn.execute(sql + " ORDER BY date, tag", params):
+        out.setdefault(r["doctor"], []).append(f"{r['date']}|{r['tag']}")
+    return out
 
 
+@_timed
 def get_response(survey_id: str, doctor: str) -> Optional[Dict[str, Any]]:
     with _connect() as conn:
         row = conn.execute(
             "SELECT * FROM survey_responses WHERE survey_id = ? AND doctor = ?",
             (survey_id, doctor),
         ).fetchone()
-    if not row:
-        return None
+        if not row:
+            return None
+        blocked = _blocked_by_doctor(conn, survey_id, doctor)
     return {
         "doctor": row["doctor"],
-        "blocked": json.loads(row["blocked"]),
+        "blocked": blocked.get(doctor, []),
         "submitted_at": row["submitted_at"],
     }
 
 
+@_timed
 def list_responses(survey_id: str) -> List[Dict[str, Any]]:
     with _connect() as conn:
         rows = conn.execute(
             "SELECT * FROM survey_responses WHERE survey_id = ? ORDER BY doctor",
             (survey_id,),
         ).fetchall()
+        blocked = _blocked_by_doctor(conn, survey_id)
     return [
         {
             "doctor": r["doctor"],
-            "blocked": json.loads(r["blocked"]),
+            "blocked": blocked.get(r["doctor"], []),
             "submitted_at": r["submitted_at"],
         }
         for r in rows
     ]
 
 
+@_timed
+def list_blocked(survey_id: str) -> List[Tuple[str, str, str]]:
+    """回答された入れない枠を (医師, "YYYY-MM-DD", タグ) のタプルで。文字列の組み立て・分解をしない"""
+    with _connect() as conn:
+        return [
+            tuple(r) for r in conn.execute(
+                "SELECT doctor, date, tag FROM survey_blocked WHERE survey_id = ?", (survey_id,),
+            )
+        ]
+
+
+def _heatmap(conn: sqlite3.Connection, survey_id: str) -> Dict[str, Dict[str, int]]:
+    out: Dict[str, Dict[str, int]] = {}
+    for date, tag, n in conn.execute(
+        "SELECT date, tag, COUNT(*) FROM survey_blocked "
+        "WHERE survey_id = ? GROUP BY date, tag ORDER BY date, tag",
+        (survey_id,),
+    ):
+        out.setdefault(date, {})[tag] = n
+    return out
+
+
+@_timed
+def blocked_heatmap(survey_id: str) -> Dict[str, Dict[str, int]]:
+    """日付ごと・タグ (DAY/NIGHT) ごとに入れないと回答した医師の人数"""
+    with _connect() as conn:
+        return _heatmap(conn, survey_id)
+
+
+@_timed
 def delete_survey(survey_id: str) -> bool:
-    with _lock, _connect() as conn:
+    with _write() as conn:
         cur = conn.execute("DELETE FROM surveys WHERE id = ?", (survey_id,))
-        return cur.rowcount > 0
+    _invalidate_results(survey_id)
+    return cur.rowcount > 0
+
+
+@_timed
+def put_survey_schedule(
+    survey_id: str, rows: List[Dict[str, Any]], gap_lo: int, gap_hi: int, solver: str,
+) -> bool:
+    """アンケートのシフト表を保存 (前回分は上書き)。アンケートが削除済みなら False"""
+    try:
+        with _write() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO survey_schedules "
+                "(survey_id, rows, gap_lo, gap_hi, solver, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    survey_id,
+                    json.dumps(rows, ensure_ascii=False),
+                    gap_lo,
+                    gap_hi,
+                    solver,
+                    _dt.datetime.utcnow().isoformat(timespec="seconds"),
+                ),
+            )
+    except sqlite3.IntegrityError:
+        return False
+    return True
+
+
+@_timed
+def get_survey_schedule(survey_id: str) -> Optional[Dict[str, Any]]:
+    with _connect() as conn:
+        row = conn.execute(
+            "SELECT * FROM survey_schedules WHERE survey_id = ?", (survey_id,)
+        ).fetchone()
+    if not row:
+        return None
+    return {
+        "rows": json.loads(row["rows"]),
+        "gap_lo": row["gap_lo"],
+        "gap_hi": row["gap_hi"],
+        "solver": row["solver"],
+        "created_at": row["created_at"],
+    }
+
+
+# -------------------------------------------------------------------
+# 集計結果の読み取りキャッシュ (プロセス内・アンケートごと)
+# 回答の書き込みと削除で明示的に捨てる。別プロセスの書き込みは検知しないので、
+# uvicorn を複数ワーカーで動かすときは SURVEY_RESULTS_CACHE_SIZE=0 で無効にする
+# -------------------------------------------------------------------
+
+_results_cache: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+_results_lock = threading.Lock()
+_results_epoch = 0
+
+
+def _invalidate_results(survey_id: str) -> None:
+    global _results_epoch
+    with _results_lock:
+        _results_cache.pop(survey_id, None)
+        _results_epoch += 1
+
+
+def _load_results(survey_id: str) -> Optional[Dict[str, Any]]:
+    """アンケート・回答・入れない枠・ヒートマップ (GROUP BY) を 1 つの接続で読み、集計結果の形にする"""
+    with _connect() as conn:
+        row = conn.execute("SELECT * FROM surveys WHERE id = ?", (survey_id,)).fetchone()
+        if not row:
+            return None
+        submitted = conn.execute(
+            "SELECT doctor, submitted_at FROM survey_responses WHERE survey_id = ? ORDER BY doctor",
+            (survey_id,),
+        ).fetchall()
+        blocked = _blocked_by_doctor(conn, survey_id)
+        heatmap = _heatmap(conn, survey_id)
+    responses = [
+        {"doctor": doctor, "blocked": blocked.get(doctor, []), "submitted_at": at} for doctor, at in submitted
+    ]
+    return {"survey": _survey_row(row), "responses": responses, "heatmap": heatmap}
+
+
+def cached_survey_results(survey_id: str) -> Optional[Dict[str, Any]]:
+    """キャッシュにある集計結果。なければ None (SQLite は読まない)"""
+    with _results_lock:
+        hit = _results_cache.get(survey_id)
+        if hit is not None:
+            _results_cache.move_to_end(survey_id)
+        return hit
+
+
+@_timed
+def get_survey_results(survey_id: str) -> Optional[Dict[str, Any]]:
+    """{"survey", "responses", "heatmap"}。get_survey・list_responses・blocked_heatmap と同じ形。
+    キャッシュした dict をそのまま返すので、呼び出し側で書き換えないこと"""
+    hit = cached_survey_results(survey_id)
+    if hit is not None:
+        return hit
+    with _results_lock:
+        epoch = _results_epoch
+    results = _load_results(survey_id)
+    if results is None or _RESULTS_CACHE_SIZE <= 0:
+        return results
+    with _results_lock:
+        # 読んでいる間に書き込みがあれば古いかもしれないので入れない
+        if epoch == _results_epoch:
+            _results_cache[survey_id] = results
+            while len(_results_cache) > _RESULTS_CACHE_SIZE:
+                _results_cache.popitem(last=False)
+    return results
+
+
+@_timed
+def get_cached_schedule(key: str, ttl: int) -> Optional[str]:
+    with _connect() as conn:
+        row = conn.execute(
+            "SELECT value FROM schedule_cache WHERE key = ? AND created_at >= ?", (key, _cutoff(ttl))
+        ).fetchone()
+    return row["value"] if row else None
+
+
+@_timed
+def put_cached_schedule(key: str, value: str, ttl: int, max_items: int) -> None:
+    """生成結果を保存し、期限切れと max_items を超えた古い分を削除する"""
+    with _write() as conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO schedule_cache (key, value, created_at) VALUES (?, ?, ?)",
+            (key, value, _dt.datetime.utcnow().isoformat(timespec="seconds")),
+        )
+        conn.execute("DELETE FROM schedule_cache WHERE created_at < ?", (_cutoff(ttl),))
+        # INSERT OR REPLACE は行を入れ直すので、rowid の大きい方が新しい
+        conn.execute(
+            "DELETE FROM schedule_cache WHERE rowid NOT IN "
+            "(SELECT rowid FROM schedule_cache ORDER BY rowid DESC LIMIT ?)",
+            (max_items,),
+        )
+
+
+# -------------------------------------------------------------------
+# CSV ダウンロード用トークン (複数ワーカーで共有するため DB に置く)
+# -------------------------------------------------------------------
+
+
+def _cutoff(ttl: int) -> str:
+    return (_dt.datetime.utcnow() - _dt.timedelta(seconds=ttl)).isoformat(timespec="seconds")
+
+
+@_timed
+def put_csv_token(tok: str, body: bytes, ttl: int, max_items: int) -> None:
+    """トークンを保存し、期限切れと max_items を超えた古い分を削除する"""
+    with _write() as conn:
+        conn.execute(
+            "INSERT INTO csv_tokens (tok, body, created_at) VALUES (?, ?, ?)",
+            (tok, body, _dt.datetime.utcnow().isoformat(timespec="seconds")),
+        )
+        conn.execute("DELETE FROM csv_tokens WHERE created_at < ?", (_cutoff(ttl),))
+        conn.execute(
+            "DELETE FROM csv_tokens WHERE id NOT IN "
+            "(SELECT id FROM csv_tokens ORDER BY id DESC LIMIT ?)",
+            (max_items,),
+        )
+
+
+@_timed
+def open_csv_token(tok: str, ttl: int, chunk_size: int = 64 * 1024) -> Optional[Iterator[bytes]]:
+    """有効なトークンなら本文を chunk_size ずつ返すイテレータ、無効なら None"""
+    with _connect() as conn:
+        row = conn.execute(
+            "SELECT id FROM csv_tokens WHERE tok = ? AND created_at >= ?",
+            (tok, _cutoff(ttl)),
+        ).fetchone()
+    if not row:
+        return None
+
+    def chunks() -> Iterator[bytes]:
+        # 別スレッドで少しずつ読まれるので、スレッド共有の接続ではなく専用の接続を使う
+        conn = _open()
+        try:
+            with conn.blobopen("csv_tokens", "body", row["id"], readonly=True) as blob:
+                while True:
+                    data = blob.read(chunk_size)
+                    if not data:
+                        break
+                    yield data
+        except sqlite3.OperationalError:
+            # 読み出し前に期限切れで削除された
+            return
+        finally:
+            conn.close()
+
+    return chunks()
@@ -1,10 +1,45 @@
+import calendar
 import datetime as _dt
+import os
+from functools import lru_cache
 
 try:
     import jpholiday
-    def is_holiday(day: _dt.date) -> bool: 
-        return jpholiday.is_holiday(day)
+
+    @lru_cache(maxsize=None)
+    def year_holidays(year: int) -> frozenset:
+        """その年の祝日 (振替休日・国民の休日を含む)。年ごとに 1 度だけ jpholiday に問い合わせる"""
+        return frozenset(d for d, _ in jpholiday.year_holidays(year))
 except ImportError:
     jpholiday = None
-    def is_holiday(day: _dt.date) -> bool: 
-        return False
\ No newline at end of file
+
+    def year_holidays(year: int) -> frozenset:
+        return frozenset()
+
+
+def _modified() -> str:
+    """祝日の判定に使うファイル (このモジュールと jpholiday) の最終更新時刻 (UTC)。
+    カレンダーの内容はこれと年月だけで決まるので、Last-Modified に使う"""
+    files = [__file__] + ([jpholiday.__file__] if jpholiday is not None else [])
+    mtime = max(os.path.getmtime(f) for f in files)
+    return _dt.datetime.utcfromtimestamp(int(mtime)).isoformat(timespec="seconds")
+
+
+HOLIDAYS_MODIFIED = _modified()
+
+
+def is_holiday(day: _dt.date) -> bool:
+    return day in year_holidays(day.year)
+
+
+def is_off_day(day: _dt.date) -> bool:
+    """土日祝"""
+    return day.weekday() >= 5 or is_holiday(day)
+
+
+@lru_cache(maxsize=128)
+def month_weeks(year: int, month: int) -> tuple:
+    """日曜始まりの週ごとの日付 (前後の月の日を含む)。結果は共有されるので変更しないこと"""
+    return tuple(
+        tuple(week) for week in calendar.Calendar(firstweekday=6).monthdatescalendar(year, month)
+    )
@@ -0,0 +1,132 @@
+"""HTTP キャッシュ: 条件付き GET (ETag / Last-Modified → 304) と、ビルド時に圧縮しておいた
+/assets のファイル (.br / .gz) の配信。
+
+/assets のファイル名は Vite がハッシュ付きで出力するので、中身が変われば URL も変わる。
+そのため 1 年の immutable で配り、index.html と API の応答は毎回 ETag で再検証させる。
+"""
+import datetime as _dt
+import hashlib
+import os
+from email.utils import format_datetime, parsedate_to_datetime
+from mimetypes import guess_type
+from typing import Optional
+
+from starlette.datastructures import Headers
+from starlette.requests import Request
+from starlette.responses import FileResponse, JSONResponse, Response
+from starlette.staticfiles import NotModifiedResponse, StaticFiles
+from starlette.types import Scope
+
+REVALIDATE = "no-cache"
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+# 優先順。拡張子はビルド後に precompress.py が作るファイルに合わせる
+ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+
+
+def etag_of(body: bytes) -> str:
+    return '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+
+
+def http_date(ts: str) -> str:
+    """db の時刻 (UTC・秒単位の ISO 形式) を HTTP 日付にする"""
+    dt = _dt.datetime.fromisoformat(ts).replace(tzinfo=_dt.timezone.utc)
+    return format_datetime(dt, usegmt=True)
+
+
+def is_not_modified(request: Headers, response: Headers) -> bool:
+    """If-None-Match があればそれだけで (弱い比較)、なければ If-Modified-Since で判定する"""
+    if_none_match = request.get("if-none-match")
+    if if_none_match is not None:
+        etag = response.get("etag", "").removeprefix("W/")
+        tags = {t.strip().removeprefix("W/") for t in if_none_match.split(",")}
+        return bool(etag) and (etag in tags or "*" in tags)
+    since, modified = request.get("if-modified-since"), response.get("last-modified")
+    if not since or not modified:
+        return False
+    try:
+        return parsedate_to_datetime(modified) <= parsedate_to_datetime(since)
+    except (TypeError, ValueError):
+        return False
+
+
+def conditional(
+    request: Request,
+    response: Response,
+    last_modified: Optional[str] = None,
+    cache_control: str = REVALIDATE,
+) -> Response:
+    """応答に ETag (なければ本文のハッシュ)・Last-Modified・Cache-Control を付け、
+    条件付きリクエストが一致すれば本文なしの 304 に差し替える"""
+    if "etag" not in response.headers:
+        response.headers["etag"] = etag_of(response.body)
+    if last_modified:
+        response.headers["last-modified"] = http_date(last_modified)
+    response.headers["cache-control"] = cache_control
+    if is_not_modified(request.headers, response.headers):
+        return NotModifiedResponse(response.headers)
+    return response
+
+
+def json_entity(payload) -> tuple:
+    """JSONResponse と同じ形で直列化した本文とその ETag。作り置きして entity_response に渡す"""
+    body = JSONResponse(payload).body
+    return body, etag_of(body)
+
+
+def entity_response(request: Request, entity: tuple, last_modified: Optional[str] = None) -> Response:
+    body, etag = entity
+    response = Response(body, media_type="application/json", headers={"etag": etag})
+    return conditional(request, response, last_modified)
+
+
+def _accepted(header: str) -> set:
+    """Accept-Encoding のうち q=0 でないもの"""
+    out = set()
+    for part in header.split(","):
+        name, _, params = part.partition(";")
+        q = params.strip().removeprefix("q=")
+        try:
+            if params and float(q) == 0:
+                continue
+        except ValueError:
+            pass
+        out.add(name.strip().lower())
+    return out
+
+
+class PrecompressedStaticFiles(StaticFiles):
+    """隣に .br / .gz があれば、Accept-Encoding に合わせてそちらを返す StaticFiles。
+    どのファイルも immutable で配る (ハッシュ付きファイル名が前提)"""
+
+    def file_response(
+        self,
+        full_path,
+        stat_result: os.stat_result,
+        scope: Scope,
+        status_code: int = 200,
+    ) -> Response:
+        request_headers = Headers(scope=scope)
+        accepted = _accepted(request_headers.get("accept-encoding", ""))
+        response = None
+        for encoding, suffix in ENCODINGS:
+            if encoding not in accepted:
+                continue
+            path = os.fspath(full_path) + suffix
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            response = FileResponse(
+                path, status_code=status_code, stat_result=stat,
+                media_type=guess_type(os.fspath(full_path))[0] or "text/plain",
+                headers={"content-encoding": encoding},
+            )
+            break
+        if response is None:
+            response = FileResponse(full_path, status_code=status_code, stat_result=stat_result)
+        response.headers["cache-control"] = IMMUTABLE
+        response.headers["vary"] = "Accept-Encoding"
+        if self.is_not_modified(response.headers, request_headers):
+            return NotModifiedResponse(response.headers)
+        return response
@@ -0,0 +1,108 @@
+import asyncio
+import datetime as _dt
+import threading
+import uuid
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+
+class QueueFull(RuntimeError):
+    pass
+
+
+class JobQueue:
+    """CPU を食う処理 (シフト生成) をイベントループの外で実行するジョブキュー。
+
+    同時実行数は workers で、待ち行列の長さは max_queue で上限を決める。
+    ジョブはスレッドで動くので、Python で書かれた探索は GIL のため workers を増やしても速くならない。
+    このキューは同時に走る生成の数を抑えてイベントループを止めないためのもので、CPU を複数使うのは
+    make_schedule(workers=N) のプロセスプールの役目。スレッドにしているのは、stop / progress の
+    コールバック (SSE の切断検知と進捗) をジョブとやり取りするため。
+    終わったジョブは keep 件まで結果を残し、古いものから捨てる。
+    失敗したジョブには error_body(例外) を error_body として残す (既定は {"error": str(例外)})。
+    """
+
+    def __init__(
+        self, workers: int = 2, max_queue: int = 100, keep: int = 200,
+        error_body: Optional[Callable[[Exception], Dict[str, Any]]] = None,
+    ):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.keep = keep
+        self.error_body = error_body or (lambda e: {"error": str(e)})
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="schedule-job")
+        self._jobs: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._futures: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+
+    def _count(self, status: str) -> int:
+        return sum(1 for j in self._jobs.values() if j["status"] == status)
+
+    def _prune(self) -> None:
+        finished = [k for k, j in self._jobs.items() if j["status"] in ("done", "failed")]
+        for k in finished[: max(0, len(finished) - self.keep)]:
+            del self._jobs[k]
+            self._futures.pop(k, None)
+
+    def submit(self, fn: Callable[..., Any], *args, **kwargs) -> str:
+        with self._lock:
+            if self._count("queued") >= self.max_queue:
+                raise QueueFull("スケジュール作成の待ちが多すぎます。しばらくしてから再試行してください。")
+            job_id = uuid.uuid4().hex
+            self._jobs[job_id] = {
+                "id": job_id,
+                "status": "queued",
+                "result": None,
+                "error": None,
+                "error_body": None,
+                "created_at": _dt.datetime.utcnow().isoformat(timespec="seconds"),
+                "finished_at": None,
+            }
+            self._prune()
+            self._futures[job_id] = self._executor.submit(self._run, job_id, fn, args, kwargs)
+        return job_id
+
+    def _run(self, job_id: str, fn, args, kwargs):
+        with self._lock:
+            self._jobs[job_id]["status"] = "running"
+        try:
+            result = fn(*args, **kwargs)
+        except Exception as e:
+            with self._lock:
+                self._jobs[job_id].update(
+                    status="failed",
+                    error=str(e),
+                    error_body=self.error_body(e),
+                    finished_at=_dt.datetime.utcnow().isoformat(timespec="seconds"),
+                )
+            raise
+        with self._lock:
+            self._jobs[job_id].update(
+                status="done",
+                result=result,
+                finished_at=_dt.datetime.utcnow().isoformat(timespec="seconds"),
+            )
+        return result
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    async def wait(self, job_id: str) -> Any:
+        """ジョブの終了をイベントループを止めずに待ち、結果を返す (失敗時は例外を送出)"""
+        return await asyncio.wrap_future(self._futures[job_id])
+
+    def depth(self) -> int:
+        with self._lock:
+            return self._count("queued")
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "queued": self._count("queued"),
+                "running": self._count("running"),
+                "max_queue": self.max_queue,
+            }
@@ -0,0 +1,191 @@
+"""プロセス内のメトリクス (カウンタ・ヒストグラム) と Prometheus テキスト形式での出力。
+
+値はプロセスごとに持つ。uvicorn を複数ワーカーで動かすと、/metrics はリクエストを
+受けたワーカーの値だけを返す。
+"""
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Tuple
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_registry: List["_Metric"] = []
+
+
+def _escape(v: str) -> str:
+    return str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(pairs) -> str:
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+def _num(v: float) -> str:
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, doc: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.doc = doc
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _key(self, kw) -> tuple:
+        if set(kw) != set(self.labels):
+            raise ValueError(f"{self.name}: ラベルは {self.labels} を指定してください")
+        return tuple(str(kw[k]) for k in self.labels)
+
+    def _header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name, doc, labels=()):
+        super().__init__(name, doc, labels)
+        self._values: Dict[tuple, float] = {}
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return self._header() + [
+            f"{self.name}{_labels(zip(self.labels, key))} {_num(v)}" for key, v in items
+        ]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, doc, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, doc, labels)
+        self.buckets = tuple(sorted(buckets))
+        # ラベルごとに [各バケツの件数..., 合計値, 件数]
+        self._values: Dict[tuple, list] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            row = self._values.get(key)
+            if row is None:
+                row = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+            if i < len(self.buckets):
+                row[i] += 1
+            row[-2] += value
+            row[-1] += 1
+
+    @contextmanager
+    def time(self, **labels) -> Iterator[None]:
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - t0, **labels)
+
+    def count(self, **labels) -> int:
+        with self._lock:
+            row = self._values.get(self._key(labels))
+            return row[-1] if row else 0
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted((k, list(v)) for k, v in self._values.items())
+        out = self._header()
+        for key, row in items:
+            pairs = list(zip(self.labels, key))
+            acc = 0
+            for b, n in zip(self.buckets, row):
+                acc += n
+                out.append(f"{self.name}_bucket{_labels(pairs + [('le', _num(b))])} {acc}")
+            out.append(f"{self.name}_bucket{_labels(pairs + [('le', '+Inf')])} {row[-1]}")
+            out.append(f"{self.name}_sum{_labels(pairs)} {_num(row[-2])}")
+            out.append(f"{self.name}_count{_labels(pairs)} {row[-1]}")
+        return out
+
+
+def render() -> str:
+    lines: List[str] = []
+    for m in _registry:
+        lines += m.render()
+    return "\n".join(lines) + "\n"
+
+
+# ── アプリ全体で使うメトリクス ────────────────────────────────────
+
+http_request_seconds = Histogram(
+    "oncall_http_request_duration_seconds", "HTTP リクエストの処理時間 (ルートのパス定義ごと)",
+    ("method", "route", "status"),
+)
+solver_runs = Counter(
+    "oncall_solver_runs_total", "シフト探索の実行回数", ("solver", "result"),
+)
+solver_attempts = Counter(
+    "oncall_solver_attempts_total", "シフト探索の試行回数 (バックトラックは行き止まりの数)", ("solver",),
+)
+solver_failures = Counter(
+    "oncall_solver_failures_total", "試行が行き詰まった原因のシフト種別", ("solver", "slot_type"),
+)
+solver_seconds = Histogram(
+    "oncall_solver_duration_seconds", "シフト探索 1 回の所要時間", ("solver",),
+)
+solver_attempt_seconds = Histogram(
+    "oncall_solver_attempt_seconds", "シフト探索の 1 試行あたりの平均時間 (探索 1 回ごとに記録)", ("solver",),
+    buckets=(1e-6, 5e-6, 1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4, 1e-3, 5e-3, 1e-2, 0.1),
+)
+csv_build_seconds = Histogram(
+    "oncall_csv_build_seconds", "シフト表の CSV 生成時間",
+)
+db_query_seconds = Histogram(
+    "oncall_db_query_seconds", "SQLite 操作の所要時間 (db モジュールの関数ごと)", ("op",),
+)
+
+
+class MetricsMiddleware:
+    """ASGI ミドルウェア: HTTP リクエストごとに応答の送信完了までの時間を記録する。
+
+    route ラベルは実際の URL ではなくマッチしたルートのパス定義 (/api/surveys/{survey_id} など)。
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        t0 = time.perf_counter()
+        status = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            path = getattr(route, "path", None) or scope.get("root_path") or "unmatched"
+            http_request_seconds.observe(
+                time.perf_counter() - t0, method=scope["method"], route=path, status=status[0],
+            )
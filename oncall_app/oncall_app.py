@@ -1,25 +1,31 @@
 # oncall_app.py  (FastAPI 版・React フロントエンド)
 # -------------------------------------------------------------------
 #  起動例:
-#     pip install fastapi uvicorn pandas jpholiday python-multipart
+#     pip install fastapi uvicorn jpholiday python-multipart
 #     cd frontend && npm install && npm run build
+#     python -m oncall_app.precompress   # /assets の .gz / .br を作る (任意)
 #     uvicorn oncall_app.oncall_app:app --reload
 # -------------------------------------------------------------------
 
+import os
 from pathlib import Path
-from fastapi.staticfiles import StaticFiles
+from fastapi import Request
 from fastapi.responses import FileResponse
 
+from .http_cache import PrecompressedStaticFiles, conditional
 from .routes import app
 
 STATIC_DIR = Path(__file__).parent / "static"
 
 
-# ビルド済みアセット配信
-app.mount("/assets", StaticFiles(directory=STATIC_DIR / "assets"), name="assets")
+# ビルド済みアセット配信 (ファイル名にハッシュが付くので immutable。圧縮済みがあればそちらを返す)
+app.mount("/assets", PrecompressedStaticFiles(directory=STATIC_DIR / "assets"), name="assets")
 
 
-# SPA ルーティング: /api と /csv と /assets を除くすべて index.html を返す
+# SPA ルーティング: /api と /csv と /metrics と /assets を除くすべて index.html を返す
+# (routes.py で先に登録したルートが優先されるので、ここは必ず最後に登録する)
 @app.get("/{full_path:path}")
-async def serve_spa(full_path: str):
-    return FileResponse(STATIC_DIR / "index.html")
+async def serve_spa(full_path: str, request: Request):
+    # index.html は新しいアセットを指すよう毎回再検証させる (変わっていなければ 304)
+    index = STATIC_DIR / "index.html"
+    return conditional(request, FileResponse(index, stat_result=os.stat(index)))
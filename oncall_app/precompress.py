@@ -0,0 +1,56 @@
+"""ビルド済みの /assets を圧縮し、隣に .gz (と brotli があれば .br) を書き出す。
+
+    python -m oncall_app.precompress [ディレクトリ]
+
+フロントエンドのビルド (npm run build) の後に一度実行する。配信時は
+http_cache.PrecompressedStaticFiles が Accept-Encoding に合わせてこれらを返す。
+"""
+import gzip
+import sys
+from pathlib import Path
+
+try:
+    import brotli
+except ImportError:  # pip install brotli (extras: compress) で .br も作る
+    brotli = None
+
+ASSETS_DIR = Path(__file__).parent / "static" / "assets"
+SUFFIXES = {".js", ".css", ".html", ".svg", ".json", ".map", ".txt"}
+MIN_SIZE = 1024
+
+
+def compress_file(path: Path) -> list:
+    """path の .gz / .br を作り、元より小さくなったものだけ残す。書いたパスを返す"""
+    raw = path.read_bytes()
+    written = []
+    outputs = [(".gz", lambda b: gzip.compress(b, compresslevel=9, mtime=0))]
+    if brotli is not None:
+        outputs.append((".br", lambda b: brotli.compress(b, quality=11)))
+    for suffix, fn in outputs:
+        out = path.with_name(path.name + suffix)
+        body = fn(raw)
+        if len(body) >= len(raw):
+            out.unlink(missing_ok=True)
+            continue
+        out.write_bytes(body)
+        written.append(out)
+    return written
+
+
+def precompress(directory: Path = ASSETS_DIR) -> list:
+    written = []
+    for path in sorted(directory.rglob("*")):
+        if path.is_file() and path.suffix in SUFFIXES and path.stat().st_size >= MIN_SIZE:
+            written += compress_file(path)
+    return written
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    directory = Path(argv[0]) if argv else ASSETS_DIR
+    for out in precompress(directory):
+        print(out)
+
+
+if __name__ == "__main__":
+    main()
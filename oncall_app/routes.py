@@ -1,39 +1,67 @@
+import asyncio
+import csv
 import io
+import json
+import os
+import threading
 import uuid
-import calendar
 import datetime as _dt
-from typing import Dict, List, Set
-
-import pandas as pd
-from fastapi import FastAPI, Form, HTTPException
-from fastapi.responses import StreamingResponse, JSONResponse
-
-from .holiday_utils import is_holiday
-from .scheduler import make_schedule
-from . import db
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Set
+
+from fastapi import FastAPI, Form, HTTPException, Path, Query, Request
+from fastapi.responses import PlainTextResponse, Response, StreamingResponse, JSONResponse
+
+from .holiday_utils import HOLIDAYS_MODIFIED, is_holiday, is_off_day, month_weeks
+from .scheduler import (
+    REQUIRED,
+    Infeasible,
+    Unsolved,
+    last_shifts,
+    make_department_schedule,
+    make_horizon_schedule,
+    make_schedule,
+)
+from .jobs import JobQueue, QueueFull
+from .schedule_cache import ScheduleCache, canonical_key
+from .http_cache import conditional, entity_response, json_entity
+from . import adb, db, metrics
 
 app = FastAPI(title="当直スケジューラ")
+app.add_middleware(metrics.MetricsMiddleware)
 
 db.init_db()
 
-_csv_cache: Dict[str, str] = {}
+CSV_TOKEN_TTL = int(os.environ.get("CSV_TOKEN_TTL", str(24 * 60 * 60)))
+CSV_TOKEN_MAX = int(os.environ.get("CSV_TOKEN_MAX", "1000"))
+
+jobs = JobQueue(
+    workers=int(os.environ.get("SCHEDULE_JOB_WORKERS", "2")),
+    max_queue=int(os.environ.get("SCHEDULE_JOB_MAX_QUEUE", "100")),
+    error_body=lambda e: _error_body(e),  # 失敗したジョブのポーリングにも同期 API と同じ応答を返す
+)
+
+schedule_cache = ScheduleCache(
+    maxsize=int(os.environ.get("SCHEDULE_CACHE_SIZE", "128")),
+    persist=os.environ.get("SCHEDULE_CACHE_PERSIST", "") not in ("", "0"),
+    persist_ttl=int(os.environ.get("SCHEDULE_CACHE_TTL", str(7 * 24 * 60 * 60))),
+    persist_max=int(os.environ.get("SCHEDULE_CACHE_MAX", "10000")),
+)
+
+
+@lru_cache(maxsize=128)
+def _month_days(y: int, m: int) -> tuple:
+    """週ごとの (日付, 日, 月, 曜日, 祝日か, 当月か)。(年, 月) ごとに作り置きする (タプルなので共有しても壊れない)"""
+    return tuple(
+        tuple((str(day), day.day, day.month, day.weekday(), is_holiday(day), day.month == m) for day in week)
+        for week in month_weeks(y, m)
+    )
 
 
 def _build_weeks(y: int, m: int) -> list:
-    weeks = []
-    for week in calendar.Calendar(firstweekday=6).monthdatescalendar(y, m):
-        week_data = []
-        for day in week:
-            week_data.append({
-                "date": str(day),
-                "day": day.day,
-                "month": day.month,
-                "weekday": day.weekday(),
-                "is_holiday": bool(is_holiday(day)),
-                "in_month": day.month == m,
-            })
-        weeks.append(week_data)
-    return weeks
+    """カレンダー表示用の週データ。応答に載せて書き換えられてもよいよう、呼び出しごとに新しく作る"""
+    keys = ("date", "day", "month", "weekday", "is_holiday", "in_month")
+    return [[dict(zip(keys, day)) for day in week] for week in _month_days(y, m)]
 
 
 @app.post("/api/calendar")
@@ -56,6 +84,207 @@ async def api_calendar(
     })
 
 
+@lru_cache(maxsize=128)
+def _calendar_entity(y: int, m: int) -> tuple:
+    return json_entity({"year": y, "month": m, "weeks": _build_weeks(y, m)})
+
+
+@app.get("/api/calendar/{year}/{month}")
+async def api_calendar_month(request: Request, year: int, month: int = Path(..., ge=1, le=12)):
+    """週データだけを返す GET 版。内容は年月と祝日表で決まるので ETag / Last-Modified で再検証できる"""
+    return entity_response(request, _calendar_entity(year, month), HOLIDAYS_MODIFIED)
+
+
+def _unavail_type(tag: str, off_day: bool) -> Optional[str]:
+    """申告のタグ (DAY / NIGHT) に当たるシフト種別。平日の DAY は枠がないので None"""
+    if tag == "DAY":
+        return "WE_DAY" if off_day else None
+    return "WE_NIGHT" if off_day else "WD_NIGHT"
+
+
+def _parse_unavail(doc_list: List[str], unavail: str) -> Dict[str, Set[tuple]]:
+    unavailable: Dict[str, Set[tuple]] = {d: set() for d in doc_list}
+    if unavail:
+        for item in unavail.split(","):
+            if not item:
+                continue
+            doc, date_str, tag = item.split("|")
+            dt = _dt.date.fromisoformat(date_str)
+            tp = _unavail_type(tag, is_off_day(dt))
+            if tp:
+                unavailable[doc].add((dt, tp))
+    return unavailable
+
+
+def _rows_to_csv(rows: list) -> bytes:
+    with metrics.csv_build_seconds.time():
+        buf = io.StringIO()
+        writer = csv.DictWriter(buf, fieldnames=["Date", "Shift", "Doctor"], lineterminator="\n")
+        writer.writeheader()
+        writer.writerows(rows)
+        return buf.getvalue().encode("utf-8-sig")
+
+
+def _schedule_payload(year: int, month: int, rows: list) -> dict:
+    tok = uuid.uuid4().hex
+    db.put_csv_token(tok, _rows_to_csv(rows), CSV_TOKEN_TTL, CSV_TOKEN_MAX)
+    return {
+        "year": year,
+        "month": month,
+        "rows": _serialize_rows(rows),
+        "tok": tok,
+    }
+
+
+def _serialize_rows(rows: list) -> list:
+    return [{"Date": str(r["Date"]), "Shift": r["Shift"], "Doctor": r["Doctor"]} for r in rows]
+
+
+def _history_from_token(tok: str, year: int, month: int) -> Optional[Dict[str, _dt.date]]:
+    """CSV トークンのシフト表のうち year 年 month 月より前の勤務から、医師ごとの最終勤務日。
+    トークンは CSV_TOKEN_TTL で切れるので、直前に作った表を続けて使うとき向け"""
+    body = db.open_csv_token(tok, CSV_TOKEN_TTL)
+    if body is None:
+        return None
+    text = b"".join(body).decode("utf-8-sig")
+    start = _dt.date(year, month, 1).isoformat()
+    return last_shifts(r for r in csv.DictReader(io.StringIO(text)) if r["Date"] < start)
+
+
+def _history_from_survey(survey_id: str, year: int, month: int) -> Optional[Dict[str, _dt.date]]:
+    """アンケートに保存したシフト表 (survey_schedules、期限なし) から、_history_from_token と同じく"""
+    saved = db.get_survey_schedule(survey_id)
+    if saved is None:
+        return None
+    start = _dt.date(year, month, 1).isoformat()
+    return last_shifts(r for r in saved["rows"] if r["Date"] < start)
+
+
+def _parse_history(history: str) -> Dict[str, _dt.date]:
+    """"医師|YYYY-MM-DD,..." 形式の医師ごとの最終勤務日"""
+    out: Dict[str, _dt.date] = {}
+    for item in history.split(","):
+        if not item.strip():
+            continue
+        doc, _, date_str = item.strip().partition("|")
+        d = _dt.date.fromisoformat(date_str)
+        out[doc] = max(out.get(doc, d), d)
+    return out
+
+
+async def _resolve_history(
+    year: int, month: int, history: str = "", prev_survey: str = "", prev_tok: str = "",
+) -> tuple:
+    """前回までの最終勤務を (history, エラー応答) で返す。指定は history (明示) → prev_survey
+    (アンケートに保存したシフト表) → prev_tok (CSV トークン) の順に使い、どれもなければ (None, None)"""
+    if history:
+        try:
+            return _parse_history(history), None
+        except ValueError:
+            return None, JSONResponse({"error": "history は 医師|YYYY-MM-DD をカンマ区切りで指定してください。"},
+                                      status_code=422)
+    if prev_survey:
+        found = await adb.read(_history_from_survey, prev_survey, year, month)
+    elif prev_tok:
+        found = await adb.read(_history_from_token, prev_tok, year, month)
+    else:
+        return None, None
+    if found is None:
+        return None, JSONResponse({"error": PREV_NOT_FOUND}, status_code=404)
+    return found, None
+
+
+def _cache_key(year, month, doc_list, unavailable, gap_lo, gap_hi, solver, workers, history=None) -> str:
+    return canonical_key(
+        year, month, doc_list, unavailable, gap_lo, gap_hi, solver=solver, workers=workers,
+        history=sorted([doc, d.isoformat()] for doc, d in (history or {}).items()),
+    )
+
+
+def _schedule_job(
+    year: int,
+    month: int,
+    doc_list: List[str],
+    unavailable: Dict[str, Set[tuple]],
+    gap_lo: int,
+    gap_hi: int,
+    solver: str,
+    workers: int,
+    history: Optional[Dict[str, _dt.date]] = None,
+    stop=None,
+    progress=None,
+    time_budget: Optional[float] = None,
+) -> dict:
+    """ジョブキューのワーカースレッドで実行される: 生成 (キャッシュ優先) → CSV 保存 → JSON 用の結果
+
+    stop で打ち切った場合 (Cancelled) と、制限時間付きで解けなかった場合は
+    結果が実行時の速さで変わるのでキャッシュしない。事前チェック (Infeasible) と探索 (Unsolved)
+    以外の RuntimeError (NumPy がないなど) も、入力によらない一時的な原因かもしれないのでキャッシュしない。
+    """
+    workers = max(1, min(workers, os.cpu_count() or 1))
+    key = _cache_key(year, month, doc_list, unavailable, gap_lo, gap_hi, solver, workers, history)
+    cached = schedule_cache.get(key)
+    if cached is None:
+        try:
+            rows = make_schedule(
+                year, month, sorted(doc_list), unavailable, gap_lo=gap_lo, gap_hi=gap_hi,
+                solver=solver, workers=workers, history=history, stop=stop, progress=progress,
+                time_budget=time_budget,
+            )
+        except Infeasible as e:
+            schedule_cache.put(key, {"error": str(e), "bottlenecks": e.bottlenecks})
+            raise
+        except Unsolved as e:
+            if time_budget is None:
+                schedule_cache.put(
+                    key, {"error": str(e), "partial": _serialize_rows(e.rows), "unfilled": e.unfilled},
+                )
+            raise
+        cached = {"rows": rows}
+        schedule_cache.put(key, cached)
+    if "bottlenecks" in cached:
+        raise Infeasible(cached["bottlenecks"])
+    if "partial" in cached:
+        rows = [dict(r, Date=_dt.date.fromisoformat(r["Date"])) for r in cached["partial"]]
+        raise Unsolved(cached["error"], rows, cached["unfilled"])
+    return _schedule_payload(year, month, cached["rows"])
+
+
+def _submit_schedule(
+    year, month, docs, unavail, gap_lo, gap_hi, solver, workers, history=None, time_budget=None,
+) -> str:
+    doc_list = [d.strip() for d in docs.split(",") if d.strip()]
+    unavailable = _parse_unavail(doc_list, unavail)
+    return jobs.submit(
+        _schedule_job, year, month, doc_list, unavailable, gap_lo, gap_hi, solver, workers, history,
+        time_budget=time_budget,
+    )
+
+
+PREV_NOT_FOUND = "前回のシフト表が見つかりません。"
+
+
+def _error_body(e: Exception) -> Dict[str, Any]:
+    """生成失敗の応答。事前チェックで弾かれたときは足りない区分と日付 (bottlenecks) を、
+    探索で埋めきれなかったときは最良の部分解 (rows) と埋められなかった枠 (unfilled) も返す"""
+    body: Dict[str, Any] = {"error": str(e)}
+    if isinstance(e, Infeasible):
+        body["bottlenecks"] = e.bottlenecks
+    if isinstance(e, Unsolved):
+        body["rows"] = _serialize_rows(e.rows)
+        body["unfilled"] = e.unfilled
+    return body
+
+
+def _budget(time_budget: float) -> Optional[float]:
+    """フォームの time_budget (秒、0 以下は制限なし)"""
+    return time_budget if time_budget > 0 else None
+
+
+def _error_response(e: Exception) -> JSONResponse:
+    return JSONResponse(_error_body(e), status_code=422)
+
+
 @app.post("/api/schedule")
 async def api_schedule(
     year: int = Form(...),
@@ -64,52 +293,290 @@ async def api_schedule(
     unavail: str = Form(""),
     gap_lo: int = Form(...),
     gap_hi: int = Form(...),
+    solver: str = Form("random"),
+    workers: int = Form(1),
+    prev_tok: str = Form(""),
+    prev_survey: str = Form(""),
+    history: str = Form(""),
+    time_budget: float = Form(0),
+):
+    history, error = await _resolve_history(year, month, history, prev_survey, prev_tok)
+    if error is not None:
+        return error
+    try:
+        job_id = _submit_schedule(
+            year, month, docs, unavail, gap_lo, gap_hi, solver, workers, history, _budget(time_budget),
+        )
+    except QueueFull as e:
+        return JSONResponse({"error": str(e)}, status_code=503)
+    try:
+        payload = await jobs.wait(job_id)
+    except Exception as e:
+        return _error_response(e)
+    return JSONResponse(payload)
+
+
+SSE_POLL_SECONDS = 0.5
+
+
+def _sse(event: str, data: Any) -> bytes:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n".encode("utf-8")
+
+
+@app.post("/api/schedule/stream")
+async def api_schedule_stream(
+    request: Request,
+    year: int = Form(...),
+    month: int = Form(...),
+    docs: str = Form(...),
+    unavail: str = Form(""),
+    gap_lo: int = Form(...),
+    gap_hi: int = Form(...),
+    solver: str = Form("random"),
+    prev_tok: str = Form(""),
+    prev_survey: str = Form(""),
+    history: str = Form(""),
+    time_budget: float = Form(0),
 ):
+    """/api/schedule と同じ生成を、進捗を Server-Sent Events で送りながら行う。
+
+    イベント: queued → progress (試行回数・同時に埋まった枠数の最大) … → done (結果) / error。
+    クライアントが切断すると探索を打ち切る。進捗を送るため workers は 1 固定。
+    """
+    history, error = await _resolve_history(year, month, history, prev_survey, prev_tok)
+    if error is not None:
+        return error
     doc_list = [d.strip() for d in docs.split(",") if d.strip()]
-    unavailable: Dict[str, Set[tuple]] = {d: set() for d in doc_list}
-    if unavail:
-        for item in unavail.split(","):
-            if not item:
-                continue
-            doc, date_str, tag = item.split("|")
-            dt = _dt.date.fromisoformat(date_str)
-            if tag == "DAY":
-                if dt.weekday() >= 5 or is_holiday(dt):
-                    unavailable[doc].add((dt, "WE_DAY"))
-            else:
-                if dt.weekday() >= 5 or is_holiday(dt):
-                    unavailable[doc].add((dt, "WE_NIGHT"))
+    unavailable = _parse_unavail(doc_list, unavail)
+    return _job_stream(
+        request,
+        sum(REQUIRED.values()) * len(doc_list),
+        lambda stop, progress: jobs.submit(
+            _schedule_job, year, month, doc_list, unavailable, gap_lo, gap_hi, solver, 1, history,
+            stop, progress, _budget(time_budget),
+        ),
+    )
+
+
+def _job_stream(request: Request, total: int, submit) -> Response:
+    """submit(stop, progress) でジョブを登録し、進捗と結果を Server-Sent Events で送る。
+    キューが満杯なら 503。切断されたら stop が真になり探索が止まる"""
+    loop = asyncio.get_running_loop()
+    events: asyncio.Queue = asyncio.Queue()
+    cancel = threading.Event()
+
+    def progress(attempts: int, depth: int) -> None:
+        data = {"attempts": attempts, "depth": depth, "total": total}
+        loop.call_soon_threadsafe(events.put_nowait, ("progress", data))
+
+    try:
+        job_id = submit(cancel.is_set, progress)
+    except QueueFull as e:
+        return JSONResponse({"error": str(e)}, status_code=503)
+
+    async def stream():
+        done = asyncio.ensure_future(jobs.wait(job_id))
+        done.add_done_callback(lambda f: f.cancelled() or f.exception())
+        try:
+            yield _sse("queued", {"job_id": job_id})
+            while not done.done():
+                getter = asyncio.ensure_future(events.get())
+                await asyncio.wait({done, getter}, timeout=SSE_POLL_SECONDS, return_when=asyncio.FIRST_COMPLETED)
+                if getter.done():
+                    yield _sse(*getter.result())
                 else:
-                    unavailable[doc].add((dt, "WD_NIGHT"))
+                    getter.cancel()
+                if await request.is_disconnected():
+                    return
+            while not events.empty():
+                yield _sse(*events.get_nowait())
+            try:
+                payload = done.result()
+            except Exception as e:
+                yield _sse("error", _error_body(e))
+            else:
+                yield _sse("done", payload)
+        finally:
+            # 切断 (ジェネレータの中断を含む) 時は探索を止める。完了後に立てても影響はない
+            cancel.set()
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+def _horizon_job(year, month, months, doc_list, unavailable, gap_lo, gap_hi, solver, history) -> dict:
+    rows = make_horizon_schedule(
+        year, month, months, sorted(doc_list), unavailable, gap_lo=gap_lo, gap_hi=gap_hi,
+        solver=solver, history=history,
+    )
+    return dict(_schedule_payload(year, month, rows), months=months)
+
+
+@app.post("/api/schedule/horizon")
+async def api_schedule_horizon(
+    year: int = Form(...),
+    month: int = Form(...),
+    months: int = Form(...),
+    docs: str = Form(...),
+    unavail: str = Form(""),
+    gap_lo: int = Form(...),
+    gap_hi: int = Form(...),
+    solver: str = Form("repair"),
+    prev_tok: str = Form(""),
+    prev_survey: str = Form(""),
+    history: str = Form(""),
+):
+    """year 年 month 月から months か月分をまとめて作る (月をまたぐ間隔も守る)"""
+    if not 1 <= months <= 12:
+        return JSONResponse({"error": "months は 1〜12 にしてください。"}, status_code=422)
+    history, error = await _resolve_history(year, month, history, prev_survey, prev_tok)
+    if error is not None:
+        return error
+    doc_list = [d.strip() for d in docs.split(",") if d.strip()]
+    unavailable = _parse_unavail(doc_list, unavail)
+    try:
+        job_id = jobs.submit(
+            _horizon_job, year, month, months, doc_list, unavailable, gap_lo, gap_hi, solver, history,
+        )
+    except QueueFull as e:
+        return JSONResponse({"error": str(e)}, status_code=503)
     try:
-        rows = make_schedule(year, month, doc_list, unavailable, gap_lo=gap_lo, gap_hi=gap_hi)
+        payload = await jobs.wait(job_id)
     except Exception as e:
+        return _error_response(e)
+    return JSONResponse(payload)
+
+
+def _department_job(year, month, wards, unavailable, quotas, groups, gap_lo, gap_hi, solver) -> dict:
+    out = make_department_schedule(
+        year, month, wards, unavailable, quotas=quotas, groups=groups, gap_lo=gap_lo, gap_hi=gap_hi,
+        solver=solver,
+    )
+    wards_out = {}
+    for name, rows in out.items():
+        payload = _schedule_payload(year, month, rows)
+        wards_out[name] = {"rows": payload["rows"], "tok": payload["tok"]}
+    return {"year": year, "month": month, "wards": wards_out}
+
+
+def _department_request(body: Any) -> tuple:
+    if not isinstance(body, dict) or not isinstance(body.get("wards"), dict) or not {"year", "month"} <= set(body):
+        raise ValueError(
+            'JSON は {"year": ..., "month": ..., "wards": {"病棟名": ["医師", ...]}, ...} の形式で送ってください。'
+        )
+    wards = {}
+    for name, docs in body["wards"].items():
+        if not isinstance(docs, list) or not all(isinstance(d, str) for d in docs):
+            raise ValueError(f"{name}: 医師は文字列の配列にしてください。")
+        wards[name] = [d.strip() for d in docs if d.strip()]
+    unavail = body.get("unavail", [])
+    if not isinstance(unavail, list) or not all(isinstance(u, str) for u in unavail):
+        raise ValueError("unavail は \"医師|YYYY-MM-DD|DAY/NIGHT\" の配列にしてください。")
+    doc_list = [d for docs in wards.values() for d in docs]
+    if any(u.split("|")[0] not in doc_list for u in unavail):
+        raise ValueError("unavail に病棟にいない医師が含まれています。")
+    quotas, groups = body.get("quotas") or {}, body.get("groups") or {}
+    if not isinstance(quotas, dict) or not isinstance(groups, dict):
+        raise ValueError("quotas と groups はオブジェクトにしてください。")
+    return (
+        int(body["year"]), int(body["month"]), wards, _parse_unavail(doc_list, ",".join(unavail)),
+        quotas, groups, int(body.get("gap_lo", 5)), int(body.get("gap_hi", 8)),
+        str(body.get("solver", "repair")),
+    )
+
+
+@app.post("/api/schedule/department")
+async def api_schedule_department(request: Request):
+    """複数の病棟のシフト表をまとめて作る (JSON)。
+
+    病棟は互いに独立した部分問題としてプロセスプールで同時に解く。医師・グループごとの
+    1 か月あたりの枠数 (quotas / groups) を指定できる。解けない病棟があれば 422 に ward を付けて返す。
+    """
+    try:
+        args = _department_request(await request.json())
+    except (ValueError, TypeError) as e:
         return JSONResponse({"error": str(e)}, status_code=422)
+    try:
+        job_id = jobs.submit(_department_job, *args)
+    except QueueFull as e:
+        return JSONResponse({"error": str(e)}, status_code=503)
+    try:
+        payload = await jobs.wait(job_id)
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=422)
+    except Exception as e:
+        return JSONResponse(dict(_error_body(e), ward=getattr(e, "ward", None)), status_code=422)
+    return JSONResponse(payload)
 
-    df = pd.DataFrame(rows)
-    tok = uuid.uuid4().hex
-    buf = io.StringIO()
-    df.to_csv(buf, index=False)
-    _csv_cache[tok] = buf.getvalue()
-    serializable_rows = [
-        {"Date": str(r["Date"]), "Shift": r["Shift"], "Doctor": r["Doctor"]}
-        for r in rows
-    ]
+
+@app.get("/api/schedule/cache")
+async def api_schedule_cache_stats():
+    return JSONResponse(schedule_cache.stats())
+
+
+@app.post("/api/schedule/jobs")
+async def api_schedule_job_submit(
+    year: int = Form(...),
+    month: int = Form(...),
+    docs: str = Form(...),
+    unavail: str = Form(""),
+    gap_lo: int = Form(...),
+    gap_hi: int = Form(...),
+    solver: str = Form("random"),
+    workers: int = Form(1),
+    time_budget: float = Form(0),
+):
+    try:
+        job_id = _submit_schedule(
+            year, month, docs, unavail, gap_lo, gap_hi, solver, workers, time_budget=_budget(time_budget),
+        )
+    except QueueFull as e:
+        return JSONResponse({"error": str(e)}, status_code=503)
+    return JSONResponse(
+        {"job_id": job_id, "status": "queued", "queue_depth": jobs.depth()},
+        status_code=202,
+    )
+
+
+@app.get("/api/schedule/jobs")
+async def api_schedule_job_stats():
+    return JSONResponse(jobs.stats())
+
+
+@app.get("/api/schedule/jobs/{job_id}")
+async def api_schedule_job_status(job_id: str):
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="ジョブが見つかりません。")
+    # 失敗時は POST /api/schedule のエラー応答 (error・bottlenecks・rows・unfilled) をそのまま載せる
     return JSONResponse({
-        "year": year,
-        "month": month,
-        "rows": serializable_rows,
-        "tok": tok,
+        "job_id": job["id"],
+        "status": job["status"],
+        "result": job["result"],
+        "error": job["error"],
+        **(job["error_body"] or {}),
+        "created_at": job["created_at"],
+        "finished_at": job["finished_at"],
+        "queue_depth": jobs.depth(),
     })
 
 
+@app.get("/metrics", response_class=PlainTextResponse)
+async def api_metrics():
+    """Prometheus テキスト形式のメトリクス (SPA の catch-all より先に登録する)"""
+    return PlainTextResponse(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+
 @app.get("/csv", response_class=StreamingResponse)
 async def download_csv(tok: str):
-    txt = _csv_cache.get(tok)
-    if txt is None:
+    body = await adb.open_csv_token(tok, CSV_TOKEN_TTL)
+    if body is None:
         return JSONResponse({"error": "リンクが無効です。"}, status_code=404)
     return StreamingResponse(
-        io.BytesIO(txt.encode("utf-8-sig")),
+        body,
         media_type="text/csv",
         headers={"Content-Disposition": "attachment; filename=shift.csv"},
     )
@@ -134,6 +601,19 @@ def _survey_public(survey: dict) -> dict:
     }
 
 
+def _survey_entity(survey: dict) -> tuple:
+    """アンケート情報の本文と ETag。アンケートは作成後に変わらないので内容ごとに作り置きする"""
+    return _survey_entity_cached(tuple(
+        (k, tuple(v) if isinstance(v, list) else v) for k, v in survey.items()
+    ))
+
+
+@lru_cache(maxsize=256)
+def _survey_entity_cached(items: tuple) -> tuple:
+    survey = {k: list(v) if isinstance(v, tuple) else v for k, v in items}
+    return json_entity(_survey_public(survey))
+
+
 @app.post("/api/surveys")
 async def create_survey(
     title: str = Form(...),
@@ -147,48 +627,68 @@ async def create_survey(
     if not doc_list:
         raise HTTPException(status_code=422, detail="医師名を1名以上入力してください。")
     survey_id = uuid.uuid4().hex[:12]
-    db.create_survey(survey_id, title.strip() or f"{year}年{month}月", year, month, doc_list, gap_lo, gap_hi)
+    await adb.create_survey(survey_id, title.strip() or f"{year}年{month}月", year, month, doc_list, gap_lo, gap_hi)
     return JSONResponse({"id": survey_id})
 
 
 @app.get("/api/surveys")
-async def list_surveys():
-    return JSONResponse({"surveys": db.list_surveys()})
+async def list_surveys(
+    limit: int = Query(50, ge=1, le=200),
+    cursor: Optional[str] = None,
+    year: Optional[int] = None,
+    month: Optional[int] = None,
+):
+    try:
+        surveys, next_cursor = await adb.list_surveys(limit, cursor, year, month)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    return JSONResponse({"surveys": surveys, "next_cursor": next_cursor})
 
 
 @app.get("/api/surveys/{survey_id}")
-async def get_survey(survey_id: str):
-    survey = db.get_survey(survey_id)
+async def get_survey(survey_id: str, request: Request):
+    survey = await adb.get_survey(survey_id)
     if not survey:
         raise HTTPException(status_code=404, detail="アンケートが見つかりません。")
-    return JSONResponse(_survey_public(survey))
+    return entity_response(request, _survey_entity(survey), survey["created_at"])
 
 
 @app.delete("/api/surveys/{survey_id}")
 async def delete_survey(survey_id: str):
-    if not db.delete_survey(survey_id):
+    if not await adb.delete_survey(survey_id):
         raise HTTPException(status_code=404, detail="アンケートが見つかりません。")
     return JSONResponse({"ok": True})
 
 
 @app.get("/api/surveys/{survey_id}/responses/{doctor}")
 async def get_survey_response(survey_id: str, doctor: str):
-    survey = db.get_survey(survey_id)
+    survey = await adb.get_survey(survey_id)
     if not survey:
         raise HTTPException(status_code=404, detail="アンケートが見つかりません。")
     if doctor not in survey["docs"]:
         raise HTTPException(status_code=404, detail="この医師はアンケート対象ではありません。")
-    resp = db.get_response(survey_id, doctor)
+    resp = await adb.get_response(survey_id, doctor)
     return JSONResponse({"response": resp})
 
 
+def _blocked_item(date_str: str, tag: str) -> str:
+    """入れない枠 1 件を検証して "YYYY-MM-DD|TAG" に正規化する (不正なら ValueError)"""
+    try:
+        _dt.date.fromisoformat(date_str)
+    except ValueError:
+        raise ValueError(f"不正な値: {date_str}|{tag}")
+    if tag not in ("DAY", "NIGHT"):
+        raise ValueError(f"不正なタグ: {tag}")
+    return f"{date_str}|{tag}"
+
+
 @app.post("/api/surveys/{survey_id}/responses")
 async def submit_survey_response(
     survey_id: str,
     doctor: str = Form(...),
     blocked: str = Form(""),
 ):
-    survey = db.get_survey(survey_id)
+    survey = await adb.get_survey(survey_id)
     if not survey:
         raise HTTPException(status_code=404, detail="アンケートが見つかりません。")
     if doctor not in survey["docs"]:
@@ -202,27 +702,230 @@ async def submit_survey_response(
                 continue
             try:
                 date_str, tag = item.split("|")
-                _dt.date.fromisoformat(date_str)
             except ValueError:
                 raise HTTPException(status_code=422, detail=f"不正な値: {item}")
-            if tag not in ("DAY", "NIGHT"):
-                raise HTTPException(status_code=422, detail=f"不正なタグ: {tag}")
-            items.append(f"{date_str}|{tag}")
+            try:
+                items.append(_blocked_item(date_str, tag))
+            except ValueError as e:
+                raise HTTPException(status_code=422, detail=str(e))
 
-    db.upsert_response(survey_id, doctor, items)
+    await adb.upsert_response(survey_id, doctor, items)
     return JSONResponse({"ok": True, "count": len(items)})
 
 
-@app.get("/api/surveys/{survey_id}/results")
-async def get_survey_results(survey_id: str):
-    survey = db.get_survey(survey_id)
+def _bulk_from_json(payload: Any) -> List[tuple]:
+    if not isinstance(payload, dict) or not isinstance(payload.get("responses"), list):
+        raise ValueError('JSON は {"responses": [{"doctor": ..., "blocked": [...]}, ...]} の形式で送ってください。')
+    entries = []
+    for n, r in enumerate(payload["responses"], 1):
+        if not isinstance(r, dict) or not isinstance(r.get("doctor"), str):
+            raise ValueError(f"{n} 件目: doctor がありません。")
+        blocked = r.get("blocked", [])
+        if not isinstance(blocked, list) or not all(isinstance(b, str) for b in blocked):
+            raise ValueError(f"{n} 件目: blocked は文字列の配列にしてください。")
+        entries.append((n, r["doctor"].strip(), [tuple(b.split("|")) for b in blocked]))
+    return entries
+
+
+def _bulk_from_csv(text: str) -> List[tuple]:
+    """doctor,date,tag のヘッダ付き CSV。date が空の行は「入れない日なし」の回答として扱う"""
+    reader = csv.DictReader(io.StringIO(text))
+    if not reader.fieldnames or not {"doctor", "date", "tag"} <= set(reader.fieldnames):
+        raise ValueError("CSV のヘッダは doctor,date,tag にしてください。")
+    entries = []
+    for row in reader:
+        date_str = (row["date"] or "").strip()
+        pairs = [(date_str, (row["tag"] or "").strip())] if date_str else []
+        entries.append((reader.line_num, (row["doctor"] or "").strip(), pairs))
+    return entries
+
+
+@app.post("/api/surveys/{survey_id}/responses/bulk")
+async def submit_survey_responses_bulk(survey_id: str, request: Request):
+    """複数医師の回答をまとめて登録する (JSON または CSV ファイル)。
+
+    すべての行を先に検証し、1 件でも不正があれば何も書き込まずに 422 を返す。
+    """
+    survey = await adb.get_survey(survey_id)
     if not survey:
         raise HTTPException(status_code=404, detail="アンケートが見つかりません。")
-    responses = db.list_responses(survey_id)
+
+    try:
+        if request.headers.get("content-type", "").startswith("application/json"):
+            entries = _bulk_from_json(await request.json())
+        else:
+            form = await request.form()
+            upload = form.get("file")
+            if upload is None or isinstance(upload, str):
+                raise ValueError("CSV ファイル (file) を添付してください。")
+            entries = _bulk_from_csv((await upload.read()).decode("utf-8-sig"))
+    except (ValueError, UnicodeDecodeError) as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+    responses: Dict[str, List[str]] = {}
+    errors: List[str] = []
+    for n, doctor, pairs in entries:
+        if doctor not in survey["docs"]:
+            errors.append(f"{n}: 医師名が一致しません: {doctor}")
+            continue
+        items = responses.setdefault(doctor, [])
+        for pair in pairs:
+            if len(pair) != 2:
+                errors.append(f"{n}: 不正な値: {'|'.join(pair)}")
+                continue
+            try:
+                items.append(_blocked_item(*pair))
+            except ValueError as e:
+                errors.append(f"{n}: {e}")
+    if errors:
+        raise HTTPException(status_code=422, detail=errors)
+
+    await adb.upsert_responses(survey_id, responses)
+    return JSONResponse({
+        "ok": True,
+        "doctors": len(responses),
+        "count": sum(len(v) for v in responses.values()),
+    })
+
+
+@app.get("/api/surveys/{survey_id}/results")
+async def get_survey_results(survey_id: str, request: Request):
+    # 回答が変わるまでは db 側のキャッシュから返り、SQLite を読まない
+    results = await adb.get_survey_results(survey_id)
+    if not results:
+        raise HTTPException(status_code=404, detail="アンケートが見つかりません。")
+    survey, responses = results["survey"], results["responses"]
     responded = {r["doctor"] for r in responses}
     pending = [d for d in survey["docs"] if d not in responded]
-    return JSONResponse({
+    # 回答の上書きは同じ秒に起こりうるので、ETag は本文のハッシュで取る
+    last_modified = max([survey["created_at"]] + [r["submitted_at"] for r in responses])
+    return conditional(request, JSONResponse({
         "survey": _survey_public(survey),
         "responses": responses,
         "pending": pending,
-    })
+        "heatmap": results["heatmap"],
+    }), last_modified)
+
+
+# -------------------------------------------------------------------
+# アンケートの回答からシフト作成 (入れない枠はサーバー側で DB から組み立てる)
+# -------------------------------------------------------------------
+
+
+def _survey_unavailable(survey: dict) -> Dict[str, Set[tuple]]:
+    """保存済みの回答から入れない枠を作る。休日判定は日付ごとに 1 回だけ行う"""
+    unavailable: Dict[str, Set[tuple]] = {d: set() for d in survey["docs"]}
+    days: Dict[str, tuple] = {}
+    for doc, date_str, tag in db.list_blocked(survey["id"]):
+        if date_str not in days:
+            dt = _dt.date.fromisoformat(date_str)
+            days[date_str] = (dt, is_off_day(dt))
+        dt, off_day = days[date_str]
+        tp = _unavail_type(tag, off_day)
+        if tp and doc in unavailable:
+            unavailable[doc].add((dt, tp))
+    return unavailable
+
+
+def _survey_schedule_job(
+    survey: dict, gap_lo: int, gap_hi: int, solver: str, workers: int,
+    stop=None, progress=None, time_budget: Optional[float] = None,
+    history: Optional[Dict[str, _dt.date]] = None,
+) -> dict:
+    """回答の読み出しから生成・保存までワーカースレッドで行う"""
+    payload = _schedule_job(
+        survey["year"], survey["month"], survey["docs"], _survey_unavailable(survey),
+        gap_lo, gap_hi, solver, workers, history, stop, progress, time_budget,
+    )
+    if not db.put_survey_schedule(survey["id"], payload["rows"], gap_lo, gap_hi, solver):
+        raise RuntimeError("アンケートが削除されました。")
+    return payload
+
+
+async def _survey_or_404(survey_id: str) -> dict:
+    survey = await adb.get_survey(survey_id)
+    if not survey:
+        raise HTTPException(status_code=404, detail="アンケートが見つかりません。")
+    return survey
+
+
+@app.post("/api/surveys/{survey_id}/schedule")
+async def survey_schedule(
+    survey_id: str,
+    gap_lo: Optional[int] = Form(None),
+    gap_hi: Optional[int] = Form(None),
+    solver: str = Form("random"),
+    workers: int = Form(1),
+    time_budget: float = Form(0),
+    prev_survey: str = Form(""),
+    history: str = Form(""),
+):
+    """回答済みの入れない枠でシフト表を作り、アンケートに保存する。間隔の既定はアンケートの値。
+    prev_survey に前月のアンケートを渡すと、そこに保存したシフト表の最終勤務からの間隔も守る"""
+    survey = await _survey_or_404(survey_id)
+    gap_lo = survey["gap_lo"] if gap_lo is None else gap_lo
+    gap_hi = survey["gap_hi"] if gap_hi is None else gap_hi
+    carry, error = await _resolve_history(survey["year"], survey["month"], history, prev_survey)
+    if error is not None:
+        return error
+    try:
+        job_id = jobs.submit(
+            _survey_schedule_job, survey, gap_lo, gap_hi, solver, workers,
+            time_budget=_budget(time_budget), history=carry,
+        )
+    except QueueFull as e:
+        return JSONResponse({"error": str(e)}, status_code=503)
+    try:
+        payload = await jobs.wait(job_id)
+    except Exception as e:
+        return _error_response(e)
+    return JSONResponse(payload)
+
+
+@app.post("/api/surveys/{survey_id}/schedule/stream")
+async def survey_schedule_stream(
+    request: Request,
+    survey_id: str,
+    gap_lo: Optional[int] = Form(None),
+    gap_hi: Optional[int] = Form(None),
+    solver: str = Form("random"),
+    time_budget: float = Form(0),
+    prev_survey: str = Form(""),
+    history: str = Form(""),
+):
+    """/api/surveys/{id}/schedule と同じ生成を、/api/schedule/stream と同じイベントで進捗を送りながら行う"""
+    survey = await _survey_or_404(survey_id)
+    gap_lo = survey["gap_lo"] if gap_lo is None else gap_lo
+    gap_hi = survey["gap_hi"] if gap_hi is None else gap_hi
+    carry, error = await _resolve_history(survey["year"], survey["month"], history, prev_survey)
+    if error is not None:
+        return error
+    return _job_stream(
+        request,
+        sum(REQUIRED.values()) * len(survey["docs"]),
+        lambda stop, progress: jobs.submit(
+            _survey_schedule_job, survey, gap_lo, gap_hi, solver, 1, stop, progress, _budget(time_budget),
+            carry,
+        ),
+    )
+
+
+@app.get("/api/surveys/{survey_id}/schedule")
+async def get_survey_schedule(survey_id: str):
+    survey = await _survey_or_404(survey_id)
+    saved = await adb.get_survey_schedule(survey_id)
+    if saved is None:
+        raise HTTPException(status_code=404, detail="このアンケートのシフト表はまだ作成されていません。")
+    return JSONResponse(dict(saved, year=survey["year"], month=survey["month"]))
+
+
+@app.get("/api/surveys/{survey_id}/schedule/csv")
+async def download_survey_schedule(survey_id: str):
+    saved = await adb.get_survey_schedule(survey_id)
+    if saved is None:
+        raise HTTPException(status_code=404, detail="このアンケートのシフト表はまだ作成されていません。")
+    return Response(
+        _rows_to_csv(saved["rows"]),
+        media_type="text/csv",
+        headers={"Content-Disposition": f"attachment; filename=shift-{survey_id}.csv"},
+    )
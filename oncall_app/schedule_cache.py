@@ -0,0 +1,119 @@
+import datetime as _dt
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Set
+
+from . import db
+
+
+def canonical_key(
+    year: int,
+    month: int,
+    doctors: List[str],
+    unavailable: Dict[str, Set[tuple]],
+    gap_lo: int,
+    gap_hi: int,
+    **params: Any,
+) -> str:
+    """入力を正規化 (医師・不可枠をソート) して JSON 化した文字列の SHA-256"""
+    norm = {
+        "year": year,
+        "month": month,
+        "doctors": sorted(doctors),
+        "unavailable": sorted(
+            [doc, d.isoformat(), tp] for doc in doctors for d, tp in unavailable.get(doc, ())
+        ),
+        "gap": [gap_lo, gap_hi],
+        "params": params,
+    }
+    raw = json.dumps(norm, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _dump(value: Dict[str, Any]) -> str:
+    if "rows" in value:
+        value = {"rows": [dict(r, Date=r["Date"].isoformat()) for r in value["rows"]]}
+    return json.dumps(value, ensure_ascii=False)
+
+
+def _load(raw: str) -> Dict[str, Any]:
+    value = json.loads(raw)
+    if "rows" in value:
+        for r in value["rows"]:
+            r["Date"] = _dt.date.fromisoformat(r["Date"])
+    return value
+
+
+def _persistable(value: Dict[str, Any]) -> bool:
+    """SQLite に残してよい結果か。成功した表と事前チェックの不足 (bottlenecks) は探索の実装によらず
+    正しいままだが、探索で埋めきれなかった結果 (partial) はソルバーを改善すると変わりうるので、
+    再起動・デプロイで消えるメモリ上のキャッシュにだけ置く"""
+    return "rows" in value or "bottlenecks" in value
+
+
+class ScheduleCache:
+    """シフト生成結果の LRU キャッシュ。
+
+    値は {"rows": [...]} (成功) か、{"error", "bottlenecks"} / {"error", "partial", "unfilled"} (解なし)。
+    persist=True のときは成功と事前チェックの不足を SQLite にも書き、プロセス再起動後や別ワーカーでも引ける。
+    SQLite の分は保存時に persist_ttl 秒より古いものと persist_max 件を超えた古いものを消す。
+    """
+
+    def __init__(
+        self, maxsize: int = 128, persist: bool = False, persist_ttl: int = 7 * 24 * 60 * 60,
+        persist_max: int = 10000,
+    ):
+        self.maxsize = maxsize
+        self.persist = persist
+        self.persist_ttl = persist_ttl
+        self.persist_max = persist_max
+        self.hits = 0
+        self.misses = 0
+        self._data: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            value = self._data.get(key)
+            if value is not None:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return value
+        raw = db.get_cached_schedule(key, self.persist_ttl) if self.persist else None
+        with self._lock:
+            if raw is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            value = _load(raw)
+            self._store(key, value)
+            return value
+
+    def put(self, key: str, value: Dict[str, Any]) -> None:
+        with self._lock:
+            self._store(key, value)
+        if self.persist and _persistable(value):
+            db.put_cached_schedule(key, _dump(value), self.persist_ttl, self.persist_max)
+
+    def _store(self, key: str, value: Dict[str, Any]) -> None:
+        self._data[key] = value
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self.hits = self.misses = 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "persist": self.persist,
+            }
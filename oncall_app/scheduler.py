@@ -1,24 +1,97 @@
+import bisect
+import itertools
+import os
 import random
-import calendar
+import time
 import datetime as _dt
-from typing import List, Dict, Set
-from .holiday_utils import is_holiday
+from functools import lru_cache
+from typing import Callable, List, Dict, Optional, Set, Tuple
+from . import metrics
+from .holiday_utils import is_off_day, month_weeks
 
 SHIFT_JP = {"WE_DAY": "休日 日直", "WE_NIGHT": "休日 宿直", "WD_NIGHT": "平日 宿直"}
 REQUIRED = {"WE_DAY": 1, "WE_NIGHT": 1, "WD_NIGHT": 2}
+PROGRESS_EVERY = 100  # progress コールバックを呼ぶ間隔 (試行回数)
+
+# 枠の区分: ((年, 月), シフト種別)。各医師に必要な枠はこの区分のリストで表す
+Cat = Tuple[Tuple[int, int], str]
 
 
 def generate_shift_slots(year: int, month: int):
-    cal = calendar.Calendar(firstweekday=6)  # Sunday first
+    return list(_month_slots(year, month))
+
+
+@lru_cache(maxsize=128)
+def _month_slots(year: int, month: int) -> tuple:
     slots = []
-    for d in cal.itermonthdates(year, month):
-        if d.month != month:
-            continue
-        if d.weekday() >= 5 or is_holiday(d):  # 土日祝
-            slots += [(d, "WE_DAY"), (d, "WE_NIGHT")]
-        else:  # 平日
-            slots.append((d, "WD_NIGHT"))
-    return slots
+    for week in month_weeks(year, month):
+        for d in week:
+            if d.month != month:
+                continue
+            if is_off_day(d):  # 土日祝
+                slots += [(d, "WE_DAY"), (d, "WE_NIGHT")]
+            else:  # 平日
+                slots.append((d, "WD_NIGHT"))
+    return tuple(slots)
+
+
+def month_range(year: int, month: int, months: int) -> List[Tuple[int, int]]:
+    """(year, month) から months か月分の (年, 月)"""
+    out = []
+    for k in range(months):
+        y, m = divmod(month - 1 + k, 12)
+        out.append((year + y, m + 1))
+    return out
+
+
+def default_demand(periods) -> List[Cat]:
+    """1 か月あたり REQUIRED の枠 (休日日直 1・休日宿直 1・平日宿直 2) を各月に"""
+    return quota_demand(periods, REQUIRED)
+
+
+def quota_demand(periods, quota: Dict[str, int]) -> List[Cat]:
+    """1 か月あたり quota[シフト種別] 枠を各月に"""
+    return [(p, tp) for p in periods for tp in REQUIRED for _ in range(quota.get(tp, 0))]
+
+
+def _check_quota(who: str, quota) -> Dict[str, int]:
+    if not isinstance(quota, dict):
+        raise ValueError(f"{who}: 枠数は {{シフト種別: 枠数}} の形式で指定してください。")
+    for tp, n in quota.items():
+        if tp not in REQUIRED:
+            raise ValueError(f"{who}: 不明なシフト種別: {tp}")
+        if not isinstance(n, int) or isinstance(n, bool) or n < 0:
+            raise ValueError(f"{who}: {tp} の枠数は 0 以上の整数にしてください。")
+    return quota
+
+
+def resolve_quotas(
+    doctors: List[str],
+    quotas: Optional[Dict[str, Dict[str, int]]] = None,
+    groups: Optional[Dict[str, dict]] = None,
+) -> Dict[str, Dict[str, int]]:
+    """医師ごとの 1 か月あたりの枠数 {医師: {シフト種別: 枠数}}。
+
+    既定は REQUIRED。groups ({グループ名: {"doctors": [...], "quota": {...}}}) の quota、
+    quotas ({医師: {...}}) の順に、指定したシフト種別だけ上書きする
+    (複数のグループに入っている医師は後のグループが優先)。
+    """
+    out = {doc: dict(REQUIRED) for doc in doctors}
+    for name, g in (groups or {}).items():
+        quota = _check_quota(name, g.get("quota", {}))
+        for doc in g.get("doctors", ()):
+            if doc not in out:
+                raise ValueError(f"{name}: {doc} は医師の一覧にありません。")
+            out[doc].update(quota)
+    for doc, quota in (quotas or {}).items():
+        if doc not in out:
+            raise ValueError(f"{doc} は医師の一覧にありません。")
+        out[doc].update(_check_quota(doc, quota))
+    return out
+
+
+def _cat(d: _dt.date, tp: str) -> Cat:
+    return (d.year, d.month), tp
 
 
 def ok_gap(seq, lo=5, hi=8):
@@ -26,6 +99,927 @@ def ok_gap(seq, lo=5, hi=8):
     return all(lo <= (seq[i + 1] - seq[i]).days <= hi for i in range(len(seq) - 1))
 
 
+def gap_feasible(seq, remaining, lo=5, hi=8):
+    """あと remaining 枠を間に挟めば ok_gap を満たせる見込みがあるか (前方チェック用)"""
+    seq = sorted(seq)
+    need = 0
+    for a, b in zip(seq, seq[1:]):
+        g = (b - a).days
+        if g <= hi:
+            if g < lo:
+                return False
+            continue
+        if hi <= 0:
+            return False
+        k = -(-g // hi) - 1  # 間に最低 k 枠必要
+        if (k + 1) * lo > g:
+            return False
+        need += k
+    return need <= remaining
+
+
+def _to_rows(assign):
+    return sorted(
+        [
+            {"Date": d, "Shift": SHIFT_JP[tp], "Doctor": doc}
+            for doc, l in assign.items()
+            for d, tp in l
+        ],
+        key=lambda r: (r["Date"], r["Shift"]),
+    )
+
+
+def _window(lo: int, hi: int, start: int) -> int:
+    """日番号 start から始まる長さ hi - lo + 1 の連続ビット (負の位置は切り捨て)"""
+    width = (1 << (hi - lo + 1)) - 1
+    return width << start if start >= 0 else width >> -start
+
+
+class SlotIndex:
+    """日付を期間初日からの日番号に、枠を区分ごとのビットマスクに置き換えた索引。
+
+    make_schedule 1 回につき 1 度だけ作る。候補日の絞り込みは
+    「空き枠 & 医師の可否 & 間隔制約」のマスク積だけで済む。
+    """
+
+    def __init__(self, slots, doctors, unavailable, gap_lo, gap_hi, history=None):
+        self.base = min((d for d, _ in slots), default=_dt.date.min)
+        self.n = (max(d for d, _ in slots) - self.base).days + 1 if slots else 0
+        self.lo = gap_lo
+        full = (1 << self.n) - 1
+        self.stock: Dict[Cat, int] = {}
+        for d, tp in slots:
+            c = _cat(d, tp)
+            self.stock[c] = self.stock.get(c, 0) | 1 << self.num(d)
+        # compat[i]: 日番号 i と間隔 [lo, hi] に収まる日番号の集合
+        self.compat = (
+            [
+                (_window(gap_lo, gap_hi, i + gap_lo) | _window(gap_lo, gap_hi, i - gap_hi)) & full
+                for i in range(self.n)
+            ]
+            if gap_hi >= gap_lo
+            else [0] * self.n
+        )
+        self.avail: Dict[str, Dict[Cat, int]] = {}
+        for doc in doctors:
+            blocked = {c: 0 for c in self.stock}
+            for d, tp in unavailable.get(doc, ()):
+                c = _cat(d, tp)
+                if c in blocked and 0 <= (d - self.base).days < self.n:
+                    blocked[c] |= 1 << self.num(d)
+            # 期間より前の最終勤務から gap_lo 日は空ける
+            floor = full
+            if history and doc in history:
+                earliest = max(self.num(history[doc]) + gap_lo, 0)
+                floor = full >> earliest << earliest
+            self.avail[doc] = {c: self.stock[c] & ~blocked[c] & floor for c in self.stock}
+
+    def num(self, d: _dt.date) -> int:
+        return (d - self.base).days
+
+    def date(self, i: int) -> _dt.date:
+        return self.base + _dt.timedelta(days=i)
+
+    def allowed(self, picks) -> int:
+        """昇順の日番号列 picks (ok_gap 済み) に 1 日足しても ok_gap を保てる日の集合"""
+        if not picks:
+            return (1 << self.n) - 1
+        compat = self.compat
+        first, last = picks[0], picks[-1]
+        m = compat[first] & ((1 << first) - 1)
+        m |= compat[last] >> (last + 1) << (last + 1)
+        for a, b in zip(picks, picks[1:]):
+            m |= compat[a] & compat[b] & ((1 << b) - 1) >> (a + 1) << (a + 1)
+        if self.lo <= 0:
+            for p in picks:
+                m |= 1 << p
+        return m
+
+
+def _bits(m: int) -> List[int]:
+    out = []
+    while m:
+        low = m & -m
+        out.append(low.bit_length() - 1)
+        m ^= low
+    return out
+
+
+def _solve_random(
+    slots, demand, unavailable, attempts, seed, gap_lo, gap_hi, stop=None, history=None, stats=None,
+    progress=None,
+):
+    """stats を渡すと、使った試行回数を stats["attempts"] に、行き詰まった枠のシフト種別ごとの
+    回数を stats["failures"] に、1 試行で埋められた枠数の最大を stats["depth"] に、
+    その試行の部分解を stats["partial"] に、評価した部分割当 (1 枠置くごとに 1) の数を
+    stats["states"] に書き込む。
+    progress は PROGRESS_EVERY 試行ごとに progress(試行回数, depth) で呼ばれる。"""
+    rng = random.Random(seed)
+    doctors = list(demand)
+    idx = SlotIndex(slots, doctors, unavailable, gap_lo, gap_hi, history)
+    # 医師ごとの必要枠を月ごとにまとめる (月の順は保ち、月の中の順だけ乱択する)
+    by_period = {
+        doc: [[c for c in cats if c[0] == p] for p in sorted({c[0] for c in cats})]
+        for doc, cats in demand.items()
+    }
+
+    full = (1 << idx.n) - 1
+    stats = {} if stats is None else stats
+    stats["attempts"] = stats["depth"] = stats["states"] = 0
+    stats["partial"] = {}
+    failures = stats["failures"] = {}
+
+    def try_once():
+        pool = dict(idx.stock)
+        assign = {}
+        placed = 0
+        for doc in rng.sample(doctors, len(doctors)):
+            avail = idx.avail[doc]
+            chosen = []
+            floor = full
+            for group in by_period[doc]:
+                picks: List[int] = []
+                # ── 月内の枠の割当順をランダムに ──
+                typ_list = group[:]
+                rng.shuffle(typ_list)
+                for c in typ_list:
+                    cand = pool[c] & avail[c] & floor & idx.allowed(picks)
+                    if not cand:
+                        failures[c[1]] = failures.get(c[1], 0) + 1
+                        stats["states"] += placed
+                        if placed > stats["depth"]:
+                            stats["depth"] = placed
+                            stats["partial"] = {**assign, doc: list(chosen)}
+                        return None
+                    ch = rng.choice(_bits(cand))
+                    bisect.insort(picks, ch)
+                    chosen.append((idx.date(ch), c[1]))
+                    pool[c] &= ~(1 << ch)
+                    placed += 1
+                # 翌月の枠は前月の最終勤務から gap_lo 日空ける
+                start = picks[-1] + gap_lo if picks else 0
+                floor = full >> start << start if start < idx.n else 0
+            assign[doc] = chosen
+        return assign
+
+    for _ in range(attempts):
+        if stop is not None and stop():
+            return None
+        stats["attempts"] += 1
+        res = try_once()
+        if res:
+            stats["states"] += sum(len(v) for v in res.values())
+            return res
+        if progress is not None and stats["attempts"] % PROGRESS_EVERY == 0:
+            progress(stats["attempts"], stats["depth"])
+    return None
+
+
+BACKTRACK_CUTOFF = 50  # 再始動までに許す行き止まりの数の単位 (Luby 列を掛ける)
+
+
+def _luby(i: int) -> int:
+    """Luby 列の i 項目 (1, 1, 2, 1, 1, 2, 4, 1, ...)。短い打ち切りを繰り返しつつ、時々長く探す"""
+    k = 1
+    while (1 << k) - 1 < i:
+        k += 1
+    while (1 << k) - 1 != i:
+        i -= (1 << (k - 1)) - 1
+        k = 1
+        while (1 << k) - 1 < i:
+            k += 1
+    return 1 << (k - 1)
+
+
+def _solve_backtrack(
+    slots, demand, unavailable, attempts, seed, gap_lo, gap_hi, stop=None, history=None, stats=None,
+    progress=None,
+):
+    """前方チェック + 最小残余値 (MRV) 順のバックトラック探索を、再始動しながら行う。
+
+    変数は (医師, 枠の区分) ごとの「次の 1 枠」。同じ区分の枠は入れ替えても同じ解なので
+    日付の昇順に 1 枠ずつ決める。割り当てるたびに未充足の全変数の候補日 (SlotIndex の
+    ビットマスク) を絞り込み、候補が最も少ない変数から決めていく。候補が空になるか、
+    候補の数が残りの必要枠数に足りなくなった時点で直前の選択を取り消す。
+    行き止まりが BACKTRACK_CUTOFF × Luby 列 (1, 1, 2, 1, 1, 2, 4, …) 回を超えたら、
+    変数と候補日の順を変えて最初からやり直す (同じ行き詰まりの周辺を探し続けない)。打ち切りは徐々に長くなる。
+    打ち切りに達しないまま探索木を探し尽くしたときだけ「解なし」と判断する。
+
+    attempts は行き止まりの許容回数 (全再始動の合計) で、実際に当たった行き止まりの数を
+    stats["attempts"] に、行き詰まった枠のシフト種別ごとの回数を stats["failures"] に、
+    同時に埋まっていた枠数の最大を stats["depth"] に、そのときの部分解を stats["partial"] に、
+    1 枠置いた回数を stats["states"] に書き込む。progress は PROGRESS_EVERY 回の行き止まりごとに呼ばれる。
+    """
+    rng = random.Random(seed)
+    doctors = list(demand)
+    idx = SlotIndex(slots, doctors, unavailable, gap_lo, gap_hi, history)
+    need: Dict[tuple, int] = {}
+    for doc, cats in demand.items():
+        for c in cats:
+            need[doc, c] = need.get((doc, c), 0) + 1
+    keys = list(need)
+    # 1 枠置く・外すと候補が変わるのは、同じ医師の変数と同じ区分の変数だけ
+    touched = {
+        (doc, c): [k for k in keys if k[0] == doc or k[1] == c] for doc, c in keys
+    }
+    periods = {doc: sorted({c[0] for c in cats}) for doc, cats in demand.items()}
+    # 勤務どうしは (月をまたいでも) gap_lo 日以上空ける: 日番号 x の前後 gap_lo - 1 日
+    near = [_window(0, 2 * gap_lo - 2, x - gap_lo + 1) if gap_lo > 0 else 0 for x in range(idx.n)]
+    # span[g]: 間隔 g 日の 2 枠の間に最低何枠挟めば ok_gap を満たせるか (満たせなければ None)
+    span: List[Optional[int]] = []
+    for g in range(idx.n + 1):
+        k = 0 if g <= gap_hi else (-(-g // gap_hi) - 1 if gap_hi > 0 else None)
+        span.append(None if g < gap_lo or k is None or (k + 1) * gap_lo > g else k)
+
+    stats = {} if stats is None else stats
+    stats["attempts"] = stats["depth"] = stats["states"] = 0
+    stats["partial"] = {}
+    failures = stats["failures"] = {}
+    cutoff_hit = object()
+
+    def search(limit):
+        """1 回分の探索。解・None (探し尽くした)・cutoff_hit (打ち切り)・stop で中断なら False"""
+        pool = dict(idx.stock)
+        picks: Dict[tuple, list] = {(doc, p): [] for doc in doctors for p in periods[doc]}
+        left = {k: 0 for k in picks}
+        for (doc, c), k in need.items():
+            left[doc, c[0]] += k
+        placed: Dict[tuple, list] = {k: [] for k in keys}  # 区分ごとに置いた日番号 (昇順)
+        order = rng.sample(keys, len(keys))
+        cache: Dict[tuple, list] = {}
+        trail: list = []
+        dead = 0
+
+        def domain(key):
+            doc, c = key
+            p = c[0]
+            m = pool[c] & idx.avail[doc][c]
+            if placed[key]:
+                last = placed[key][-1]
+                m = m >> (last + 1) << (last + 1)
+            for q in periods[doc]:
+                for x in picks[doc, q]:
+                    m &= ~near[x]
+            # 昇順に置くので、d より後ろに残りの枠を置ける候補が要る
+            rest = need[key] - len(placed[key]) - 1
+            cand = _bits(m)
+            if len(cand) <= rest:
+                return []
+            cand = cand[: len(cand) - rest]
+            # gap_feasible と同じ判定を、d が割り込む 1 つの間隔の差分だけで行う
+            mine = picks[doc, p]
+            if not mine:
+                return cand
+            budget = left[doc, p] - 1 - sum(span[y - x] for x, y in zip(mine, mine[1:]))
+            out = []
+            for d in cand:
+                j = bisect.bisect_left(mine, d)
+                extra = 0
+                if j:
+                    k = span[d - mine[j - 1]]
+                    if k is None:
+                        continue
+                    extra += k
+                if j < len(mine):
+                    k = span[mine[j] - d]
+                    if k is None:
+                        continue
+                    extra += k
+                    if j:
+                        extra -= span[mine[j] - mine[j - 1]]
+                if extra <= budget:
+                    out.append(d)
+            return out
+
+        def select():
+            best = None
+            for key in order:
+                if len(placed[key]) == need[key]:
+                    continue
+                dom = cache.get(key)
+                if dom is None:
+                    dom = cache[key] = domain(key)
+                if not dom:
+                    return key, dom
+                if best is None or len(dom) < len(best[1]):
+                    best = (key, dom)
+            return best
+
+        def place(key, d):
+            doc, c = key
+            stats["states"] += 1
+            placed[key].append(d)
+            bisect.insort(picks[doc, c[0]], d)
+            left[doc, c[0]] -= 1
+            pool[c] &= ~(1 << d)
+            trail.append(key)
+            for k in touched[key]:
+                cache.pop(k, None)
+
+        def unplace(key):
+            doc, c = key
+            d = placed[key].pop()
+            picks[doc, c[0]].remove(d)
+            left[doc, c[0]] += 1
+            pool[c] |= 1 << d
+            trail.pop()
+            for k in touched[key]:
+                cache.pop(k, None)
+
+        def collect():
+            assign: Dict[str, list] = {doc: [] for doc in doctors}
+            for (doc, c), days in placed.items():
+                assign[doc] += [(idx.date(d), c[1]) for d in days]
+            return assign
+
+        def dead_end(key):
+            tp = key[1][1]
+            failures[tp] = failures.get(tp, 0) + 1
+            if len(trail) > stats["depth"]:
+                stats["depth"] = len(trail)
+                stats["partial"] = collect()
+
+        first = select()
+        if first is None:
+            return collect()
+        if not first[1]:
+            # 何も置かないうちに候補が空: 順番を変えても解はない
+            dead_end(first[0])
+            stats["attempts"] += 1
+            return None
+        stack = [(first[0], rng.sample(first[1], len(first[1])))]
+        while stack:
+            key, dom = stack[-1]
+            if len(trail) == len(stack):
+                unplace(key)
+            if not dom:
+                stack.pop()
+                continue
+            place(key, dom.pop())
+            nxt = select()
+            if nxt is None:
+                return collect()
+            if not nxt[1]:
+                dead_end(nxt[0])
+                stats["attempts"] += 1
+                dead += 1
+                if stop is not None and stop():
+                    return False
+                if progress is not None and stats["attempts"] % PROGRESS_EVERY == 0:
+                    progress(stats["attempts"], stats["depth"])
+                if stats["attempts"] >= attempts or dead >= limit:
+                    return cutoff_hit
+                continue
+            stack.append((nxt[0], rng.sample(nxt[1], len(nxt[1]))))
+        return None
+
+    for run in itertools.count(1):
+        res = search(BACKTRACK_CUTOFF * _luby(run))
+        if res is not cutoff_hit:
+            return res or None
+        if stats["attempts"] >= attempts:
+            return None
+
+
+REPAIR_NOISE = 0.1  # 修復探索で最良の手ではなく無作為な手を打つ確率
+REPAIR_RESTART = 2000  # 違反量の最小値がこの手数だけ更新されなければ初期解から作り直す
+
+
+def _solve_repair(
+    slots, demand, unavailable, attempts, seed, gap_lo, gap_hi, stop=None, history=None, stats=None,
+    progress=None,
+):
+    """局所探索 (min-conflicts) で間隔の違反を直していく修復型の探索。
+
+    まず医師を乱択順に、違反量が最小になる空き枠を 1 枠ずつ選んで初期解を作る (空きが尽きたら
+    区分ごとの「医師の必要枠 × 入れる日」の完全マッチングで作る)。入れない日と前回勤務からの
+    間隔はこの時点で守られ、以後も崩さない。残る違反は間隔だけなので、
+    違反量 (gap_lo 未満・gap_hi 超過の日数の合計) が正の医師の枠を 1 つ選び、
+    空き枠への移動か同じ区分の他の医師との入れ替えのうち違反量が最も減る手を打つ。
+    行き詰まっても最初からやり直さず、今の割当を直し続ける。
+
+    attempts は手数の上限。stats["attempts"] に打った手数を、stats["states"] に評価した
+    割当 (初期解の枠 + 手の候補) の数を書き込む。partial には違反のない医師の割当だけを入れる。
+    progress は PROGRESS_EVERY 手ごとに呼ばれる。
+    """
+    rng = random.Random(seed)
+    floor = {doc: d.toordinal() + gap_lo for doc, d in (history or {}).items()}
+    free: Dict[Cat, List[int]] = {}
+    for d, tp in sorted(slots):
+        free.setdefault(_cat(d, tp), []).append(d.toordinal())
+    units = [(doc, c) for doc, cats in demand.items() for c in cats]
+    dom = [
+        [
+            o for o in free.get(c, ())
+            if o >= floor.get(doc, o) and (_dt.date.fromordinal(o), c[1]) not in unavailable.get(doc, ())
+        ]
+        for doc, c in units
+    ]
+    dom_set = [set(v) for v in dom]
+    by_cat: Dict[Cat, List[int]] = {}
+    groups: Dict[str, Dict[tuple, List[int]]] = {doc: {} for doc in demand}
+    for i, (doc, c) in enumerate(units):
+        by_cat.setdefault(c, []).append(i)
+        groups[doc].setdefault(c[0], []).append(i)
+    pos = [0] * len(units)  # 単位 i の日番号 (toordinal)
+    placed: Set[int] = set()  # 日を決めた単位 (初期解を作り終えた後は全単位)
+    holder: Dict[tuple, int] = {}  # (区分, 日番号) -> 単位
+
+    stats = {} if stats is None else stats
+    stats["attempts"] = stats["depth"] = stats["states"] = 0
+    stats["partial"] = {}
+    failures = stats["failures"] = {}
+
+    def viol(g):
+        return gap_lo - g if g < gap_lo else g - gap_hi if g > gap_hi else 0
+
+    def cost(doc):
+        total, prev = 0, None
+        for p in sorted(groups[doc]):
+            days = sorted(pos[i] for i in groups[doc][p] if i in placed)
+            if not days:
+                continue
+            # 月をまたぐ勤務は gap_lo だけを守る
+            if prev is not None and days[0] - prev < gap_lo:
+                total += gap_lo - (days[0] - prev)
+            total += sum(viol(b - a) for a, b in zip(days, days[1:]))
+            prev = days[-1]
+        return total
+
+    def greedy():
+        """医師を乱択順に、各枠で違反量が最小の空き枠を選ぶ。入れる空き枠がなくなれば False"""
+        for doc in rng.sample(list(groups), len(groups)):
+            mine = [i for p in groups[doc].values() for i in p]
+            for i in rng.sample(mine, len(mine)):
+                c = units[i][1]
+                placed.add(i)
+                scored = []
+                for o in dom[i]:
+                    if (c, o) not in holder:
+                        pos[i] = o
+                        scored.append((cost(doc), o))
+                stats["states"] += len(scored)
+                if not scored:
+                    return False
+                low = min(v for v, _ in scored)
+                pos[i] = rng.choice([o for v, o in scored if v == low])
+                holder[c, pos[i]] = i
+        return True
+
+    def init():
+        holder.clear()
+        placed.clear()
+        if greedy():
+            return True
+        # 貪欲に置けなかったときは区分ごとの完全マッチングから始める
+        holder.clear()
+        placed.update(range(len(units)))
+        for c, idx in by_cat.items():
+            owner, unmatched = _matching([rng.sample(dom[i], len(dom[i])) for i in idx])
+            if unmatched:
+                return False
+            for o, k in owner.items():
+                pos[idx[k]] = o
+                holder[c, o] = idx[k]
+        stats["states"] += len(units)
+        return True
+
+    def move(i, o, j):
+        c, old = units[i][1], pos[i]
+        pos[i] = o
+        holder[c, o] = i
+        if j is None:
+            del holder[c, old]
+        else:
+            pos[j] = old
+            holder[c, old] = j
+
+    def collect(docs):
+        return {
+            doc: [(_dt.date.fromordinal(pos[i]), units[i][1][1]) for p in groups[doc].values() for i in p]
+            for doc in docs
+        }
+
+    if not init():
+        return None
+    costs = {doc: cost(doc) for doc in groups}
+    best, since = sum(costs.values()), 0
+    while True:
+        total = sum(costs.values())
+        if total == 0:
+            return collect(groups)
+        if total < best:
+            best, since = total, 0
+        if stats["attempts"] >= attempts or (stop is not None and stop()):
+            break
+        stats["attempts"] += 1
+        if progress is not None and stats["attempts"] % PROGRESS_EVERY == 0:
+            progress(stats["attempts"], stats["depth"])
+        since += 1
+        if since > REPAIR_RESTART:
+            init()
+            costs = {doc: cost(doc) for doc in groups}
+            since = 0
+            continue
+        doc = rng.choice([d for d, v in costs.items() if v])
+        i = rng.choice([i for p in groups[doc].values() for i in p])
+        c = units[i][1]
+        failures[c[1]] = failures.get(c[1], 0) + 1
+        moves = []
+        for o in dom[i]:
+            j = holder.get((c, o))
+            if o == pos[i] or j is not None and (units[j][0] == doc or pos[i] not in dom_set[j]):
+                continue
+            other = units[j][0] if j is not None else None
+            old = pos[i]
+            pos[i] = o
+            if j is not None:
+                pos[j] = old
+            after = cost(doc) + (cost(other) if other else 0)
+            pos[i] = old
+            if j is not None:
+                pos[j] = o
+            moves.append((after - costs[doc] - (costs[other] if other else 0), o, j))
+        stats["states"] += len(moves)
+        if not moves:
+            continue
+        if rng.random() < REPAIR_NOISE:
+            _, o, j = rng.choice(moves)
+        else:
+            low = min(m[0] for m in moves)
+            _, o, j = rng.choice([m for m in moves if m[0] == low])
+        move(i, o, j)
+        costs[doc] = cost(doc)
+        if j is not None:
+            costs[units[j][0]] = cost(units[j][0])
+        done = sum(len(demand[d]) for d, v in costs.items() if not v)
+        if done > stats["depth"]:
+            stats["depth"] = done
+            stats["partial"] = collect([d for d, v in costs.items() if not v])
+    return None
+
+
+def _solve_numpy(*args, **kwargs):
+    """NumPy で多数の乱択割当をまとめて試す (batch_solver)。attempts は作った候補の数"""
+    try:
+        from . import batch_solver
+    except ImportError as e:
+        raise RuntimeError('solver="numpy" には numpy が必要です (pip install "oncall-app[fast]")。') from e
+    return batch_solver.solve(*args, **kwargs)
+
+
+SOLVERS = {
+    "random": _solve_random,
+    "backtrack": _solve_backtrack,
+    "numpy": _solve_numpy,
+    "repair": _solve_repair,
+}
+
+
+# ── 事前チェック (区分ごとの二部マッチング) ──────────────────────────
+
+
+class Infeasible(RuntimeError):
+    """事前チェックで割り当て不可能と分かったときの例外。
+
+    bottlenecks は足りない区分ごとの
+    {"year", "month", "type", "shift", "doctors", "dates", "need"} (dates は ISO 形式の文字列)。
+    doctors の必要枠の合計 need に対し、その医師たちが入れる日は dates しかない。
+    """
+
+    def __init__(self, bottlenecks: List[dict]):
+        self.bottlenecks = bottlenecks
+        super().__init__(
+            "条件を満たす組み合わせがありません。" + " ".join(_describe(b) for b in bottlenecks)
+        )
+
+    def __reduce__(self):
+        # プロセスプールから親へ返すとき bottlenecks を保つ
+        return type(self), (self.bottlenecks,), self.__dict__
+
+
+def _describe(b: dict) -> str:
+    who = "・".join(b["doctors"])
+    if not b["dates"]:
+        return f"{b['year']}年{b['month']}月 {b['shift']}: {who} の入れる日がありません。"
+    days = "・".join(f"{int(d[5:7])}/{int(d[8:])}" for d in b["dates"])
+    return (
+        f"{b['year']}年{b['month']}月 {b['shift']}: {who} の {b['need']} 枠に対し、"
+        f"入れる日は {days} の {len(b['dates'])} 日だけです。"
+    )
+
+
+def _matching(options) -> Tuple[dict, List[int]]:
+    """単位 i が options[i] のどれか 1 つを取る二部マッチング (増加路法)。
+
+    (日 -> 単位 の対応, マッチしなかった単位のリスト) を返す。options の並び順で先に試す日が決まる。
+    """
+    owner: dict = {}
+
+    def augment(i, seen):
+        for d in options[i]:
+            if d in seen:
+                continue
+            seen.add(d)
+            if d not in owner or augment(owner[d], seen):
+                owner[d] = i
+                return True
+        return False
+
+    return owner, [i for i in range(len(options)) if not augment(i, set())]
+
+
+def _bottleneck(units, options) -> Optional[Tuple[List[int], Set[_dt.date]]]:
+    """units[i] が options[i] のどれか 1 日を取る二部マッチング。
+
+    全員に割り当てられないときは、マッチしなかった単位から交互路でたどれる単位の集合 S と
+    その入れる日の集合 N(S) (|N(S)| < |S|、Hall の条件を破る組) を返す。
+    """
+    owner, unmatched = _matching(options)
+    if not unmatched:
+        return None
+    # マッチしなかった単位から交互路でたどれる範囲が不足の原因
+    reach, dates, todo = set(unmatched), set(), list(unmatched)
+    while todo:
+        j = todo.pop()
+        for d in options[j]:
+            if d not in dates:
+                dates.add(d)
+                k = owner.get(d)
+                if k is not None and k not in reach:
+                    reach.add(k)
+                    todo.append(k)
+    return sorted(reach), dates
+
+
+def _precheck(slots, demand, unavailable, gap_lo, history) -> None:
+    """区分 (月, シフト種別) ごとに「医師の必要枠 × 入れる日」の二部マッチングで
+    全員を割り当てられるかを調べ、無理なら Infeasible を送出する。
+
+    間隔の制約は見ないので必要条件にすぎないが、同じ週末に全員が入れない
+    といった入力は探索を始める前に多項式時間で弾ける。
+    """
+    free: Dict[Cat, List[_dt.date]] = {}
+    for d, tp in slots:
+        free.setdefault(_cat(d, tp), []).append(d)
+    floor = {doc: d + _dt.timedelta(days=gap_lo) for doc, d in (history or {}).items()}
+    units: Dict[Cat, List[str]] = {}
+    for doc, cats in demand.items():
+        for c in cats:
+            units.setdefault(c, []).append(doc)
+    out = []
+    for c, docs in units.items():
+        (y, m), tp = c
+        options = [
+            [
+                d for d in free.get(c, ())
+                if (d, tp) not in unavailable.get(doc, ()) and (doc not in floor or d >= floor[doc])
+            ]
+            for doc in docs
+        ]
+        found = _bottleneck(docs, options)
+        if found is None:
+            continue
+        idx, dates = found
+        out.append({
+            "year": y,
+            "month": m,
+            "type": tp,
+            "shift": SHIFT_JP[tp],
+            "doctors": sorted({docs[i] for i in idx}),
+            "dates": [d.isoformat() for d in sorted(dates)],
+            "need": len(idx),
+        })
+    if out:
+        raise Infeasible(out)
+
+
+# ── 並列探索 (複数シードをプロセスプールで同時に試す) ──────────────────
+
+_winner = None  # 子プロセス側: 成功したワーカー番号の最小値 (multiprocessing.Value)
+
+
+def _init_worker(winner):
+    global _winner
+    _winner = winner
+
+
+def _mp_context():
+    """ワーカープロセスの起動方式。スレッドで動くサーバーから fork すると、
+    他のスレッドが持っていたロック (metrics など) を持ったままの状態が子に写るので使わない"""
+    import multiprocessing as mp
+
+    return mp.get_context("forkserver" if "forkserver" in mp.get_all_start_methods() else "spawn")
+
+
+def _worker_seed(seed: int, k: int) -> int:
+    return seed + k * 1_000_003
+
+
+def _run_partition(k, solver, slots, demand, unavailable, attempts, seed, gap_lo, gap_hi, history, time_budget):
+    stats: dict = {}
+    deadline = None if time_budget is None else time.perf_counter() + time_budget
+    assign = SOLVERS[solver](
+        slots, demand, unavailable, attempts, _worker_seed(seed, k), gap_lo, gap_hi,
+        stop=lambda: _winner.value < k or (deadline is not None and time.perf_counter() >= deadline),
+        history=history, stats=stats,
+    )
+    if assign is not None:
+        with _winner.get_lock():
+            _winner.value = min(_winner.value, k)
+    return assign, stats
+
+
+def _solve_parallel(
+    solver, workers, slots, demand, unavailable, attempts, seed, gap_lo, gap_hi, history, stats=None,
+    time_budget=None,
+):
+    """試行回数を workers 個に分け、ワーカー k はシード seed + k * 1000003 で探索する。
+
+    ワーカー k が成功すると k より番号の大きいワーカーは打ち切られる。番号の小さい
+    ワーカーは自分の持ち分を使い切るまで続けるので、採用される解は
+    「成功したうち最小番号のワーカーの解」となり、タイミングによらず再現できる。
+    stats には全ワーカーの試行回数・行き詰まりの種別ごとの回数を合計して書き込み、
+    部分解は最も深く埋まったワーカーのものを使う。time_budget は各ワーカーの制限時間 (秒)。
+    """
+    # 並列モードを使わない限り、起動時にプロセスプール関連を読み込まない
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+
+    ctx = _mp_context()
+    winner = ctx.Value("i", workers)
+    share = -(-attempts // workers)
+    with ProcessPoolExecutor(
+        max_workers=workers, mp_context=ctx, initializer=_init_worker, initargs=(winner,)
+    ) as ex:
+        futs = [
+            ex.submit(
+                _run_partition, k, solver, slots, demand, unavailable, share, seed, gap_lo, gap_hi, history,
+                time_budget,
+            )
+            for k in range(workers)
+        ]
+        for fut in as_completed(futs):
+            if not fut.cancelled() and fut.result()[0] is not None:
+                for f in futs[futs.index(fut) + 1:]:
+                    f.cancel()
+        results = [fut.result() for fut in futs if not fut.cancelled()]
+    if stats is not None:
+        stats["attempts"] = sum(st["attempts"] for _, st in results)
+        deepest = max((st for _, st in results), key=lambda st: st["depth"], default=None)
+        stats["depth"] = deepest["depth"] if deepest else 0
+        stats["partial"] = deepest["partial"] if deepest else {}
+        stats["failures"] = {}
+        for _, st in results:
+            for tp, n in st["failures"].items():
+                stats["failures"][tp] = stats["failures"].get(tp, 0) + n
+    return next((assign for assign, _ in results if assign is not None), None)
+
+
+class Cancelled(RuntimeError):
+    """stop() が真になって探索を打ち切ったときの例外 (解なしとは区別する)"""
+
+
+class Unsolved(RuntimeError):
+    """試行回数か制限時間を使い切っても全枠を埋められなかったときの例外。
+
+    rows は探索中に最も多く埋まった部分解 (make_schedule の戻り値と同じ形) に、
+    残りの枠を貪欲に足したもの。unfilled は埋められなかった枠ごとの
+    {"doctor", "year", "month", "type", "shift", "blocked"} で、blocked はその区分の
+    空き日ごとの {"date", "reason"} (reason は "unavailable" / "history" / "gap")。
+    blocked が空なら、その区分の枠は他の医師ですべて埋まっている。
+    """
+
+    def __init__(self, message: str, rows: list, unfilled: List[dict]):
+        super().__init__(message)
+        self.rows = rows
+        self.unfilled = unfilled
+
+    def __reduce__(self):
+        return type(self), (str(self), self.rows, self.unfilled), self.__dict__
+
+
+def _complete(partial, slots, demand, unavailable, gap_lo, gap_hi, history):
+    """部分解に残りの枠を日付の早い順に貪欲に足し、(行, 埋められなかった枠) を返す"""
+    taken = {(d, tp) for picks in partial.values() for d, tp in picks}
+    free: Dict[Cat, List[_dt.date]] = {}
+    for d, tp in sorted(slots):
+        if (d, tp) not in taken:
+            free.setdefault(_cat(d, tp), []).append(d)
+    floor = {doc: d + _dt.timedelta(days=gap_lo) for doc, d in (history or {}).items()}
+    assign = {doc: list(partial.get(doc, ())) for doc in demand}
+    unfilled = []
+    for doc, cats in demand.items():
+        have = [_cat(d, tp) for d, tp in assign[doc]]
+        missing = list(cats)
+        for c in have:
+            missing.remove(c)
+        for n, c in enumerate(sorted(missing)):
+            (y, m), tp = c
+            left = sum(1 for x in missing[n + 1:] if x[0] == c[0])
+            blocked = []
+            for d in free.get(c, ()):
+                month = [x for x, t in assign[doc] if (x.year, x.month) == c[0]]
+                others = [x for x, t in assign[doc] if (x.year, x.month) != c[0]]
+                if (d, tp) in unavailable.get(doc, ()):
+                    why = "unavailable"
+                elif doc in floor and d < floor[doc]:
+                    why = "history"
+                elif not gap_feasible(month + [d], left, gap_lo, gap_hi) or any(
+                    abs((d - x).days) < gap_lo for x in others
+                ):
+                    why = "gap"
+                else:
+                    assign[doc].append((d, tp))
+                    free[c].remove(d)
+                    break
+                blocked.append({"date": d.isoformat(), "reason": why})
+            else:
+                unfilled.append({
+                    "doctor": doc, "year": y, "month": m, "type": tp, "shift": SHIFT_JP[tp],
+                    "blocked": blocked,
+                })
+    return _to_rows(assign), unfilled
+
+
+def _schedule(
+    periods, doctors, unavailable, attempts, seed, gap_lo, gap_hi, solver, workers, history, stats=None,
+    stop=None, progress=None, time_budget=None, quotas=None,
+):
+    if solver not in SOLVERS:
+        raise ValueError(f"不明なソルバー: {solver}")
+    for d in doctors:
+        unavailable.setdefault(d, set())
+
+    slots = [s for y, m in periods for s in _month_slots(y, m)]
+    quota = resolve_quotas(doctors, quotas)
+    demand = {doc: quota_demand(periods, quota[doc]) for doc in doctors}
+
+    # 枠数チェック
+    need = {tp: sum(q[tp] for q in quota.values()) for tp in REQUIRED}
+    for y, m in periods:
+        month_slots = _month_slots(y, m)
+        if any(sum(1 for _, t in month_slots if t == tp) < need[tp] for tp in REQUIRED):
+            if len(periods) == 1:
+                raise RuntimeError("この月はシフト枠が不足しています。")
+            raise RuntimeError(f"{y}年{m}月はシフト枠が不足しています。")
+
+    _precheck(slots, demand, unavailable, gap_lo, history)
+
+    stats = {} if stats is None else stats
+    t0 = time.perf_counter()
+    deadline = None if time_budget is None else t0 + time_budget
+
+    def timed_out():
+        return deadline is not None and time.perf_counter() >= deadline
+
+    def halt():
+        return (stop is not None and stop()) or timed_out()
+    if workers > 1:
+        assign = _solve_parallel(
+            solver, workers, slots, demand, unavailable, attempts, seed, gap_lo, gap_hi, history, stats,
+            time_budget,
+        )
+    else:
+        assign = SOLVERS[solver](
+            slots, demand, unavailable, attempts, seed, gap_lo, gap_hi,
+            stop=stop if deadline is None else halt, history=history, stats=stats, progress=progress,
+        )
+    cancelled = assign is None and stop is not None and stop()
+    result = "cancelled" if cancelled else "failed" if assign is None else "ok"
+    _observe(solver, stats, time.perf_counter() - t0, result)
+    if cancelled:
+        raise Cancelled("シフト作成を中断しました。")
+    if assign is None:
+        rows, unfilled = _complete(
+            stats.get("partial") or {}, slots, demand, unavailable, gap_lo, gap_hi, history,
+        )
+        if not unfilled:  # 貪欲に足しただけで全枠が埋まった
+            return rows
+        if timed_out():
+            raise Unsolved(f"制限時間内に全枠を埋められませんでした (未割当 {len(unfilled)} 枠)。", rows, unfilled)
+        raise Unsolved("条件を満たす組み合わせが見つかりませんでした。", rows, unfilled)
+    return _to_rows(assign)
+
+
+# 病棟ごとのワーカープロセスでは指標をここにためて親に返す (子の metrics は親に届かない)
+_deferred: Optional[list] = None
+
+
+def _observe(solver, stats, seconds, result) -> None:
+    if _deferred is not None:
+        kept = {"attempts": stats.get("attempts", 0), "failures": stats.get("failures", {})}
+        _deferred.append((solver, kept, seconds, result))
+        return
+    metrics.solver_runs.inc(solver=solver, result=result)
+    metrics.solver_seconds.observe(seconds, solver=solver)
+    used = stats.get("attempts", 0)
+    metrics.solver_attempts.inc(used, solver=solver)
+    if used:
+        metrics.solver_attempt_seconds.observe(seconds / used, solver=solver)
+    for tp, n in stats.get("failures", {}).items():
+        metrics.solver_failures.inc(n, solver=solver, slot_type=tp)
+
+
 def make_schedule(
     year: int,
     month: int,
@@ -35,52 +1029,168 @@ def make_schedule(
     seed=42,
     gap_lo=5,
     gap_hi=8,
+    solver="random",
+    workers=1,
+    history: Optional[Dict[str, _dt.date]] = None,
+    stats: Optional[dict] = None,
+    stop: Optional[Callable[[], bool]] = None,
+    progress: Optional[Callable[[int, int], None]] = None,
+    time_budget: Optional[float] = None,
+    quotas: Optional[Dict[str, Dict[str, int]]] = None,
 ):
-    random.seed(seed)
-    for d in doctors:
-        unavailable.setdefault(d, set())
+    """history: 医師ごとの前月までの最終勤務日。その日から gap_lo 日未満の枠には入れない
+    stats: 渡すと探索で使った試行回数 (バックトラックは行き止まりの数) を stats["attempts"] に書き込む
+    stop: 真を返すと探索を打ち切り Cancelled を送出する (workers=1 のときのみ)
+    progress: 探索中に progress(試行回数, 同時に埋まった枠数の最大) で呼ばれる (workers=1 のときのみ)
+    time_budget: 探索の制限時間 (秒)。attempts と先に尽きた方で打ち切る
+    quotas: 医師ごとの 1 か月あたりの枠数 {医師: {シフト種別: 枠数}}。指定のない種別は REQUIRED
 
-    slots = generate_shift_slots(year, month)
-    stock = {tp: [d for d, t in slots if t == tp] for tp in REQUIRED}
+    全枠を埋められなかったときは、最良の部分解と埋められなかった枠を持つ Unsolved を送出する。
+    """
+    return _schedule(
+        [(year, month)], doctors, unavailable, attempts, seed, gap_lo, gap_hi, solver, workers, history,
+        stats, stop, progress, time_budget, quotas,
+    )
 
-    # 枠数チェック
-    if any(len(stock[tp]) < REQUIRED[tp] * len(doctors) for tp in REQUIRED):
-        raise RuntimeError("この月はシフト枠が不足しています。")
 
-    def try_once():
-        pool = {k: v[:] for k, v in stock.items()}
-        for v in pool.values():
-            random.shuffle(v)
-        assign = {}
-        for doc in random.sample(doctors, len(doctors)):
-            picks = []
-            # ── 4 枠の割当順をランダムに ──
-            typ_list = ["WE_DAY", "WE_NIGHT", "WD_NIGHT", "WD_NIGHT"]
-            random.shuffle(typ_list)
-            for typ in typ_list:
-                cand = [
-                    d
-                    for d in pool[typ]
-                    if (d, typ) not in unavailable[doc] and ok_gap(picks + [d], gap_lo, gap_hi)
-                ]
-                if not cand:
-                    return None
-                ch = random.choice(cand)
-                picks.append(ch)
-                pool[typ].remove(ch)
-            assign[doc] = list(zip(picks, typ_list))
-        # 成功
-        return sorted(
-            [
-                {"Date": d, "Shift": SHIFT_JP[tp], "Doctor": doc}
-                for doc, l in assign.items()
-                for d, tp in l
-            ],
-            key=lambda r: (r["Date"], r["Shift"]),
+def make_horizon_schedule(
+    year: int,
+    month: int,
+    months: int,
+    doctors: List[str],
+    unavailable: Dict[str, Set[tuple]],
+    attempts=30000,
+    seed=42,
+    gap_lo=5,
+    gap_hi=8,
+    solver="repair",
+    workers=1,
+    history: Optional[Dict[str, _dt.date]] = None,
+    quotas: Optional[Dict[str, Dict[str, int]]] = None,
+):
+    """(year, month) から months か月分のシフト表をまとめて作る。
+
+    各医師は毎月 REQUIRED (quotas で医師ごとに変更可) の枠を受け持つ。
+    間隔 [gap_lo, gap_hi] は月の中で守り、
+    月をまたぐ勤務は make_schedule の history と同じく gap_lo 日以上空ける。
+
+    まず先頭の月から順に、前月までの最終勤務を引き継ぎながら 1 か月ずつ解く
+    (枠と祝日の表は lru_cache で共有される)。途中の月で行き詰まったときだけ、
+    期間全体を 1 つの問題としてまとめて探索し直す。
+    """
+    if months < 1:
+        raise ValueError("months は 1 以上にしてください。")
+    periods = month_range(year, month, months)
+    try:
+        rows: list = []
+        carry = dict(history or {})
+        for p in periods:
+            part = _schedule(
+                [p], doctors, unavailable, attempts, seed, gap_lo, gap_hi, solver, workers, carry, quotas=quotas,
+            )
+            rows += part
+            carry.update(last_shifts(part))
+        return rows
+    except RuntimeError:
+        return _schedule(
+            periods, doctors, unavailable, attempts, seed, gap_lo, gap_hi, solver, workers, history,
+            quotas=quotas,
         )
 
-    for _ in range(attempts):
-        res = try_once()
-        if res:
-            return res
-    raise RuntimeError("条件を満たす組み合わせが見つかりませんでした。")
\ No newline at end of file
+
+def make_department_schedule(
+    year: int,
+    month: int,
+    wards: Dict[str, List[str]],
+    unavailable: Dict[str, Set[tuple]],
+    quotas: Optional[Dict[str, Dict[str, int]]] = None,
+    groups: Optional[Dict[str, dict]] = None,
+    workers: Optional[int] = None,
+    **kwargs,
+) -> Dict[str, list]:
+    """病棟ごとのシフト表 {病棟名: 行} をまとめて作る。
+
+    wards は {病棟名: 医師のリスト}。病棟はそれぞれ月の全枠を持つ別々の当直表なので、
+    互いに依存しない部分問題として workers 個 (既定は CPU 数) のプロセスで同時に解く。
+    quotas / groups は resolve_quotas と同じ形式で、病棟をまたいで指定できる。
+    kwargs は make_schedule に渡す (プロセスをまたぐので stop / progress は使えない)。
+    解けない病棟があれば、病棟名を ward 属性に付けた例外を送出する (病棟の並びで最初のもの)。
+    """
+    seen: Dict[str, str] = {}
+    for name, docs in wards.items():
+        for doc in docs:
+            if doc in seen:
+                raise ValueError(f"{doc} が {seen[doc]} と {name} の両方に入っています。")
+            seen[doc] = name
+    quota = resolve_quotas(list(seen), quotas, groups)
+    jobs = {
+        name: (
+            year, month, list(docs), {doc: set(unavailable.get(doc, ())) for doc in docs},
+            dict(kwargs, quotas={doc: quota[doc] for doc in docs}),
+        )
+        for name, docs in wards.items()
+    }
+    workers = min(workers or os.cpu_count() or 1, len(jobs))
+    out: Dict[str, list] = {}
+    if workers <= 1:
+        for name, (y, m, docs, unavail, kw) in jobs.items():
+            out[name] = _ward_schedule(name, y, m, docs, unavail, kw)[0]
+        return out
+
+    from concurrent.futures import ProcessPoolExecutor
+
+    error = None
+    with ProcessPoolExecutor(max_workers=workers, mp_context=_mp_context(), initializer=_init_ward_worker) as ex:
+        futs = {name: ex.submit(_ward_schedule, name, *job) for name, job in jobs.items()}
+        for name, fut in futs.items():
+            try:
+                out[name] = fut.result()[0]
+            except BaseException as e:
+                error = e
+                for f in futs.values():
+                    f.cancel()
+                break
+    # プールを閉じる (実行中の病棟が終わる) のを待ってから、子で記録した指標をまとめて反映する
+    for fut in futs.values():
+        if fut.cancelled():
+            continue
+        e = fut.exception()
+        for args in getattr(e, "observed", ()) if e is not None else fut.result()[1]:
+            _observe(*args)
+    if error is not None:
+        raise error
+    return out
+
+
+def _init_ward_worker():
+    global _deferred
+    _deferred = []
+
+
+def _take_deferred() -> list:
+    if _deferred is None:
+        return []
+    out = _deferred[:]
+    _deferred.clear()
+    return out
+
+
+def _ward_schedule(name, year, month, doctors, unavailable, kwargs) -> tuple:
+    """(行, ワーカープロセスで保留した _observe の引数のリスト)"""
+    try:
+        rows = make_schedule(year, month, doctors, unavailable, **kwargs)
+    except RuntimeError as e:
+        e.ward = name
+        e.observed = _take_deferred()
+        raise
+    return rows, _take_deferred()
+
+
+def last_shifts(rows) -> Dict[str, _dt.date]:
+    """既存のシフト表 (Date, Shift, Doctor の行) から医師ごとの最終勤務日を取り出す"""
+    out: Dict[str, _dt.date] = {}
+    for r in rows:
+        d = r["Date"] if isinstance(r["Date"], _dt.date) else _dt.date.fromisoformat(r["Date"])
+        if r["Doctor"] not in out or d > out[r["Doctor"]]:
+            out[r["Doctor"]] = d
+    return out
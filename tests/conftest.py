@@ -0,0 +1,5 @@
+import os
+import tempfile
+
+# テストでは作業ツリーの data/survey.db を汚さないよう一時ディレクトリの DB を使う
+os.environ.setdefault("SURVEY_DB_PATH", os.path.join(tempfile.mkdtemp(), "survey.db"))
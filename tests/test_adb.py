@@ -0,0 +1,75 @@
+import asyncio
+import threading
+import time
+import uuid
+
+from oncall_app import adb, db
+
+db.init_db()
+
+
+def _concurrency(calls):
+    """calls 個の (await する関数) を同時に走らせ、同時に実行中だった数の最大"""
+    state = {"now": 0, "max": 0}
+    lock = threading.Lock()
+
+    def work():
+        with lock:
+            state["now"] += 1
+            state["max"] = max(state["max"], state["now"])
+        time.sleep(0.02)
+        with lock:
+            state["now"] -= 1
+
+    async def main():
+        await asyncio.gather(*(call(work) for call in calls))
+
+    asyncio.run(main())
+    return state["max"]
+
+
+class TestAsyncDb:
+    def test_roundtrip(self):
+        async def main():
+            survey_id = uuid.uuid4().hex[:12]
+            await adb.create_survey(survey_id, "t", 2024, 6, ["医師A"], 5, 8)
+            await adb.upsert_response(survey_id, "医師A", ["2024-06-01|DAY"])
+            survey = await adb.get_survey(survey_id)
+            results = await adb.get_survey_results(survey_id)
+            assert await adb.delete_survey(survey_id)
+            return survey, results
+
+        survey, results = asyncio.run(main())
+        assert survey["docs"] == ["医師A"]
+        assert results["responses"][0]["blocked"] == ["2024-06-01|DAY"]
+
+    def test_runs_on_db_threads(self):
+        async def main():
+            return (
+                await adb.read(lambda: threading.current_thread().name),
+                await adb.write(lambda: threading.current_thread().name),
+            )
+
+        reader, writer = asyncio.run(main())
+        assert reader.startswith("db-read") and writer.startswith("db-write")
+
+    def test_writes_one_at_a_time(self):
+        assert _concurrency([adb.write] * 6) == 1
+
+    def test_reads_bounded(self):
+        peak = _concurrency([adb.read] * (adb.READERS + 4))
+        assert 1 < peak <= adb.READERS
+
+    def test_loop_not_blocked_by_slow_write(self, monkeypatch):
+        monkeypatch.setattr(db, "upsert_response", lambda *a: time.sleep(0.3))
+
+        async def main():
+            write = asyncio.ensure_future(adb.upsert_response("s", "医師A", []))
+            lag = 0.0
+            while not write.done():
+                t0 = time.perf_counter()
+                await asyncio.sleep(0.005)
+                lag = max(lag, time.perf_counter() - t0 - 0.005)
+            return lag
+
+        assert asyncio.run(main()) < 0.1
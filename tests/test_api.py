@@ -1,3 +1,8 @@
+import asyncio
+import datetime as _dt
+import json
+import time
+
 import pytest
 from starlette.testclient import TestClient
 
@@ -51,6 +56,12 @@ class TestApiCalendar:
         assert "is_holiday" in day
         assert "in_month" in day
 
+    def test_weeks_not_shared_between_calls(self):
+        from oncall_app import routes
+
+        routes._build_weeks(2024, 6)[0][0]["day"] = 99
+        assert routes._build_weeks(2024, 6)[0][0]["day"] != 99
+
     def test_docs_whitespace_trimmed(self):
         res = client.post("/api/calendar", data={
             "year": 2024, "month": 6, "docs": " 医師A , 医師B ",
@@ -92,6 +103,25 @@ class TestApiSchedule:
         for doc in ["医師A", "医師B", "医師C"]:
             assert counts[doc] == 4
 
+    def test_backtrack_solver(self):
+        res = client.post("/api/schedule", data={
+            "year": 2024, "month": 6,
+            "docs": "医師A,医師B,医師C",
+            "gap_lo": 5, "gap_hi": 8,
+            "solver": "backtrack",
+        })
+        assert res.status_code == 200
+        assert len(res.json()["rows"]) == 12
+
+    def test_unknown_solver_returns_error(self):
+        res = client.post("/api/schedule", data={
+            "year": 2024, "month": 6,
+            "docs": "医師A",
+            "gap_lo": 5, "gap_hi": 8,
+            "solver": "nope",
+        })
+        assert res.status_code == 422
+
     def test_impossible_schedule_returns_error(self):
         many_docs = ",".join([f"医師{i}" for i in range(50)])
         res = client.post("/api/schedule", data={
@@ -104,6 +134,293 @@ class TestApiSchedule:
         assert "error" in res.json()
 
 
+class TestScheduleStream:
+    # 間隔 11 日以上で 4 枠は 6 月に収まらないので、試行回数を使い切るまで探索が続く
+    SLOW = {"year": 2024, "month": 6, "docs": "医師A,医師B", "gap_lo": 11, "gap_hi": 12}
+
+    def _events(self, text):
+        return [line[len("event: "):] for line in text.splitlines() if line.startswith("event: ")]
+
+    def test_done_event_has_rows(self):
+        res = client.post("/api/schedule/stream", data=dict(self.SLOW, gap_lo=5, gap_hi=8))
+        assert res.headers["content-type"].startswith("text/event-stream")
+        assert self._events(res.text) == ["queued", "done"]
+        payload = json.loads(res.text.strip().splitlines()[-1][len("data: "):])
+        assert len(payload["rows"]) == 8 and payload["tok"]
+
+    def test_progress_then_error(self):
+        res = client.post("/api/schedule/stream", data=self.SLOW)
+        events = self._events(res.text)
+        assert events[0] == "queued" and events[-1] == "error"
+        assert "progress" in events
+        first = next(l for l in res.text.splitlines() if l.startswith("data: {\"attempts\""))
+        data = json.loads(first[len("data: "):])
+        assert data["attempts"] > 0 and data["total"] == 8 and 0 <= data["depth"] < 8
+
+    def test_disconnect_stops_search(self):
+        from urllib.parse import urlencode
+        from oncall_app import routes
+
+        async def main():
+            # 他のテストで解なしがキャッシュされないよう医師を変える
+            body = urlencode(dict(self.SLOW, docs="医師C,医師D")).encode()
+            disconnected = asyncio.Event()
+            state = {"sent": False}
+
+            async def receive():
+                if not state["sent"]:
+                    state["sent"] = True
+                    return {"type": "http.request", "body": body, "more_body": False}
+                await disconnected.wait()
+                return {"type": "http.disconnect"}
+
+            async def send(msg):
+                if msg["type"] == "http.response.body" and b"event: progress" in msg.get("body", b""):
+                    disconnected.set()
+
+            scope = {
+                "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1",
+                "method": "POST", "scheme": "http", "path": "/api/schedule/stream",
+                "raw_path": b"/api/schedule/stream", "root_path": "", "query_string": b"",
+                "headers": [(b"content-type", b"application/x-www-form-urlencoded")],
+                "client": ("test", 0), "server": ("test", 80),
+            }
+            await app(scope, receive, send)
+
+        before = set(routes.jobs._jobs)
+        asyncio.run(main())
+        (job_id,) = set(routes.jobs._jobs) - before
+        deadline = time.time() + 5
+        while routes.jobs.get(job_id)["status"] not in ("done", "failed") and time.time() < deadline:
+            time.sleep(0.01)
+        assert routes.jobs.get(job_id)["error"] == "シフト作成を中断しました。"
+
+
+class TestPrecheck:
+    def _post(self):
+        # 全員が 6/1・6/2 以外の土日祝の日直に入れない
+        days = ["2024-06-08", "2024-06-09", "2024-06-15", "2024-06-16",
+                "2024-06-22", "2024-06-23", "2024-06-29", "2024-06-30"]
+        docs = ["医師A", "医師B", "医師C"]
+        return client.post("/api/schedule", data={
+            "year": 2024, "month": 6, "docs": ",".join(docs),
+            "unavail": ",".join(f"{d}|{day}|DAY" for d in docs for day in days),
+            "gap_lo": 5, "gap_hi": 8,
+        })
+
+    def test_returns_bottlenecks(self):
+        t0 = time.perf_counter()
+        res = self._post()
+        assert time.perf_counter() - t0 < 1.0
+        assert res.status_code == 422
+        (b,) = res.json()["bottlenecks"]
+        assert b["type"] == "WE_DAY"
+        assert b["dates"] == ["2024-06-01", "2024-06-02"]
+        assert "休日 日直" in res.json()["error"]
+
+    def test_cached_error_keeps_bottlenecks(self):
+        first = self._post().json()
+        assert self._post().json() == first
+
+
+class TestTimeBudget:
+    DATA = {
+        "year": 2024, "month": 6, "docs": ",".join(f"医師{i}" for i in range(7)),
+        "gap_lo": 6, "gap_hi": 7, "time_budget": 0.1,
+    }
+
+    def test_partial_result_in_422(self):
+        res = client.post("/api/schedule", data=self.DATA)
+        assert res.status_code == 422
+        body = res.json()
+        assert body["rows"] and body["unfilled"]
+        assert len(body["rows"]) + len(body["unfilled"]) == 28
+        assert isinstance(body["rows"][0]["Date"], str)
+
+    def test_budget_failure_not_cached(self):
+        before = client.get("/api/schedule/cache").json()["size"]
+        client.post("/api/schedule", data=self.DATA)
+        assert client.get("/api/schedule/cache").json()["size"] == before
+
+    def test_attempts_failure_cached_with_partial(self):
+        data = dict(self.DATA, docs="医師X,医師Y", gap_lo=11, gap_hi=12, time_budget=0)
+        first = client.post("/api/schedule", data=data).json()
+        second = client.post("/api/schedule", data=data).json()
+        assert first["unfilled"] and second == first
+
+
+class TestHorizon:
+    DATA = {"year": 2024, "month": 6, "docs": "医師A,医師B,医師C", "gap_lo": 5, "gap_hi": 8}
+
+    def test_horizon_rows(self):
+        res = client.post("/api/schedule/horizon", data=dict(self.DATA, months=3))
+        assert res.status_code == 200
+        data = res.json()
+        assert data["months"] == 3
+        assert len(data["rows"]) == 4 * 3 * 3
+        assert {r["Date"][:7] for r in data["rows"]} == {"2024-06", "2024-07", "2024-08"}
+
+    def test_months_out_of_range(self):
+        res = client.post("/api/schedule/horizon", data=dict(self.DATA, months=13))
+        assert res.status_code == 422
+
+    def test_prev_tok_carries_gap(self):
+        prev = client.post("/api/schedule", data=self.DATA).json()
+        last = {}
+        for r in prev["rows"]:
+            last[r["Doctor"]] = max(last.get(r["Doctor"], ""), r["Date"])
+        res = client.post("/api/schedule", data=dict(self.DATA, month=7, prev_tok=prev["tok"]))
+        assert res.status_code == 200
+        for r in res.json()["rows"]:
+            gap = (_dt.date.fromisoformat(r["Date"]) - _dt.date.fromisoformat(last[r["Doctor"]])).days
+            assert gap >= 5
+
+    def test_unknown_prev_tok(self):
+        res = client.post("/api/schedule", data=dict(self.DATA, prev_tok="nope"))
+        assert res.status_code == 404
+
+    def test_explicit_history(self):
+        history = "医師A|2024-06-30,医師B|2024-06-29,医師C|2024-06-28"
+        res = client.post("/api/schedule", data=dict(self.DATA, month=7, history=history))
+        assert res.status_code == 200
+        last = dict(item.split("|") for item in history.split(","))
+        for r in res.json()["rows"]:
+            gap = (_dt.date.fromisoformat(r["Date"]) - _dt.date.fromisoformat(last[r["Doctor"]])).days
+            assert gap >= 5
+
+    def test_bad_history(self):
+        res = client.post("/api/schedule", data=dict(self.DATA, history="医師A|06/30"))
+        assert res.status_code == 422
+
+    def test_unknown_prev_survey(self):
+        res = client.post("/api/schedule/horizon", data=dict(self.DATA, months=2, prev_survey="nope"))
+        assert res.status_code == 404
+
+
+class TestDepartment:
+    BODY = {
+        "year": 2024, "month": 6,
+        "wards": {"内科": ["内科1", "内科2", "内科3"], "外科": ["外科1", "外科2", "外科3", "外科4"]},
+        "unavail": ["内科1|2024-06-01|DAY"],
+        "groups": {"研修医": {"doctors": ["外科3", "外科4"], "quota": {"WE_DAY": 0}}},
+        "quotas": {"内科2": {"WD_NIGHT": 3}},
+    }
+
+    def test_wards_and_quotas(self):
+        res = client.post("/api/schedule/department", json=self.BODY)
+        assert res.status_code == 200
+        wards = res.json()["wards"]
+        assert set(wards) == {"内科", "外科"}
+        count = {}
+        for ward in wards.values():
+            assert ward["tok"]
+            for r in ward["rows"]:
+                count[r["Doctor"]] = count.get(r["Doctor"], 0) + 1
+        assert count == {"内科1": 4, "内科2": 5, "内科3": 4, "外科1": 4, "外科2": 4, "外科3": 3, "外科4": 3}
+        assert not any(
+            r["Doctor"] == "内科1" and r["Date"] == "2024-06-01" and r["Shift"] == "休日 日直"
+            for r in wards["内科"]["rows"]
+        )
+
+    def test_bad_request(self):
+        res = client.post("/api/schedule/department", json={"year": 2024, "month": 6, "wards": []})
+        assert res.status_code == 422
+        res = client.post("/api/schedule/department", json=dict(self.BODY, quotas={"誰か": {"WE_DAY": 1}}))
+        assert res.status_code == 422
+        assert "誰か" in res.json()["error"]
+
+    def test_failed_ward_is_named(self):
+        body = {"year": 2024, "month": 6, "wards": {"内科": ["内科1"], "大所帯": [f"医師{i}" for i in range(20)]}}
+        res = client.post("/api/schedule/department", json=body)
+        assert res.status_code == 422
+        assert res.json()["ward"] == "大所帯"
+
+
+class TestScheduleCache:
+    def _post(self, docs):
+        return client.post("/api/schedule", data={
+            "year": 2024, "month": 7,
+            "docs": docs,
+            "unavail": "医師B|2024-07-06|DAY",
+            "gap_lo": 5, "gap_hi": 8,
+        })
+
+    def test_generic_error_not_cached(self, monkeypatch):
+        from oncall_app import routes
+
+        def broken(*args, **kwargs):
+            raise RuntimeError("NumPy がありません。")
+
+        monkeypatch.setattr(routes, "make_schedule", broken)
+        assert self._post("医師B,医師E,医師F").status_code == 422
+        monkeypatch.undo()
+        assert len(self._post("医師B,医師E,医師F").json()["rows"]) == 12
+
+    def test_repeat_request_hits_cache(self):
+        first = self._post("医師A,医師B,医師C").json()
+        before = client.get("/api/schedule/cache").json()["hits"]
+        second = self._post("医師C,医師A,医師B").json()
+        assert client.get("/api/schedule/cache").json()["hits"] == before + 1
+        assert second["rows"] == first["rows"]
+        assert second["tok"] != first["tok"]
+
+
+class TestScheduleJobs:
+    def _submit(self, docs="医師A,医師B,医師C"):
+        return client.post("/api/schedule/jobs", data={
+            "year": 2024, "month": 6,
+            "docs": docs,
+            "unavail": "",
+            "gap_lo": 5, "gap_hi": 8,
+        })
+
+    def _poll(self, job_id):
+        for _ in range(500):
+            data = client.get(f"/api/schedule/jobs/{job_id}").json()
+            if data["status"] in ("done", "failed"):
+                return data
+            time.sleep(0.01)
+        raise AssertionError("job did not finish")
+
+    def test_submit_returns_job_id(self):
+        res = self._submit()
+        assert res.status_code == 202
+        data = res.json()
+        assert isinstance(data["job_id"], str)
+        assert "queue_depth" in data
+
+    def test_job_result(self):
+        job_id = self._submit().json()["job_id"]
+        data = self._poll(job_id)
+        assert data["status"] == "done"
+        assert len(data["result"]["rows"]) == 12
+        assert client.get(f"/csv?tok={data['result']['tok']}").status_code == 200
+
+    def test_failed_job_reports_error(self):
+        many_docs = ",".join([f"医師{i}" for i in range(50)])
+        data = self._poll(self._submit(many_docs).json()["job_id"])
+        assert data["status"] == "failed"
+        assert data["error"]
+
+    def test_infeasible_job_reports_bottlenecks(self):
+        job_id = client.post("/api/schedule/jobs", data={
+            "year": 2024, "month": 6, "docs": "医師P,医師Q",
+            "unavail": ",".join(f"医師P|2024-06-{d:02d}|DAY" for d in (1, 2, 8, 9, 15, 16, 22, 23, 29, 30)),
+            "gap_lo": 5, "gap_hi": 8,
+        }).json()["job_id"]
+        data = self._poll(job_id)
+        assert data["status"] == "failed"
+        assert data["error"]
+        assert data["bottlenecks"][0]["doctors"] == ["医師P"]
+
+    def test_unknown_job_returns_404(self):
+        assert client.get("/api/schedule/jobs/nope").status_code == 404
+
+    def test_queue_stats(self):
+        data = client.get("/api/schedule/jobs").json()
+        assert set(data) == {"workers", "queued", "running", "max_queue"}
+
+
 class TestCsvDownload:
     def _get_tok(self):
         res = client.post("/api/schedule", data={
@@ -148,3 +465,294 @@ class TestSpaRoutes:
         res = client.get("/schedule")
         assert res.status_code == 200
         assert "text/html" in res.headers["content-type"]
+
+
+class TestHttpCache:
+    def _survey(self):
+        return client.post("/api/surveys", data={
+            "title": "etag", "year": 2024, "month": 6, "docs": "医師A,医師B",
+        }).json()["id"]
+
+    def test_survey_304(self):
+        url = f"/api/surveys/{self._survey()}"
+        res = client.get(url)
+        assert res.headers["cache-control"] == "no-cache"
+        assert res.headers["last-modified"].endswith("GMT")
+        again = client.get(url, headers={"If-None-Match": res.headers["etag"]})
+        assert again.status_code == 304
+        assert again.content == b""
+        assert again.headers["etag"] == res.headers["etag"]
+        since = client.get(url, headers={"If-Modified-Since": res.headers["last-modified"]})
+        assert since.status_code == 304
+
+    def test_survey_etag_mismatch_returns_body(self):
+        url = f"/api/surveys/{self._survey()}"
+        res = client.get(url, headers={"If-None-Match": '"other"'})
+        assert res.status_code == 200
+        assert res.json()["docs"] == ["医師A", "医師B"]
+
+    def test_results_etag_changes_on_response(self):
+        survey_id = self._survey()
+        url = f"/api/surveys/{survey_id}/results"
+        etag = client.get(url).headers["etag"]
+        assert client.get(url, headers={"If-None-Match": etag}).status_code == 304
+        client.post(f"/api/surveys/{survey_id}/responses", data={
+            "doctor": "医師A", "blocked": "2024-06-01|DAY",
+        })
+        res = client.get(url, headers={"If-None-Match": etag})
+        assert res.status_code == 200
+        assert res.headers["etag"] != etag
+        assert res.json()["pending"] == ["医師B"]
+
+    def test_calendar_get(self):
+        res = client.get("/api/calendar/2024/6")
+        assert res.status_code == 200
+        assert res.json()["weeks"] == client.post("/api/calendar", data={
+            "year": 2024, "month": 6, "docs": "医師A", "gap_lo": 5, "gap_hi": 8,
+        }).json()["weeks"]
+        again = client.get("/api/calendar/2024/6", headers={"If-None-Match": res.headers["etag"]})
+        assert again.status_code == 304
+        since = client.get("/api/calendar/2024/6", headers={"If-Modified-Since": res.headers["last-modified"]})
+        assert since.status_code == 304
+        assert client.get("/api/calendar/2024/13").status_code == 422
+
+    def test_index_revalidates(self):
+        res = client.get("/")
+        assert res.headers["cache-control"] == "no-cache"
+        again = client.get("/survey/x", headers={"If-None-Match": res.headers["etag"]})
+        assert again.status_code == 304
+
+    def test_assets_immutable(self):
+        from oncall_app.oncall_app import STATIC_DIR
+        name = next(p.name for p in (STATIC_DIR / "assets").iterdir() if p.suffix == ".js")
+        res = client.get(f"/assets/{name}")
+        assert res.status_code == 200
+        assert res.headers["cache-control"] == "public, max-age=31536000, immutable"
+        assert res.headers["vary"] == "Accept-Encoding"
+
+    def test_precompressed_assets(self, tmp_path):
+        import gzip
+
+        from starlette.applications import Starlette
+        from starlette.routing import Mount
+
+        from oncall_app.http_cache import PrecompressedStaticFiles
+        from oncall_app.precompress import precompress
+
+        body = b"console.log('x');\n" * 200
+        (tmp_path / "app-abc.js").write_bytes(body)
+        (tmp_path / "tiny.js").write_bytes(b"1")
+        assert [p.name for p in precompress(tmp_path)][0] == "app-abc.js.gz"
+        assets = TestClient(Starlette(routes=[
+            Mount("/assets", PrecompressedStaticFiles(directory=tmp_path)),
+        ]))
+        res = assets.get("/assets/app-abc.js", headers={"Accept-Encoding": "gzip"})
+        assert res.headers["content-encoding"] == "gzip"
+        assert "javascript" in res.headers["content-type"]
+        assert res.content == body  # httpx が展開する
+        assert int(res.headers["content-length"]) == len(gzip.compress(body, 9, mtime=0))
+        plain = assets.get("/assets/app-abc.js", headers={"Accept-Encoding": "gzip;q=0"})
+        assert "content-encoding" not in plain.headers
+        assert int(plain.headers["content-length"]) == len(body)
+        assert "content-encoding" not in assets.get(
+            "/assets/tiny.js", headers={"Accept-Encoding": "gzip"},
+        ).headers
+        again = assets.get("/assets/app-abc.js", headers={
+            "Accept-Encoding": "gzip", "If-None-Match": res.headers["etag"],
+        })
+        assert again.status_code == 304
+
+
+class TestMetrics:
+    def test_not_shadowed_by_spa(self):
+        res = client.get("/metrics")
+        assert res.status_code == 200
+        assert res.headers["content-type"].startswith("text/plain")
+        assert "# TYPE oncall_http_request_duration_seconds histogram" in res.text
+
+    def test_records_route_solver_and_db(self):
+        client.post("/api/schedule", data={
+            "year": 2024, "month": 9, "docs": "医師A,医師B", "gap_lo": 5, "gap_hi": 8,
+        })
+        client.get("/api/surveys")
+        text = client.get("/metrics").text
+        assert 'route="/api/schedule",status="200"' in text
+        assert 'oncall_solver_runs_total{solver="random",result="ok"}' in text
+        assert "oncall_solver_attempts_total" in text
+        assert 'oncall_db_query_seconds_count{op="list_surveys"}' in text
+        assert "oncall_csv_build_seconds_count" in text
+
+    def test_route_label_uses_path_template(self):
+        client.get("/api/surveys/nope")
+        text = client.get("/metrics").text
+        assert 'route="/api/surveys/{survey_id}",status="404"' in text
+        assert "/api/surveys/nope" not in text
+
+
+class TestSurveyList:
+    def test_paginated(self):
+        for i in range(3):
+            client.post("/api/surveys", data={
+                "title": f"p{i}", "year": 2032, "month": 1, "docs": "医師A",
+            })
+        first = client.get("/api/surveys", params={"limit": 2, "year": 2032, "month": 1}).json()
+        assert len(first["surveys"]) == 2
+        assert first["next_cursor"]
+        second = client.get("/api/surveys", params={
+            "limit": 2, "year": 2032, "month": 1, "cursor": first["next_cursor"],
+        }).json()
+        assert len(second["surveys"]) == 1
+        assert second["next_cursor"] is None
+
+    def test_bad_cursor_returns_422(self):
+        assert client.get("/api/surveys", params={"cursor": "x"}).status_code == 422
+
+    def test_limit_bounds(self):
+        assert client.get("/api/surveys", params={"limit": 0}).status_code == 422
+
+
+class TestSurveyResults:
+    def test_heatmap(self):
+        survey_id = client.post("/api/surveys", data={
+            "title": "h", "year": 2024, "month": 6, "docs": "医師A,医師B",
+        }).json()["id"]
+        client.post(f"/api/surveys/{survey_id}/responses", data={
+            "doctor": "医師A", "blocked": "2024-06-01|DAY,2024-06-03|NIGHT",
+        })
+        client.post(f"/api/surveys/{survey_id}/responses", data={
+            "doctor": "医師B", "blocked": "2024-06-01|DAY",
+        })
+        data = client.get(f"/api/surveys/{survey_id}/results").json()
+        assert data["heatmap"] == {"2024-06-01": {"DAY": 2}, "2024-06-03": {"NIGHT": 1}}
+        assert data["pending"] == []
+
+
+class TestBulkResponses:
+    def _survey(self, docs="医師A,医師B,医師C"):
+        return client.post("/api/surveys", data={
+            "title": "bulk", "year": 2024, "month": 6, "docs": docs,
+        }).json()["id"]
+
+    def test_json_bulk(self):
+        survey_id = self._survey()
+        res = client.post(f"/api/surveys/{survey_id}/responses/bulk", json={"responses": [
+            {"doctor": "医師A", "blocked": ["2024-06-01|DAY", "2024-06-02|NIGHT"]},
+            {"doctor": "医師B", "blocked": []},
+        ]})
+        assert res.status_code == 200
+        assert res.json() == {"ok": True, "doctors": 2, "count": 2}
+        data = client.get(f"/api/surveys/{survey_id}/results").json()
+        assert data["pending"] == ["医師C"]
+        assert data["heatmap"] == {"2024-06-01": {"DAY": 1}, "2024-06-02": {"NIGHT": 1}}
+
+    def test_csv_bulk(self):
+        survey_id = self._survey()
+        body = "doctor,date,tag\n医師A,2024-06-01,DAY\n医師A,2024-06-08,NIGHT\n医師B,,\n医師C,2024-06-01,DAY\n"
+        res = client.post(
+            f"/api/surveys/{survey_id}/responses/bulk",
+            files={"file": ("answers.csv", body.encode("utf-8-sig"), "text/csv")},
+        )
+        assert res.status_code == 200
+        assert res.json() == {"ok": True, "doctors": 3, "count": 3}
+        resp = client.get(f"/api/surveys/{survey_id}/responses/医師A").json()["response"]
+        assert resp["blocked"] == ["2024-06-01|DAY", "2024-06-08|NIGHT"]
+
+    def test_invalid_rows_write_nothing(self):
+        survey_id = self._survey()
+        res = client.post(f"/api/surveys/{survey_id}/responses/bulk", json={"responses": [
+            {"doctor": "医師A", "blocked": ["2024-06-01|DAY"]},
+            {"doctor": "誰か", "blocked": []},
+            {"doctor": "医師B", "blocked": ["2024-06-01|MORNING", "bad"]},
+        ]})
+        assert res.status_code == 422
+        assert len(res.json()["detail"]) == 3
+        assert client.get(f"/api/surveys/{survey_id}/results").json()["responses"] == []
+
+    def test_csv_requires_header(self):
+        survey_id = self._survey()
+        res = client.post(
+            f"/api/surveys/{survey_id}/responses/bulk",
+            files={"file": ("answers.csv", b"a,b\n1,2\n", "text/csv")},
+        )
+        assert res.status_code == 422
+
+    def test_unknown_survey(self):
+        res = client.post("/api/surveys/nope/responses/bulk", json={"responses": []})
+        assert res.status_code == 404
+
+
+class TestSurveySchedule:
+    def _survey(self, docs="医師A,医師B"):
+        survey_id = client.post("/api/surveys", data={
+            "title": "sched", "year": 2024, "month": 6, "docs": docs,
+        }).json()["id"]
+        client.post(f"/api/surveys/{survey_id}/responses", data={
+            "doctor": "医師A", "blocked": "2024-06-01|DAY,2024-06-03|DAY,2024-06-03|NIGHT",
+        })
+        return survey_id
+
+    def test_unavailable_built_from_responses(self):
+        from oncall_app import routes
+        survey_id = self._survey()
+        unavailable = routes._survey_unavailable(client.get(f"/api/surveys/{survey_id}").json())
+        d = _dt.date
+        # 平日 (6/3) の DAY は枠がないので入らない
+        assert unavailable == {
+            "医師A": {(d(2024, 6, 1), "WE_DAY"), (d(2024, 6, 3), "WD_NIGHT")},
+            "医師B": set(),
+        }
+        assert unavailable == routes._parse_unavail(
+            ["医師A", "医師B"], "医師A|2024-06-01|DAY,医師A|2024-06-03|DAY,医師A|2024-06-03|NIGHT",
+        )
+
+    def test_schedule_saved_for_download(self):
+        survey_id = self._survey()
+        assert client.get(f"/api/surveys/{survey_id}/schedule").status_code == 404
+        res = client.post(f"/api/surveys/{survey_id}/schedule")
+        assert res.status_code == 200
+        rows = res.json()["rows"]
+        assert len(rows) == 8
+        assert not any(r["Doctor"] == "医師A" and r["Date"] == "2024-06-01" and r["Shift"] == "日直" for r in rows)
+        saved = client.get(f"/api/surveys/{survey_id}/schedule").json()
+        assert saved["rows"] == rows
+        assert (saved["gap_lo"], saved["gap_hi"], saved["solver"]) == (5, 8, "random")
+        csv_res = client.get(f"/api/surveys/{survey_id}/schedule/csv")
+        assert csv_res.headers["content-type"].startswith("text/csv")
+        assert csv_res.content.decode("utf-8-sig").count("\n") == 9
+        client.delete(f"/api/surveys/{survey_id}")
+        assert client.get(f"/api/surveys/{survey_id}/schedule/csv").status_code == 404
+
+    def test_prev_survey_carries_gap(self):
+        june = self._survey("医師A,医師B,医師C")
+        last = {}
+        for r in client.post(f"/api/surveys/{june}/schedule").json()["rows"]:
+            last[r["Doctor"]] = max(last.get(r["Doctor"], ""), r["Date"])
+        july = client.post("/api/surveys", data={
+            "title": "sched", "year": 2024, "month": 7, "docs": "医師A,医師B,医師C",
+        }).json()["id"]
+        for res in (
+            client.post("/api/schedule", data={
+                "year": 2024, "month": 7, "docs": "医師A,医師B,医師C", "gap_lo": 5, "gap_hi": 8,
+                "prev_survey": june,
+            }),
+            client.post(f"/api/surveys/{july}/schedule", data={"prev_survey": june}),
+        ):
+            assert res.status_code == 200
+            for r in res.json()["rows"]:
+                gap = (_dt.date.fromisoformat(r["Date"]) - _dt.date.fromisoformat(last[r["Doctor"]])).days
+                assert gap >= 5
+        assert client.post(f"/api/surveys/{july}/schedule", data={"prev_survey": "nope"}).status_code == 404
+
+    def test_stream(self):
+        survey_id = self._survey()
+        res = client.post(f"/api/surveys/{survey_id}/schedule/stream", data={"gap_lo": 5, "gap_hi": 8})
+        assert res.headers["content-type"].startswith("text/event-stream")
+        payload = json.loads(res.text.strip().splitlines()[-1][len("data: "):])
+        assert client.get(f"/api/surveys/{survey_id}/schedule").json()["rows"] == payload["rows"]
+
+    def test_error_and_unknown(self):
+        survey_id = self._survey()
+        res = client.post(f"/api/surveys/{survey_id}/schedule", data={"gap_lo": 11, "gap_hi": 12, "time_budget": 0.2})
+        assert res.status_code == 422
+        assert client.get(f"/api/surveys/{survey_id}/schedule").status_code == 404
+        assert client.post("/api/surveys/nope/schedule").status_code == 404
@@ -0,0 +1,261 @@
+import uuid
+
+from oncall_app import db
+
+db.init_db()
+
+
+class TestCsvTokens:
+    def test_roundtrip_in_chunks(self):
+        tok = uuid.uuid4().hex
+        body = ("Date,Shift,Doctor\n" * 1000).encode("utf-8-sig")
+        db.put_csv_token(tok, body, ttl=60, max_items=100)
+        chunks = list(db.open_csv_token(tok, ttl=60, chunk_size=1024))
+        assert len(chunks) > 1
+        assert b"".join(chunks) == body
+
+    def test_unknown_token(self):
+        assert db.open_csv_token("nope", ttl=60) is None
+
+    def test_expired_token(self):
+        tok = uuid.uuid4().hex
+        db.put_csv_token(tok, b"x", ttl=60, max_items=100)
+        assert db.open_csv_token(tok, ttl=-1) is None
+
+    def test_size_eviction_keeps_newest(self):
+        toks = [uuid.uuid4().hex for _ in range(4)]
+        for t in toks:
+            db.put_csv_token(t, t.encode(), ttl=60, max_items=2)
+        assert db.open_csv_token(toks[0], ttl=60) is None
+        assert db.open_csv_token(toks[1], ttl=60) is None
+        assert b"".join(db.open_csv_token(toks[3], ttl=60)) == toks[3].encode()
+
+
+class TestConnections:
+    def test_wal_enabled(self):
+        assert db._connect().execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+
+    def test_connection_reused_per_thread(self):
+        import threading
+        assert db._connect() is db._connect()
+        other = []
+        t = threading.Thread(target=lambda: other.append(db._connect()))
+        t.start()
+        t.join()
+        assert other[0] is not db._connect()
+
+    def test_failed_write_rolls_back(self):
+        survey_id = uuid.uuid4().hex[:12]
+        try:
+            with db._write() as conn:
+                conn.execute(
+                    "INSERT INTO surveys (id, title, year, month, docs, created_at) "
+                    "VALUES (?, 't', 2024, 6, '[]', 'x')",
+                    (survey_id,),
+                )
+                raise RuntimeError
+        except RuntimeError:
+            pass
+        assert db.get_survey(survey_id) is None
+
+    def test_concurrent_upserts(self):
+        from concurrent.futures import ThreadPoolExecutor
+        survey_id = uuid.uuid4().hex[:12]
+        doctors = [f"医師{i}" for i in range(40)]
+        db.create_survey(survey_id, "t", 2024, 6, doctors, 5, 8)
+
+        def submit(doc):
+            for n in range(5):
+                db.upsert_response(survey_id, doc, [f"2024-06-0{n + 1}|DAY"])
+
+        with ThreadPoolExecutor(max_workers=8) as ex:
+            list(ex.map(submit, doctors))
+        responses = db.list_responses(survey_id)
+        assert sorted(r["doctor"] for r in responses) == sorted(doctors)
+        assert all(r["blocked"] == ["2024-06-05|DAY"] for r in responses)
+
+
+class TestListSurveys:
+    def _create(self, year, month, n):
+        ids = []
+        for i in range(n):
+            survey_id = uuid.uuid4().hex[:12]
+            db.create_survey(survey_id, f"s{i}", year, month, ["医師A", "医師B"], 5, 8)
+            ids.append(survey_id)
+        return ids
+
+    def test_keyset_pages_cover_everything_once(self):
+        ids = self._create(2031, 1, 7)
+        seen, cursor = [], None
+        while True:
+            page, cursor = db.list_surveys(limit=3, cursor=cursor, year=2031, month=1)
+            seen += [s["id"] for s in page]
+            if cursor is None:
+                break
+        assert sorted(seen) == sorted(ids)
+        assert len(seen) == len(set(seen))
+
+    def test_newest_first(self):
+        self._create(2031, 2, 3)
+        page, _ = db.list_surveys(year=2031, month=2)
+        keys = [(s["created_at"], s["id"]) for s in page]
+        assert keys == sorted(keys, reverse=True)
+
+    def test_month_filter(self):
+        self._create(2031, 3, 2)
+        self._create(2031, 4, 1)
+        page, cursor = db.list_surveys(year=2031, month=3)
+        assert len(page) == 2 and cursor is None
+        assert all(s["month"] == 3 for s in page)
+
+    def test_bad_cursor(self):
+        import pytest
+        with pytest.raises(ValueError):
+            db.list_surveys(cursor="garbage")
+
+    def test_response_count_maintained(self):
+        (survey_id,) = self._create(2031, 5, 1)
+        db.upsert_response(survey_id, "医師A", [])
+        db.upsert_response(survey_id, "医師A", ["2031-05-03|DAY"])
+        db.upsert_response(survey_id, "医師B", [])
+        page, _ = db.list_surveys(year=2031, month=5)
+        assert page[0]["response_count"] == 2
+
+    def test_migration_backfills_response_count(self, tmp_path, monkeypatch):
+        import sqlite3
+        path = tmp_path / "old.db"
+        conn = sqlite3.connect(str(path))
+        conn.executescript(
+            """
+            CREATE TABLE surveys (
+                id TEXT PRIMARY KEY, title TEXT NOT NULL, year INTEGER NOT NULL,
+                month INTEGER NOT NULL, docs TEXT NOT NULL,
+                gap_lo INTEGER NOT NULL DEFAULT 5, gap_hi INTEGER NOT NULL DEFAULT 8,
+                created_at TEXT NOT NULL
+            );
+            CREATE TABLE survey_responses (
+                id INTEGER PRIMARY KEY AUTOINCREMENT, survey_id TEXT NOT NULL,
+                doctor TEXT NOT NULL, blocked TEXT NOT NULL, submitted_at TEXT NOT NULL
+            );
+            INSERT INTO surveys VALUES ('old', 't', 2024, 6, '["医師A","医師B"]', 5, 8, '2024-05-01T00:00:00');
+            INSERT INTO survey_responses (survey_id, doctor, blocked, submitted_at)
+                VALUES ('old', '医師A', '["2024-06-01|DAY","2024-06-03|NIGHT"]', '2024-05-02T00:00:00');
+            """
+        )
+        conn.commit()
+        conn.close()
+        monkeypatch.setattr(db, "_DB_PATH", path)
+        db.init_db()
+        page, _ = db.list_surveys()
+        assert page[0]["response_count"] == 1
+        assert db.get_response("old", "医師A")["blocked"] == ["2024-06-01|DAY", "2024-06-03|NIGHT"]
+        assert db.blocked_heatmap("old") == {"2024-06-01": {"DAY": 1}, "2024-06-03": {"NIGHT": 1}}
+        db.upsert_response("old", "医師B", [])
+        assert db.list_surveys()[0][0]["response_count"] == 2
+
+
+class TestBlockedSlots:
+    def _survey(self):
+        survey_id = uuid.uuid4().hex[:12]
+        db.create_survey(survey_id, "t", 2024, 6, ["医師A", "医師B", "医師C"], 5, 8)
+        return survey_id
+
+    def test_roundtrip_sorted_and_deduplicated(self):
+        survey_id = self._survey()
+        db.upsert_response(survey_id, "医師A", ["2024-06-03|NIGHT", "2024-06-01|DAY", "2024-06-01|DAY"])
+        assert db.get_response(survey_id, "医師A")["blocked"] == ["2024-06-01|DAY", "2024-06-03|NIGHT"]
+
+    def test_resubmit_replaces_slots(self):
+        survey_id = self._survey()
+        db.upsert_response(survey_id, "医師A", ["2024-06-01|DAY"])
+        db.upsert_response(survey_id, "医師A", ["2024-06-02|NIGHT"])
+        assert db.blocked_heatmap(survey_id) == {"2024-06-02": {"NIGHT": 1}}
+
+    def test_heatmap_counts_per_day_and_tag(self):
+        survey_id = self._survey()
+        db.upsert_response(survey_id, "医師A", ["2024-06-01|DAY", "2024-06-01|NIGHT"])
+        db.upsert_response(survey_id, "医師B", ["2024-06-01|DAY"])
+        db.upsert_response(survey_id, "医師C", [])
+        assert db.blocked_heatmap(survey_id) == {"2024-06-01": {"DAY": 2, "NIGHT": 1}}
+        responses = db.list_responses(survey_id)
+        assert [r["blocked"] for r in responses] == [["2024-06-01|DAY", "2024-06-01|NIGHT"], ["2024-06-01|DAY"], []]
+
+    def test_list_blocked_tuples(self):
+        survey_id = self._survey()
+        db.upsert_response(survey_id, "医師A", ["2024-06-01|DAY"])
+        db.upsert_response(survey_id, "医師B", ["2024-06-03|NIGHT"])
+        assert sorted(db.list_blocked(survey_id)) == [
+            ("医師A", "2024-06-01", "DAY"), ("医師B", "2024-06-03", "NIGHT"),
+        ]
+
+    def test_schedule_replaced_and_removed_with_survey(self):
+        survey_id = self._survey()
+        rows = [{"Date": "2024-06-01", "Shift": "日直", "Doctor": "医師A"}]
+        assert db.put_survey_schedule(survey_id, [], 5, 8, "random")
+        assert db.put_survey_schedule(survey_id, rows, 4, 9, "repair")
+        saved = db.get_survey_schedule(survey_id)
+        assert (saved["rows"], saved["gap_lo"], saved["solver"]) == (rows, 4, "repair")
+        db.delete_survey(survey_id)
+        assert db.get_survey_schedule(survey_id) is None
+        assert not db.put_survey_schedule(survey_id, rows, 5, 8, "random")
+
+    def test_slots_removed_with_survey(self):
+        survey_id = self._survey()
+        db.upsert_response(survey_id, "医師A", ["2024-06-01|DAY"])
+        db.delete_survey(survey_id)
+        assert db.blocked_heatmap(survey_id) == {}
+
+
+class TestSurveyResults:
+    def _survey(self):
+        survey_id = uuid.uuid4().hex[:12]
+        db.create_survey(survey_id, "t", 2024, 6, ["医師A", "医師B", "医師C"], 5, 8)
+        return survey_id
+
+    def test_matches_separate_queries(self):
+        survey_id = self._survey()
+        db.upsert_response(survey_id, "医師B", ["2024-06-03|NIGHT", "2024-06-01|DAY"])
+        db.upsert_response(survey_id, "医師A", ["2024-06-01|DAY"])
+        db.upsert_response(survey_id, "医師C", [])
+        results = db.get_survey_results(survey_id)
+        assert results["survey"] == db.get_survey(survey_id)
+        assert results["responses"] == db.list_responses(survey_id)
+        assert results["heatmap"] == db.blocked_heatmap(survey_id)
+        assert list(results["heatmap"]) == list(db.blocked_heatmap(survey_id))
+
+    def test_no_responses_and_unknown(self):
+        survey_id = self._survey()
+        assert db.get_survey_results(survey_id)["responses"] == []
+        assert db.get_survey_results("nope") is None
+
+    def test_cached_until_write(self, monkeypatch):
+        survey_id = self._survey()
+        db.upsert_response(survey_id, "医師A", ["2024-06-01|DAY"])
+        first = db.get_survey_results(survey_id)
+
+        def no_sqlite():
+            raise AssertionError("キャッシュから返るはず")
+
+        monkeypatch.setattr(db, "_connect", no_sqlite)
+        assert db.get_survey_results(survey_id) is first
+        monkeypatch.undo()
+        db.upsert_response(survey_id, "医師A", ["2024-06-02|NIGHT"])
+        assert db.get_survey_results(survey_id)["heatmap"] == {"2024-06-02": {"NIGHT": 1}}
+        db.upsert_responses(survey_id, {"医師B": ["2024-06-02|NIGHT"]})
+        assert db.get_survey_results(survey_id)["heatmap"] == {"2024-06-02": {"NIGHT": 2}}
+        db.delete_survey(survey_id)
+        assert db.get_survey_results(survey_id) is None
+
+    def test_write_during_read_is_not_cached(self, monkeypatch):
+        survey_id = self._survey()
+        load = db._load_results
+
+        def racing(sid):
+            out = load(sid)
+            db.upsert_response(sid, "医師A", ["2024-06-01|DAY"])
+            return out
+
+        monkeypatch.setattr(db, "_load_results", racing)
+        assert db.get_survey_results(survey_id)["responses"] == []
+        monkeypatch.undo()
+        assert [r["doctor"] for r in db.get_survey_results(survey_id)["responses"]] == ["医師A"]
@@ -0,0 +1,42 @@
+import datetime as _dt
+
+import pytest
+
+from oncall_app.holiday_utils import is_holiday, is_off_day, month_weeks, year_holidays
+
+
+class TestYearHolidays:
+    def test_matches_jpholiday(self):
+        jpholiday = pytest.importorskip("jpholiday")
+        day = _dt.date(2024, 1, 1)
+        while day.year < 2027:
+            assert is_holiday(day) == bool(jpholiday.is_holiday(day)), day
+            day += _dt.timedelta(days=1)
+
+    def test_memoized_per_year(self):
+        assert year_holidays(2025) is year_holidays(2025)
+
+    def test_golden_week(self):
+        pytest.importorskip("jpholiday")
+        assert is_holiday(_dt.date(2024, 5, 3))
+        assert is_holiday(_dt.date(2024, 5, 6))  # 振替休日
+        assert not is_holiday(_dt.date(2024, 5, 7))
+
+
+class TestIsOffDay:
+    def test_weekend(self):
+        assert is_off_day(_dt.date(2024, 6, 1))  # 土
+        assert is_off_day(_dt.date(2024, 6, 2))  # 日
+        assert not is_off_day(_dt.date(2024, 6, 3))  # 月
+
+
+class TestMonthWeeks:
+    def test_sunday_first_full_weeks(self):
+        weeks = month_weeks(2024, 6)
+        assert all(len(w) == 7 for w in weeks)
+        assert all(w[0].weekday() == 6 for w in weeks)
+        days = [d for w in weeks for d in w if d.month == 6]
+        assert days[0] == _dt.date(2024, 6, 1) and days[-1] == _dt.date(2024, 6, 30)
+
+    def test_memoized(self):
+        assert month_weeks(2024, 6) is month_weeks(2024, 6)
@@ -0,0 +1,76 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from oncall_app.jobs import JobQueue, QueueFull
+
+
+def _wait_done(q, job_id, timeout=5):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = q.get(job_id)
+        if job["status"] in ("done", "failed"):
+            return job
+        time.sleep(0.01)
+    raise AssertionError("job did not finish")
+
+
+class TestJobQueue:
+    def test_done_job_keeps_result(self):
+        q = JobQueue(workers=1)
+        job_id = q.submit(lambda a, b: a + b, 1, 2)
+        job = _wait_done(q, job_id)
+        assert job["status"] == "done"
+        assert job["result"] == 3
+        assert job["finished_at"] is not None
+
+    def test_failed_job_keeps_error(self):
+        def boom():
+            raise RuntimeError("だめ")
+        q = JobQueue(workers=1)
+        job = _wait_done(q, q.submit(boom))
+        assert job["status"] == "failed"
+        assert job["error"] == "だめ"
+
+    def test_unknown_job(self):
+        assert JobQueue(workers=1).get("nope") is None
+
+    def test_queue_depth_and_bound(self):
+        gate = threading.Event()
+        q = JobQueue(workers=1, max_queue=2)
+        running = q.submit(gate.wait)
+        while q.get(running)["status"] != "running":
+            time.sleep(0.01)
+        q.submit(gate.wait)
+        q.submit(gate.wait)
+        assert q.depth() == 2
+        assert q.stats() == {"workers": 1, "queued": 2, "running": 1, "max_queue": 2}
+        with pytest.raises(QueueFull):
+            q.submit(gate.wait)
+        gate.set()
+
+    def test_wait_does_not_block_event_loop(self):
+        gate = threading.Event()
+        q = JobQueue(workers=1)
+
+        async def main():
+            job_id = q.submit(lambda: gate.wait() and "ok")
+            ticks = 0
+            waiter = asyncio.ensure_future(q.wait(job_id))
+            while ticks < 5:
+                await asyncio.sleep(0.01)
+                ticks += 1
+            gate.set()
+            return ticks, await waiter
+
+        assert asyncio.run(main()) == (5, "ok")
+
+    def test_old_finished_jobs_are_pruned(self):
+        q = JobQueue(workers=1, keep=2)
+        ids = [q.submit(lambda: None) for _ in range(3)]
+        for i in ids:
+            _wait_done(q, i)
+        q.submit(lambda: None)
+        assert q.get(ids[0]) is None
@@ -0,0 +1,50 @@
+import pytest
+
+from oncall_app.metrics import Counter, Histogram, _registry, render
+
+
+@pytest.fixture
+def scratch():
+    # テスト用に作ったメトリクスは登録簿から外す
+    n = len(_registry)
+    yield
+    del _registry[n:]
+
+
+class TestCounter:
+    def test_inc_and_render(self, scratch):
+        c = Counter("t_total", "テスト", ("kind",))
+        c.inc(kind="a")
+        c.inc(2, kind="a")
+        c.inc(kind='b"x')
+        assert c.value(kind="a") == 3
+        lines = c.render()
+        assert lines[:2] == ["# HELP t_total テスト", "# TYPE t_total counter"]
+        assert 't_total{kind="a"} 3' in lines
+        assert 't_total{kind="b\\"x"} 1' in lines
+
+    def test_wrong_labels(self, scratch):
+        c = Counter("t2_total", "テスト", ("kind",))
+        with pytest.raises(ValueError):
+            c.inc(other="a")
+
+
+class TestHistogram:
+    def test_cumulative_buckets(self, scratch):
+        h = Histogram("t_seconds", "テスト", buckets=(0.1, 1.0))
+        for v in (0.05, 0.5, 0.5, 3.0):
+            h.observe(v)
+        lines = h.render()
+        assert 't_seconds_bucket{le="0.1"} 1' in lines
+        assert 't_seconds_bucket{le="1.0"} 3' in lines
+        assert 't_seconds_bucket{le="+Inf"} 4' in lines
+        assert "t_seconds_sum 4.05" in lines
+        assert "t_seconds_count 4" in lines
+        assert h.count() == 4
+
+    def test_time_context(self, scratch):
+        h = Histogram("t2_seconds", "テスト", ("op",))
+        with h.time(op="x"):
+            pass
+        assert h.count(op="x") == 1
+        assert 't2_seconds_count{op="x"} 1' in render()
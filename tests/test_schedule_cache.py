@@ -0,0 +1,73 @@
+import datetime as _dt
+
+from oncall_app import db
+from oncall_app.schedule_cache import ScheduleCache, canonical_key
+
+SAT = _dt.date(2024, 6, 1)
+SUN = _dt.date(2024, 6, 2)
+
+
+class TestCanonicalKey:
+    def test_order_independent(self):
+        a = canonical_key(2024, 6, ["医師A", "医師B"],
+                          {"医師A": {(SAT, "WE_DAY"), (SUN, "WE_NIGHT")}}, 5, 8, solver="random")
+        b = canonical_key(2024, 6, ["医師B", "医師A"],
+                          {"医師A": {(SUN, "WE_NIGHT"), (SAT, "WE_DAY")}, "医師B": set()}, 5, 8,
+                          solver="random")
+        assert a == b
+
+    def test_inputs_change_key(self):
+        base = canonical_key(2024, 6, ["医師A"], {}, 5, 8)
+        assert canonical_key(2024, 7, ["医師A"], {}, 5, 8) != base
+        assert canonical_key(2024, 6, ["医師A"], {}, 4, 8) != base
+        assert canonical_key(2024, 6, ["医師A"], {"医師A": {(SAT, "WE_DAY")}}, 5, 8) != base
+        assert canonical_key(2024, 6, ["医師A"], {}, 5, 8, solver="backtrack") != base
+
+
+class TestScheduleCache:
+    def test_hit_and_miss_counts(self):
+        c = ScheduleCache()
+        assert c.get("k") is None
+        c.put("k", {"error": "x"})
+        assert c.get("k") == {"error": "x"}
+        assert c.stats()["hits"] == 1
+        assert c.stats()["misses"] == 1
+
+    def test_lru_eviction(self):
+        c = ScheduleCache(maxsize=2)
+        c.put("a", {"error": "a"})
+        c.put("b", {"error": "b"})
+        c.get("a")
+        c.put("c", {"error": "c"})
+        assert c.get("b") is None
+        assert c.get("a") is not None
+        assert c.get("c") is not None
+
+    def test_persisted_across_instances(self):
+        rows = [{"Date": SAT, "Shift": "休日 日直", "Doctor": "医師A"}]
+        ScheduleCache(persist=True).put("persist-key", {"rows": rows})
+        fresh = ScheduleCache(persist=True)
+        assert fresh.get("persist-key") == {"rows": rows}
+        assert fresh.stats()["hits"] == 1
+
+    def test_memory_only_does_not_persist(self):
+        ScheduleCache().put("memory-key", {"error": "x"})
+        assert ScheduleCache(persist=True).get("memory-key") is None
+
+    def test_generic_error_not_persisted(self):
+        ScheduleCache(persist=True).put("generic-key", {"error": "NumPy がありません"})
+        assert db.get_cached_schedule("generic-key", ttl=60) is None
+
+    def test_unsolved_kept_in_memory_only(self):
+        c = ScheduleCache(persist=True)
+        c.put("unsolved-key", {"error": "x", "partial": [], "unfilled": []})
+        assert c.get("unsolved-key") is not None
+        assert db.get_cached_schedule("unsolved-key", ttl=60) is None
+
+    def test_persisted_pruned_by_count_and_age(self):
+        c = ScheduleCache(persist=True, persist_max=2)
+        for k in ("p1", "p2", "p3"):
+            c.put(k, {"error": k, "bottlenecks": []})
+        assert db.get_cached_schedule("p1", ttl=60) is None
+        assert db.get_cached_schedule("p3", ttl=60) is not None
+        assert ScheduleCache(persist=True, persist_ttl=-1).get("p3") is None
@@ -1,7 +1,29 @@
 import datetime as _dt
+import random
+import time
 import pytest
 
-from oncall_app.scheduler import generate_shift_slots, ok_gap, make_schedule
+from oncall_app import metrics
+from oncall_app.scheduler import (
+    REQUIRED,
+    SHIFT_JP,
+    Cancelled,
+    Infeasible,
+    Unsolved,
+    SlotIndex,
+    _complete,
+    _luby,
+    _schedule,
+    gap_feasible,
+    generate_shift_slots,
+    last_shifts,
+    make_department_schedule,
+    make_horizon_schedule,
+    make_schedule,
+    month_range,
+    ok_gap,
+    resolve_quotas,
+)
 
 
 class TestGenerateShiftSlots:
@@ -118,3 +140,525 @@ class TestMakeSchedule:
         unavail = {d: set() for d in doctors}
         with pytest.raises(RuntimeError):
             make_schedule(2024, 6, doctors, unavail)
+
+
+class TestGapFeasible:
+    def test_complete_sequence_matches_ok_gap(self):
+        dates = [_dt.date(2024, 6, 1), _dt.date(2024, 6, 7), _dt.date(2024, 6, 13)]
+        assert gap_feasible(dates, 0, lo=5, hi=8) is True
+
+    def test_wide_gap_needs_remaining_slot(self):
+        dates = [_dt.date(2024, 6, 1), _dt.date(2024, 6, 13)]  # 12 days
+        assert gap_feasible(dates, 0, lo=5, hi=8) is False
+        assert gap_feasible(dates, 1, lo=5, hi=8) is True
+
+    def test_gap_too_small_is_never_feasible(self):
+        dates = [_dt.date(2024, 6, 1), _dt.date(2024, 6, 3)]
+        assert gap_feasible(dates, 3, lo=5, hi=8) is False
+
+    def test_gap_unfillable_between_windows(self):
+        # 9 日: 1 枠では 8 を超え、2 分割すると 5 未満になる
+        dates = [_dt.date(2024, 6, 1), _dt.date(2024, 6, 10)]
+        assert gap_feasible(dates, 2, lo=5, hi=8) is False
+
+
+class TestSlotIndex:
+    def _index(self, doctors=("医師A",), unavail=None, lo=5, hi=8):
+        slots = generate_shift_slots(2024, 6)
+        return SlotIndex(slots, list(doctors), unavail or {}, lo, hi), slots
+
+    def test_allowed_matches_ok_gap(self):
+        rng = random.Random(0)
+        for lo, hi in [(5, 8), (3, 6), (0, 4), (2, 2)]:
+            idx, _ = self._index(lo=lo, hi=hi)
+            for _ in range(200):
+                picks = []
+                for _ in range(rng.randint(0, 4)):
+                    cand = [i for i in range(idx.n) if idx.allowed(picks) >> i & 1]
+                    if not cand:
+                        break
+                    picks = sorted(picks + [rng.choice(cand)])
+                dates = [idx.date(p) for p in picks]
+                expected = {i for i in range(idx.n) if ok_gap(dates + [idx.date(i)], lo, hi)}
+                got = {i for i in range(idx.n) if idx.allowed(picks) >> i & 1}
+                assert got == expected
+
+    def test_avail_excludes_blocked(self):
+        sat = _dt.date(2024, 6, 1)
+        idx, slots = self._index(unavail={"医師A": {(sat, "WE_DAY")}})
+        assert not idx.avail["医師A"][((2024, 6), "WE_DAY")] >> idx.num(sat) & 1
+        assert idx.avail["医師A"][((2024, 6), "WE_NIGHT")] >> idx.num(sat) & 1
+        assert bin(idx.stock[((2024, 6), "WD_NIGHT")]).count("1") == sum(
+            1 for _, t in slots if t == "WD_NIGHT"
+        )
+
+    def test_history_clears_early_days(self):
+        idx, _ = self._index(doctors=("医師A",))
+        slots = generate_shift_slots(2024, 6)
+        hist = SlotIndex(slots, ["医師A"], {}, 5, 8, history={"医師A": _dt.date(2024, 5, 30)})
+        for c, m in hist.avail["医師A"].items():
+            assert m == idx.avail["医師A"][c] >> 3 << 3  # 6/1〜6/3 は gap_lo 未満
+
+
+class TestBacktrackSolver:
+    def _make(self, doctors, unavail=None, **kw):
+        if unavail is None:
+            unavail = {d: set() for d in doctors}
+        return make_schedule(2024, 6, doctors, unavail, solver="backtrack", **kw)
+
+    def test_same_row_shape_as_random(self):
+        doctors = ["医師A", "医師B", "医師C"]
+        rows = self._make(doctors)
+        ref = make_schedule(2024, 6, doctors, {d: set() for d in doctors})
+        assert len(rows) == len(ref)
+        assert all(set(r.keys()) == {"Date", "Shift", "Doctor"} for r in rows)
+        keys = [(r["Date"], r["Shift"]) for r in rows]
+        assert keys == sorted(keys)
+
+    def test_constraints_hold(self):
+        doctors = ["医師A", "医師B", "医師C", "医師D"]
+        slots = generate_shift_slots(2024, 6)
+        unavail = {d: {s for k, s in enumerate(slots) if (k + i) % 3 == 0} for i, d in enumerate(doctors)}
+        rows = self._make(doctors, {d: set(v) for d, v in unavail.items()})
+        from collections import Counter, defaultdict
+        assert Counter(r["Doctor"] for r in rows) == {d: 4 for d in doctors}
+        shift_en = {v: k for k, v in SHIFT_JP.items()}
+        by_doc = defaultdict(list)
+        for r in rows:
+            assert (r["Date"], shift_en[r["Shift"]]) not in unavail[r["Doctor"]]
+            by_doc[r["Doctor"]].append(r["Date"])
+        assert all(ok_gap(v) for v in by_doc.values())
+        assert len({(r["Date"], r["Shift"]) for r in rows}) == len(rows)
+
+    def test_deterministic_for_seed(self):
+        doctors = ["医師A", "医師B", "医師C"]
+        assert self._make(doctors, seed=7) == self._make(doctors, seed=7)
+
+    def test_finds_schedule_where_random_gives_up(self):
+        # 7 名 / 約半分の枠が NG: 同じ試行回数 (行き止まりの数) で乱択再始動は見つけられない
+        doctors = [f"医師{i}" for i in range(7)]
+        slots = generate_shift_slots(2024, 6)
+        rng = random.Random(1)
+        unavail = {d: {s for s in slots if rng.random() < 0.5} for d in doctors}
+        with pytest.raises(RuntimeError):
+            make_schedule(2024, 6, doctors, {d: set(v) for d, v in unavail.items()},
+                          attempts=1000, gap_lo=4, gap_hi=7)
+        rows = self._make(doctors, {d: set(v) for d, v in unavail.items()},
+                          attempts=1000, gap_lo=4, gap_hi=7)
+        assert len(rows) == 28
+
+    def test_luby_cutoffs(self):
+        assert [_luby(i) for i in range(1, 16)] == [1, 1, 2, 1, 1, 2, 4, 1, 1, 2, 1, 1, 2, 4, 8]
+
+    def test_raises_when_all_blocked(self):
+        doctors = ["医師A", "医師B"]
+        slots = generate_shift_slots(2024, 6)
+        unavail = {"医師A": {s for s in slots if s[1] == "WE_DAY"}, "医師B": set()}
+        with pytest.raises(RuntimeError):
+            self._make(doctors, unavail)
+
+    @pytest.mark.parametrize("solver", ["random", "backtrack", "repair"])
+    def test_stats_reports_attempts(self, solver):
+        stats: dict = {}
+        make_schedule(2024, 6, ["医師A", "医師B"], {}, solver=solver, stats=stats)
+        assert 0 <= stats["attempts"] <= 30000
+        # 間隔 11 日以上で 4 枠は 6 月に収まらない (事前チェックは通り、探索で行き詰まる)
+        with pytest.raises(RuntimeError):
+            make_schedule(2024, 6, ["医師A", "医師B"], {}, solver=solver, attempts=50,
+                          gap_lo=11, gap_hi=12, stats=stats)
+        assert 0 < stats["attempts"] <= 50
+        assert sum(stats["failures"].values()) >= 1
+
+    def test_progress_and_stop(self):
+        seen = []
+
+        def progress(attempts, depth):
+            seen.append((attempts, depth))
+
+        with pytest.raises(Cancelled):
+            make_schedule(2024, 6, ["医師A", "医師B"], {}, gap_lo=11, gap_hi=12,
+                          stop=lambda: len(seen) >= 3, progress=progress)
+        assert [a for a, _ in seen] == [100, 200, 300]
+        assert all(0 <= d < 8 for _, d in seen)
+
+    def test_backtrack_stops_at_dead_end(self):
+        stats: dict = {}
+        with pytest.raises(Cancelled):
+            make_schedule(2024, 6, ["医師A", "医師B"], {}, solver="backtrack", gap_lo=11, gap_hi=12,
+                          stop=lambda: True, stats=stats)
+        assert stats["attempts"] == 1
+
+    def test_unknown_solver(self):
+        with pytest.raises(ValueError):
+            make_schedule(2024, 6, ["医師A"], {}, solver="nope")
+
+
+def _assert_valid(rows, doctors, unavail, lo=5, hi=8, per_doc=4):
+    """各医師の枠数・枠の重複・入れない日・月ごとの間隔を確かめる"""
+    from collections import Counter, defaultdict
+    assert Counter(r["Doctor"] for r in rows) == {d: per_doc for d in doctors}
+    assert len({(r["Date"], r["Shift"]) for r in rows}) == len(rows)
+    shift_en = {v: k for k, v in SHIFT_JP.items()}
+    by_doc = defaultdict(list)
+    for r in rows:
+        assert (r["Date"], shift_en[r["Shift"]]) not in unavail.get(r["Doctor"], set())
+        by_doc[(r["Doctor"], r["Date"].month)].append(r["Date"])
+    assert all(ok_gap(v, lo, hi) for v in by_doc.values())
+
+
+class TestRepairSolver:
+    def test_constraints_hold_where_random_gives_up(self):
+        doctors = [f"医師{i}" for i in range(7)]
+        slots = generate_shift_slots(2024, 6)
+        rng = random.Random(1)
+        unavail = {d: {s for s in slots if rng.random() < 0.5} for d in doctors}
+        with pytest.raises(RuntimeError):
+            make_schedule(2024, 6, doctors, {d: set(v) for d, v in unavail.items()},
+                          attempts=200, gap_lo=4, gap_hi=7)
+        stats: dict = {}
+        rows = make_schedule(2024, 6, doctors, {d: set(v) for d, v in unavail.items()}, solver="repair",
+                             attempts=5000, gap_lo=4, gap_hi=7, stats=stats)
+        _assert_valid(rows, doctors, unavail, 4, 7)
+        assert 0 < stats["states"]
+
+    def test_fewer_states_than_restarting(self):
+        doctors = [f"医師{i}" for i in range(7)]
+        slots = generate_shift_slots(2024, 5)
+        rng = random.Random(2)
+        unavail = {d: {s for s in slots if rng.random() < 0.15} for d in doctors}
+        used = {}
+        for solver in ("random", "repair"):
+            stats: dict = {}
+            make_schedule(2024, 5, doctors, {d: set(v) for d, v in unavail.items()}, solver=solver,
+                          gap_lo=4, gap_hi=7, stats=stats)
+            used[solver] = stats["states"]
+        assert used["repair"] * 3 < used["random"]
+
+    def test_deterministic_for_seed(self):
+        doctors = ["医師A", "医師B", "医師C", "医師D"]
+        run = lambda: make_schedule(2024, 6, doctors, {}, solver="repair", seed=3)  # noqa: E731
+        assert run() == run()
+
+    def test_history_and_multi_month(self):
+        doctors = ["医師A", "医師B", "医師C"]
+        hist = {"医師A": _dt.date(2024, 5, 30)}
+        rows = _schedule(month_range(2024, 6, 3), doctors, {}, 30000, 1, 5, 8, "repair", 1, hist)
+        _assert_valid(rows, doctors, {}, per_doc=12)
+        mine = sorted(r["Date"] for r in rows if r["Doctor"] == "医師A")
+        assert mine[0] >= _dt.date(2024, 6, 4)
+        assert all(b - a >= _dt.timedelta(days=5) for a, b in zip(mine, mine[1:]))
+
+    def test_partial_keeps_only_valid_doctors(self):
+        stats: dict = {}
+        with pytest.raises(Unsolved):
+            make_schedule(2024, 6, ["医師A", "医師B"], {}, solver="repair", attempts=300,
+                          gap_lo=11, gap_hi=12, stats=stats)
+        assert stats["attempts"] == 300
+        assert sum(stats["failures"].values()) == 300
+        assert stats["depth"] == sum(len(v) for v in stats["partial"].values()) == 0
+
+    def test_progress_and_stop(self):
+        seen = []
+        with pytest.raises(Cancelled):
+            make_schedule(2024, 6, ["医師A", "医師B"], {}, solver="repair", gap_lo=11, gap_hi=12,
+                          stop=lambda: len(seen) >= 2, progress=lambda a, d: seen.append(a))
+        assert seen == [100, 200]
+
+
+class TestNumpySolver:
+    @pytest.fixture(autouse=True)
+    def _numpy(self):
+        pytest.importorskip("numpy")
+
+    def test_constraints_hold(self):
+        doctors = [f"医師{i}" for i in range(5)]
+        slots = generate_shift_slots(2024, 6)
+        rng = random.Random(3)
+        unavail = {d: {s for s in slots if rng.random() < 0.2} for d in doctors}
+        rows = make_schedule(2024, 6, doctors, {d: set(v) for d, v in unavail.items()}, solver="numpy",
+                             gap_lo=4, gap_hi=7)
+        _assert_valid(rows, doctors, unavail, 4, 7)
+
+    def test_deterministic_for_seed(self):
+        doctors = ["医師A", "医師B", "医師C"]
+        run = lambda: make_schedule(2024, 6, doctors, {}, solver="numpy", seed=7)  # noqa: E731
+        assert run() == run()
+
+    def test_history_and_multi_month(self):
+        doctors = ["医師A", "医師B", "医師C"]
+        hist = {"医師A": _dt.date(2024, 5, 30)}
+        rows = _schedule(month_range(2024, 6, 2), doctors, {}, 30000, 1, 5, 8, "numpy", 1, hist)
+        _assert_valid(rows, doctors, {}, per_doc=8)
+        mine = sorted(r["Date"] for r in rows if r["Doctor"] == "医師A")
+        assert mine[0] >= _dt.date(2024, 6, 4)
+        assert all(b - a >= _dt.timedelta(days=5) for a, b in zip(mine, mine[1:]))
+
+    def test_stats_and_partial(self):
+        stats: dict = {}
+        with pytest.raises(Unsolved) as e:
+            make_schedule(2024, 6, ["医師A", "医師B"], {}, solver="numpy", attempts=1000,
+                          gap_lo=11, gap_hi=12, stats=stats)
+        assert stats["attempts"] == 1000
+        assert sum(stats["failures"].values()) >= 1000
+        assert 0 < stats["depth"] < 8
+        assert sum(len(v) for v in stats["partial"].values()) == stats["depth"]
+        assert e.value.unfilled
+
+    def test_progress_and_stop(self):
+        seen = []
+        with pytest.raises(Cancelled):
+            make_schedule(2024, 6, ["医師A", "医師B"], {}, solver="numpy", gap_lo=11, gap_hi=12,
+                          stop=lambda: len(seen) >= 2, progress=lambda a, d: seen.append(a))
+        assert seen == [256, 256 + 512]
+
+
+class TestPrecheck:
+    def test_same_weekend_blocked_rejected_fast(self):
+        doctors = ["医師A", "医師B", "医師C", "医師D"]
+        slots = generate_shift_slots(2024, 6)
+        # 全員が 6 月の土日祝の日直に 6/1・6/2 以外入れない
+        unavail = {d: {s for s in slots if s[1] == "WE_DAY" and s[0].day > 2} for d in doctors}
+        stats: dict = {}
+        with pytest.raises(Infeasible) as ei:
+            make_schedule(2024, 6, doctors, unavail, stats=stats)
+        assert "attempts" not in stats
+        (b,) = ei.value.bottlenecks
+        assert b["type"] == "WE_DAY" and b["need"] == 4
+        assert b["dates"] == ["2024-06-01", "2024-06-02"]
+        assert b["doctors"] == sorted(doctors)
+        assert "6/1・6/2" in str(ei.value)
+
+    def test_doctor_without_options(self):
+        slots = generate_shift_slots(2024, 6)
+        unavail = {"医師A": {s for s in slots if s[1] == "WD_NIGHT"}}
+        with pytest.raises(Infeasible) as ei:
+            make_schedule(2024, 6, ["医師A", "医師B"], unavail)
+        (b,) = ei.value.bottlenecks
+        assert b["doctors"] == ["医師A"] and b["dates"] == [] and b["need"] == 2
+        assert "入れる日がありません" in str(ei.value)
+
+    def test_history_counts_as_blocked(self):
+        slots = generate_shift_slots(2024, 6)
+        # 6/5 以降は 6/8 (土) しか日直に入れないが、前月末勤務で 6/8 も間隔不足
+        unavail = {"医師A": {s for s in slots if s[1] == "WE_DAY" and s[0].day != 8}}
+        with pytest.raises(Infeasible):
+            make_schedule(2024, 6, ["医師A"], unavail, history={"医師A": _dt.date(2024, 6, 4)})
+
+    def test_feasible_input_passes(self):
+        rows = make_schedule(2024, 6, ["医師A", "医師B", "医師C"], {})
+        assert len(rows) == 12
+
+
+class TestTimeBudget:
+    # 7 人・間隔 6〜7 日は枠が足りていても探索ではまず埋まらない
+    DOCS = [f"医師{i}" for i in range(7)]
+
+    @pytest.mark.parametrize("solver", ["random", "backtrack"])
+    def test_budget_returns_partial(self, solver):
+        t0 = time.perf_counter()
+        with pytest.raises(Unsolved) as ei:
+            make_schedule(2024, 6, self.DOCS, {}, solver=solver, gap_lo=6, gap_hi=7, time_budget=0.1)
+        assert time.perf_counter() - t0 < 1.0
+        e = ei.value
+        assert "制限時間" in str(e)
+        assert len(e.rows) + len(e.unfilled) == 4 * len(self.DOCS)
+        assert len({(r["Date"], r["Shift"]) for r in e.rows}) == len(e.rows)
+        for u in e.unfilled:
+            assert u["type"] in REQUIRED and u["shift"] == SHIFT_JP[u["type"]]
+            assert all(b["reason"] in ("unavailable", "history", "gap") for b in u["blocked"])
+
+    def test_complete_reports_reasons(self):
+        slots = generate_shift_slots(2024, 6)
+        sat = _dt.date(2024, 6, 1)
+        cat = ((2024, 6), "WE_DAY")
+        # 医師A が入れる日直は 6/1 と 6/2 だけ。6/1 は医師B が埋めていて、6/2 は前月末勤務から近すぎる
+        unavail = {"医師A": {s for s in slots if s[1] == "WE_DAY" and s[0].day > 2}}
+        rows, unfilled = _complete(
+            {"医師B": [(sat, "WE_DAY")]}, slots, {"医師A": [cat], "医師B": [cat]}, unavail, 5, 8,
+            {"医師A": _dt.date(2024, 5, 30)},
+        )
+        assert rows == [{"Date": sat, "Shift": SHIFT_JP["WE_DAY"], "Doctor": "医師B"}]
+        (u,) = unfilled
+        assert u["doctor"] == "医師A" and u["type"] == "WE_DAY"
+        reasons = {b["date"]: b["reason"] for b in u["blocked"]}
+        assert reasons.pop("2024-06-02") == "history"
+        assert set(reasons.values()) == {"unavailable"} and "2024-06-01" not in reasons
+
+    def test_attempts_exhausted_also_reports(self):
+        with pytest.raises(Unsolved) as ei:
+            make_schedule(2024, 6, ["医師A", "医師B"], {}, gap_lo=11, gap_hi=12, attempts=20)
+        assert str(ei.value) == "条件を満たす組み合わせが見つかりませんでした。"
+        assert ei.value.unfilled
+        assert {b["reason"] for u in ei.value.unfilled for b in u["blocked"]} <= {"gap"}
+
+
+class TestParallelSearch:
+    def _args(self):
+        doctors = ["医師A", "医師B", "医師C", "医師D"]
+        slots = generate_shift_slots(2024, 6)
+        rng = random.Random(3)
+        unavail = {d: {s for s in slots if rng.random() < 0.3} for d in doctors}
+        return doctors, unavail
+
+    def test_reproducible_for_seed_and_workers(self):
+        doctors, unavail = self._args()
+        a = make_schedule(2024, 6, doctors, {d: set(v) for d, v in unavail.items()}, workers=2, seed=5)
+        b = make_schedule(2024, 6, doctors, {d: set(v) for d, v in unavail.items()}, workers=2, seed=5)
+        assert a == b
+
+    def test_lowest_successful_worker_wins(self):
+        # ワーカー 0 は逐次版と同じシード・同じ持ち分で探索する
+        doctors, unavail = self._args()
+        par = make_schedule(2024, 6, doctors, {d: set(v) for d, v in unavail.items()},
+                            workers=3, attempts=3000, seed=9)
+        seq = make_schedule(2024, 6, doctors, {d: set(v) for d, v in unavail.items()},
+                            attempts=1000, seed=9)
+        assert par == seq
+
+    def test_parallel_backtrack(self):
+        doctors, unavail = self._args()
+        rows = make_schedule(2024, 6, doctors, unavail, workers=2, solver="backtrack")
+        assert len(rows) == 16
+
+    def test_stats_sums_worker_attempts(self):
+        stats: dict = {}
+        with pytest.raises(RuntimeError):
+            make_schedule(2024, 6, ["医師A", "医師B"], {}, workers=2, attempts=200,
+                          gap_lo=11, gap_hi=12, stats=stats)
+        assert stats["attempts"] == 200
+
+    def test_parallel_raises_when_impossible(self):
+        doctors = ["医師A", "医師B"]
+        slots = generate_shift_slots(2024, 6)
+        unavail = {"医師A": {s for s in slots if s[1] == "WE_DAY"}}
+        with pytest.raises(RuntimeError):
+            make_schedule(2024, 6, doctors, unavail, workers=2, attempts=200)
+
+
+class TestHorizon:
+    DOCS = ["医師A", "医師B", "医師C", "医師D"]
+
+    def test_month_range_wraps_year(self):
+        assert month_range(2024, 11, 3) == [(2024, 11), (2024, 12), (2025, 1)]
+
+    @pytest.mark.parametrize("solver", ["random", "backtrack"])
+    def test_rows_and_gaps_across_months(self, solver):
+        rows = make_horizon_schedule(2024, 6, 3, self.DOCS, {}, solver=solver)
+        assert len(rows) == 4 * len(self.DOCS) * 3
+        for doc in self.DOCS:
+            dates = sorted(r["Date"] for r in rows if r["Doctor"] == doc)
+            assert all((b - a).days >= 5 for a, b in zip(dates, dates[1:]))
+            for m in (6, 7, 8):
+                month = [d for d in dates if d.month == m]
+                assert len(month) == 4 and ok_gap(month, 5, 8)
+
+    @pytest.mark.parametrize("solver", ["random", "backtrack"])
+    def test_joint_search(self, solver):
+        # 月ごとの逐次探索が行き詰まったときに使う、期間全体をまとめた探索
+        rows = _schedule(month_range(2024, 6, 2), self.DOCS, {}, 30000, 42, 5, 8, solver, 1, None)
+        assert len(rows) == 4 * len(self.DOCS) * 2
+        for doc in self.DOCS:
+            dates = sorted(r["Date"] for r in rows if r["Doctor"] == doc)
+            assert all((b - a).days >= 5 for a, b in zip(dates, dates[1:]))
+            assert ok_gap([d for d in dates if d.month == 7], 5, 8)
+
+    def test_history_respected(self):
+        hist = {d: _dt.date(2024, 5, 31) for d in self.DOCS[:2]}
+        rows = make_schedule(2024, 6, self.DOCS, {}, solver="backtrack", history=hist)
+        for r in rows:
+            if r["Doctor"] in hist:
+                assert r["Date"] >= _dt.date(2024, 6, 5)
+
+    def test_history_respected_random(self):
+        hist = {"医師A": _dt.date(2024, 5, 31)}
+        rows = make_schedule(2024, 6, self.DOCS, {}, history=hist)
+        assert min(r["Date"] for r in rows if r["Doctor"] == "医師A") >= _dt.date(2024, 6, 5)
+
+    def test_last_shifts(self):
+        rows = make_schedule(2024, 6, self.DOCS, {})
+        last = last_shifts([dict(r, Date=r["Date"].isoformat()) for r in rows])
+        assert last == {d: max(r["Date"] for r in rows if r["Doctor"] == d) for d in self.DOCS}
+
+    def test_invalid_months(self):
+        with pytest.raises(ValueError):
+            make_horizon_schedule(2024, 6, 0, self.DOCS, {})
+
+
+class TestQuotas:
+    def test_resolve_order(self):
+        q = resolve_quotas(
+            ["医師A", "医師B", "医師C"],
+            quotas={"医師A": {"WD_NIGHT": 3}},
+            groups={"非常勤": {"doctors": ["医師A", "医師B"], "quota": {"WE_DAY": 0, "WD_NIGHT": 1}}},
+        )
+        assert q["医師A"] == {"WE_DAY": 0, "WE_NIGHT": 1, "WD_NIGHT": 3}
+        assert q["医師B"] == {"WE_DAY": 0, "WE_NIGHT": 1, "WD_NIGHT": 1}
+        assert q["医師C"] == REQUIRED
+
+    @pytest.mark.parametrize("quotas", [
+        {"医師Z": {"WE_DAY": 1}},
+        {"医師A": {"XX": 1}},
+        {"医師A": {"WE_DAY": -1}},
+        {"医師A": {"WE_DAY": 1.5}},
+    ])
+    def test_invalid(self, quotas):
+        with pytest.raises(ValueError):
+            resolve_quotas(["医師A"], quotas)
+
+    def test_roster_larger_than_default_supply(self):
+        # 既定の 4 枠では 6 月の休日の枠が足りない人数でも、枠数を減らせば作れる
+        doctors = [f"医師{i}" for i in range(12)]
+        with pytest.raises(RuntimeError, match="枠が不足"):
+            make_schedule(2024, 6, doctors, {})
+        quotas = {d: {"WE_DAY": 0, "WE_NIGHT": 0, "WD_NIGHT": 1} for d in doctors[:6]}
+        rows = make_schedule(2024, 6, doctors, {}, solver="repair", quotas=quotas)
+        from collections import Counter
+        count = Counter(r["Doctor"] for r in rows)
+        assert count == {d: 1 if d in quotas else 4 for d in doctors}
+        assert len({(r["Date"], r["Shift"]) for r in rows}) == len(rows)
+
+    @pytest.mark.parametrize("solver", ["random", "backtrack", "repair"])
+    def test_solvers_follow_quota(self, solver):
+        doctors = ["医師A", "医師B", "医師C"]
+        quotas = {"医師A": {"WD_NIGHT": 3}, "医師B": {"WE_DAY": 0, "WE_NIGHT": 0}}
+        rows = make_schedule(2024, 6, doctors, {}, solver=solver, quotas=quotas)
+        shift_en = {v: k for k, v in SHIFT_JP.items()}
+        for doc, q in resolve_quotas(doctors, quotas).items():
+            mine = [shift_en[r["Shift"]] for r in rows if r["Doctor"] == doc]
+            assert {tp: mine.count(tp) for tp in REQUIRED} == q
+            assert ok_gap([r["Date"] for r in rows if r["Doctor"] == doc])
+
+
+class TestDepartment:
+    WARDS = {f"病棟{w}": [f"病棟{w}-{i}" for i in range(6)] for w in range(3)}
+
+    def test_each_ward_solved_independently(self):
+        out = make_department_schedule(2024, 6, self.WARDS, {}, workers=1, solver="repair")
+        assert set(out) == set(self.WARDS)
+        for name, rows in out.items():
+            _assert_valid(rows, self.WARDS[name], {})
+
+    def test_parallel_matches_sequential(self):
+        groups = {"非常勤": {"doctors": ["病棟0-0", "病棟2-5"], "quota": {"WE_DAY": 0, "WD_NIGHT": 1}}}
+        seq = make_department_schedule(2024, 6, self.WARDS, {}, groups=groups, workers=1, solver="repair")
+        par = make_department_schedule(2024, 6, self.WARDS, {}, groups=groups, workers=2, solver="repair")
+        assert par == seq
+        assert sum(1 for r in par["病棟0"] if r["Doctor"] == "病棟0-0") == 2
+
+    def test_parallel_records_metrics_in_parent(self):
+        before = metrics.solver_runs.value(solver="repair", result="ok")
+        make_department_schedule(2024, 6, self.WARDS, {}, workers=2, solver="repair")
+        assert metrics.solver_runs.value(solver="repair", result="ok") == before + len(self.WARDS)
+
+    def test_doctor_in_two_wards(self):
+        with pytest.raises(ValueError):
+            make_department_schedule(2024, 6, {"A": ["医師A"], "B": ["医師A"]}, {})
+
+    @pytest.mark.parametrize("workers", [1, 2])
+    def test_failure_names_ward(self, workers):
+        slots = generate_shift_slots(2024, 6)
+        blocked = {"B-0": {s for s in slots if s[1] == "WE_DAY"}}
+        with pytest.raises(Infeasible) as e:
+            make_department_schedule(2024, 6, {"A": ["A-0"], "B": ["B-0", "B-1"]}, blocked, workers=workers)
+        assert e.value.ward == "B"
+        assert e.value.bottlenecks[0]["doctors"] == ["B-0"]